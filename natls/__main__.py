@@ -32,7 +32,7 @@ import logging
 import logging.config
 import sys
 
-from .lang_server import start_io_lang_server, start_tcp_lang_server, LanguageServer
+from . import shim
 
 LOG_FORMAT = "%(asctime)s UTC - %(levelname)s - %(name)s - %(message)s"
 
@@ -40,10 +40,26 @@ LOG_FORMAT = "%(asctime)s UTC - %(levelname)s - %(name)s - %(message)s"
 def _add_arguments(parser):
     parser.description = "Python Language Server"
 
-    parser.add_argument(
+    transport_group = parser.add_mutually_exclusive_group()
+    transport_group.add_argument(
         "--tcp", action="store_true",
         help="Use TCP server instead of stdio"
     )
+    transport_group.add_argument(
+        "--socket", metavar="PATH",
+        help="Use a Unix domain socket server at this path instead of stdio. "
+             "Only the current user can connect to it."
+    )
+    parser.add_argument(
+        "--asyncio", action="store_true",
+        help="Serve stdio or sockets with an asyncio event loop instead of a "
+             "reader thread per connection"
+    )
+    parser.add_argument(
+        "--request-timeout", type=float,
+        help="Fail requests that take longer than this many seconds. Only "
+             "used with --asyncio."
+    )
     parser.add_argument(
         "--host", default="127.0.0.1",
         help="Bind to this address"
@@ -52,6 +68,26 @@ def _add_arguments(parser):
         "--port", type=int, default=2087,
         help="Bind to this port"
     )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="Run a daemon that owns the model and serves a language server "
+             "per connection on a Unix domain socket"
+    )
+    parser.add_argument(
+        "--zygote", action="store_true",
+        help="Make the daemon fork a fresh language server process per "
+             "connection, which inherits the loaded model. Children can hang "
+             "with torch builds that use GNU OpenMP"
+    )
+    parser.add_argument(
+        "--shim", action="store_true",
+        help="Forward stdio to the daemon and start it if it isn't running. "
+             "The shim doesn't load the model."
+    )
+    parser.add_argument(
+        "--daemon-socket", default=shim.default_socket_path(),
+        help="Path of the Unix domain socket of the daemon"
+    )
     parser.add_argument(
         '--check-parent-process', action="store_true",
         help="Check whether parent process is still alive using "
@@ -60,6 +96,22 @@ def _add_arguments(parser):
              "on a Windows machine."
     )
 
+    parser.add_argument(
+        "--workers", type=int, default=0,
+        help="Run the model in this many worker processes that share its "
+             "weights instead of in the server process"
+    )
+    parser.add_argument(
+        "--worker-threads", type=int,
+        help="Number of torch threads per model worker. Defaults to the "
+             "number of CPUs divided by the number of workers."
+    )
+    parser.add_argument(
+        "--latency-target", type=float, metavar="SECONDS",
+        help="Shorten the context and the completions when completions take "
+             "longer than this"
+    )
+
     log_group = parser.add_mutually_exclusive_group()
     log_group.add_argument(
         "--log-config",
@@ -76,6 +128,43 @@ def _add_arguments(parser):
         help="Increase verbosity of log output, overrides log config file"
     )
 
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    _add_batch_arguments(subparsers.add_parser(
+        'batch', help="Generate completions for files of prompts"))
+
+
+def _add_batch_arguments(parser):
+    parser.description = "Generate completions for files of prompts and " \
+        "write them with the log-probabilities of their tokens as JSONL. " \
+        "Options of the model, eg. --workers, go before the command."
+
+    parser.add_argument(
+        "inputs", nargs="+", metavar="INPUT",
+        help="Prompt file with a prompt per line. Lines of .jsonl files are "
+             "JSON strings or objects with a \"prompt\" and an optional "
+             "\"id\". - reads stdin."
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="Write the results to this file instead of stdout"
+    )
+    parser.add_argument(
+        "--jsonl", action="store_true", default=None,
+        help="Parse all inputs as JSONL"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=16,
+        help="Maximum number of prompts per forward pass"
+    )
+    parser.add_argument(
+        "--gen-len", type=int,
+        help="Number of tokens to generate per prompt"
+    )
+    parser.add_argument(
+        "--context-tokens", type=int,
+        help="Number of tokens of each prompt that the model sees"
+    )
+
 
 def _binary_stdio():
     """Construct binary stdio streams (not text mode).
@@ -133,13 +222,74 @@ def _configure_logger(verbose=0, log_config=None, log_file=None):
     root_logger.setLevel(level)
 
 
+def _daemon_args(args):
+    """Command line arguments passed on to a daemon started by the shim."""
+    daemon_args = ['--workers', str(args.workers)]
+    if args.zygote:
+        daemon_args.append('--zygote')
+    if args.worker_threads is not None:
+        daemon_args += ['--worker-threads', str(args.worker_threads)]
+    if args.latency_target is not None:
+        daemon_args += ['--latency-target', str(args.latency_target)]
+    if args.log_config:
+        daemon_args += ['--log-config', args.log_config]
+    elif args.log_file:
+        daemon_args += ['--log-file', args.log_file]
+    if args.verbose:
+        daemon_args.append('-' + 'v' * args.verbose)
+    return daemon_args
+
+
 def main():
     parser = argparse.ArgumentParser()
     _add_arguments(parser)
     args = parser.parse_args()
+    if args.zygote and args.workers:
+        parser.error('--zygote can\'t be combined with --workers')
     _configure_logger(args.verbose, args.log_config, args.log_file)
 
-    if args.tcp:
+    if args.shim:
+        stdin, stdout = _binary_stdio()
+        shim.start_shim(stdin, stdout, args.daemon_socket,
+                        _daemon_args(args))
+        return
+
+    # Imported here, because the shim must not load the model.
+    from . import lang_model
+
+    lang_model.config.n_workers = args.workers
+    lang_model.config.worker_threads = args.worker_threads
+    lang_model.config.latency_target = args.latency_target
+
+    if args.command == 'batch':
+        from .batch import start_batch
+        start_batch(args.inputs, args.output, args.batch_size, args.gen_len,
+                    args.context_tokens, args.jsonl)
+        return
+
+    from .lang_server import MAX_WORKERS, start_daemon_lang_server, \
+        start_io_lang_server, start_tcp_lang_server, start_unix_lang_server, \
+        LanguageServer
+
+    if args.daemon:
+        start_daemon_lang_server(args.daemon_socket, LanguageServer,
+                                 fork=args.zygote)
+    elif args.asyncio:
+        from . import aio
+        if args.socket:
+            aio.start_unix_lang_server(args.socket, LanguageServer,
+                                       MAX_WORKERS, args.request_timeout)
+        elif args.tcp:
+            aio.start_tcp_lang_server(args.host, args.port, LanguageServer,
+                                      MAX_WORKERS, args.request_timeout)
+        else:
+            stdin, stdout = _binary_stdio()
+            aio.start_io_lang_server(stdin, stdout, args.check_parent_process,
+                                     LanguageServer, MAX_WORKERS,
+                                     args.request_timeout)
+    elif args.socket:
+        start_unix_lang_server(args.socket, LanguageServer)
+    elif args.tcp:
         start_tcp_lang_server(args.host, args.port, LanguageServer)
     else:
         stdin, stdout = _binary_stdio()
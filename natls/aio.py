@@ -0,0 +1,475 @@
+"""asyncio transport and dispatcher for the language server.
+
+Messages are read and written on an event loop instead of a blocking reader
+thread. Handlers are called on the loop in the order of the messages, so they
+can access the workspace without locks. Handlers that return a coroutine run
+on the loop and await their model calls with `AsyncEndpoint.run_in_executor`,
+which runs them in a thread pool shared by all connections. Handlers that
+return a callable have it run in the pool like in the synchronous server.
+Requests can be cancelled and time out, which also stops their model calls,
+and outgoing messages go through a bounded queue, so senders wait when the
+client doesn't keep up with reading.
+"""
+
+import asyncio
+import errno
+import logging
+import os
+import sys
+import threading
+import uuid
+from concurrent import futures
+from functools import partial
+
+from jsonrpc.endpoint import CANCEL_METHOD, JSONRPC_VERSION
+from jsonrpc.exceptions import JsonRpcException, JsonRpcInternalError, \
+    JsonRpcMethodNotFound, JsonRpcRequestCancelled
+
+from . import lang_model, shim, streams
+
+log = logging.getLogger(__name__)
+
+# Maximum number of outgoing messages that are queued before senders wait.
+MAX_QUEUED_MESSAGES = 64
+_HEADER_END = b'\r\n\r\n'
+# How often senders outside the loop check whether the connection is closed
+# while they wait for room in the queue in seconds.
+_SEND_POLL_INTERVAL = 1
+
+
+class AsyncEndpoint(object):
+    """JSON RPC endpoint that runs on an asyncio event loop.
+
+    Must be created on the loop. `notify`, `request`, `shutdown` and `spawn`
+    can be called from any thread like on `jsonrpc.endpoint.Endpoint`.
+
+    Arguments:
+        dispatcher: Dict-like object of handlers by method name.
+        writer: The `asyncio.StreamWriter` of the connection.
+        executor: The `concurrent.futures.Executor` that runs the model calls
+            of handlers.
+        timeout: Optional number of seconds after which requests fail.
+        on_close: Optional function that is called when the endpoint is shut
+            down, eg. to stop reading.
+    """
+
+    def __init__(self, dispatcher, writer, executor, timeout=None,
+                 on_close=None):
+        self._dispatcher = dispatcher
+        self._writer = writer
+        self._executor = executor
+        self._timeout = timeout
+        self._on_close = on_close
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._queue = asyncio.Queue(MAX_QUEUED_MESSAGES)
+        # Futures of the requests in progress by id.
+        self._client_requests = {}
+        # Tasks of the notifications and spawned coroutines in progress.
+        self._tasks = set()
+        self._server_requests = {}
+        self.closed = False
+
+    def notify(self, method, params=None):
+        """Send a JSON RPC notification to the client."""
+        log.debug('Sending notification: %s %s', method, params)
+        message = {'jsonrpc': JSONRPC_VERSION, 'method': method}
+        if params is not None:
+            message['params'] = params
+        self._send(message)
+
+    def request(self, method, params=None):
+        """Send a JSON RPC request to the client.
+
+        Returns: A `concurrent.futures.Future` of the result.
+
+        """
+        msg_id = str(uuid.uuid4())
+        log.debug('Sending request with id %s: %s %s', msg_id, method, params)
+        message = {'jsonrpc': JSONRPC_VERSION, 'id': msg_id, 'method': method}
+        if params is not None:
+            message['params'] = params
+
+        future = futures.Future()
+        self._server_requests[msg_id] = future
+        self._send(message)
+        return future
+
+    def shutdown(self):
+        """Stop writing and call `on_close`."""
+        if threading.get_ident() == self._loop_thread:
+            self._close()
+        else:
+            self._loop.call_soon_threadsafe(self._close)
+
+    def spawn(self, coro):
+        """Run a coroutine on the loop, eg. a debounced handler.
+
+        Failures are logged, and the endpoint waits for the coroutine in
+        `join` like for the handlers of notifications.
+        """
+        if threading.get_ident() == self._loop_thread:
+            self._spawn(coro)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._spawn, coro)
+        except RuntimeError:
+            # The loop is closed.
+            coro.close()
+
+    async def run_in_executor(self, fn):
+        """Run a function in the thread pool and await its result.
+
+        Cancelling the awaiting task, like a cancelled or timed out request
+        does, removes the call from the pool if it hasn't started yet and
+        stops its model calls otherwise.
+        """
+        cancelled = threading.Event()
+        try:
+            return await self._loop.run_in_executor(
+                self._executor, partial(_run_cancellable, fn, cancelled))
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    def consume(self, message):
+        """Dispatch a JSON RPC message from the client. Runs on the loop."""
+        if message.get('jsonrpc') != JSONRPC_VERSION:
+            log.warning('Unknown message type %s', message)
+            return
+
+        if 'id' not in message:
+            if message['method'] == CANCEL_METHOD:
+                self._cancel(message['params']['id'])
+            else:
+                self._handle_notification(message['method'],
+                                          message.get('params'))
+        elif 'method' not in message:
+            self._handle_response(message['id'], message.get('result'),
+                                  message.get('error'))
+        else:
+            self._handle_request(message['id'], message['method'],
+                                 message.get('params'))
+
+    async def write_messages(self):
+        """Write queued messages until the endpoint is shut down."""
+        closing = False
+        while not closing:
+            # Messages that are queued already are written together.
+            messages = [await self._queue.get()]
+            while not self._queue.empty():
+                messages.append(self._queue.get_nowait())
+            if None in messages:
+                closing = True
+                messages = messages[:messages.index(None)]
+
+            data = []
+            for message in messages:
+                try:
+                    data.append(streams.encode_message(message))
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Failed to serialize message %s', message)
+            self._writer.write(b''.join(data))
+            try:
+                # Waits while the client is behind on reading.
+                await self._writer.drain()
+            except ConnectionError:
+                log.info('Connection lost')
+                self.shutdown()
+                return
+
+    async def join(self):
+        """Wait for the handlers of notifications in progress, eg. exit."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def _send(self, message):
+        if self.closed:
+            return
+        if threading.get_ident() == self._loop_thread:
+            asyncio.ensure_future(self._queue.put(message))
+            return
+
+        # Handlers in the thread pool wait until the message is queued, but
+        # not after the connection is closed.
+        try:
+            future = asyncio.run_coroutine_threadsafe(
+                self._queue.put(message), self._loop)
+        except RuntimeError:
+            # The loop is closed.
+            return
+        while not self.closed:
+            try:
+                future.result(_SEND_POLL_INTERVAL)
+                return
+            except futures.TimeoutError:
+                pass
+        future.cancel()
+
+    def _close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for future in list(self._client_requests.values()):
+            future.cancel()
+        # The writer stops at None. If the queue is full, the client isn't
+        # reading, so the unsent messages are dropped to make room.
+        try:
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+        if self._on_close is not None:
+            self._on_close()
+
+    def _cancel(self, msg_id):
+        future = self._client_requests.get(msg_id)
+        if future is None:
+            log.debug('Received cancel notification for unknown message id '
+                      '%s', msg_id)
+            return
+        future.cancel()
+
+    def _handle_notification(self, method, params):
+        try:
+            handler = self._dispatcher[method]
+        except KeyError:
+            log.warning('Ignoring notification for unknown method %s', method)
+            return
+
+        self._spawn(self._call(handler, params), method, params)
+
+    def _spawn(self, coro, method=None, params=None):
+        if self.closed:
+            coro.close()
+            return
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(_log_failure(method, params))
+
+    def _handle_request(self, msg_id, method, params):
+        try:
+            handler = self._dispatcher[method]
+        except KeyError:
+            self._send({'jsonrpc': JSONRPC_VERSION, 'id': msg_id,
+                        'error': JsonRpcMethodNotFound.of(method).to_dict()})
+            return
+
+        # The call is what is cancelled, so that the response is sent even if
+        # it is cancelled before it is awaited.
+        future = asyncio.ensure_future(self._call(handler, params))
+        self._client_requests[msg_id] = future
+        future.add_done_callback(
+            lambda _: self._client_requests.pop(msg_id, None))
+        asyncio.ensure_future(self._respond(msg_id, future))
+
+    async def _call(self, handler, params):
+        """Call a handler and await the result that it defers."""
+        # Tasks start in the order that they are created, so the handlers are
+        # called in the order of the messages.
+        result = handler(params)
+        if asyncio.iscoroutine(result):
+            return await result
+        if callable(result):
+            return await self.run_in_executor(result)
+        return result
+
+    async def _respond(self, msg_id, future):
+        message = {'jsonrpc': JSONRPC_VERSION, 'id': msg_id}
+        try:
+            if self._timeout is None:
+                message['result'] = await future
+            else:
+                message['result'] = await asyncio.wait_for(future,
+                                                           self._timeout)
+        except asyncio.CancelledError:
+            log.debug('Cancelled request with id %s', msg_id)
+            message['error'] = JsonRpcRequestCancelled().to_dict()
+        except asyncio.TimeoutError:
+            log.warning('Request %s timed out', msg_id)
+            message['error'] = JsonRpcRequestCancelled(
+                message='Request timed out').to_dict()
+        except JsonRpcException as e:
+            log.exception('Failed to handle request %s', msg_id)
+            message['error'] = e.to_dict()
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Failed to handle request %s', msg_id)
+            message['error'] = JsonRpcInternalError.of(
+                sys.exc_info()).to_dict()
+        if not self.closed:
+            await self._queue.put(message)
+
+    def _handle_response(self, msg_id, result=None, error=None):
+        future = self._server_requests.pop(msg_id, None)
+        if future is None:
+            log.warning('Received response to unknown message id %s', msg_id)
+        elif error is not None:
+            future.set_exception(JsonRpcException.from_dict(error))
+        else:
+            future.set_result(result)
+
+
+def _run_cancellable(fn, cancelled):
+    with lang_model.cancel_context(cancelled):
+        return fn()
+
+
+def _log_failure(method, params):
+    """Make a done callback that logs the failure of a notification."""
+    def callback(future):
+        if future.cancelled() or future.exception() is None:
+            return
+        if method is None:
+            log.error('Failed to run a spawned coroutine',
+                      exc_info=future.exception())
+        else:
+            log.error('Failed to handle notification %s: %s', method,
+                      params, exc_info=future.exception())
+    return callback
+
+
+async def read_message(reader):
+    """Read the body of a message.
+
+    The headers are read in one go instead of line by line.
+
+    Returns: The body as bytes or None at the end of the stream.
+
+    """
+    try:
+        header = await reader.readuntil(_HEADER_END)
+    except asyncio.IncompleteReadError:
+        return None
+
+    try:
+        return await reader.readexactly(streams.content_length(header))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def serve(reader, writer, handler_class, executor,
+                check_parent_process=False, timeout=None):
+    """Serve a language server on a connection until it closes or exits."""
+    endpoint = None
+
+    def make_endpoint(dispatcher):
+        nonlocal endpoint
+        endpoint = AsyncEndpoint(dispatcher, writer, executor, timeout,
+                                 on_close=reader.feed_eof)
+        return endpoint
+
+    handler_class(None, None, check_parent_process,
+                  make_endpoint=make_endpoint)
+    writing = asyncio.ensure_future(endpoint.write_messages())
+    try:
+        while not endpoint.closed:
+            body = await read_message(reader)
+            if body is None:
+                break
+            try:
+                message = streams.loads(body)
+            except ValueError:
+                log.exception('Failed to parse JSON message %s', body)
+                continue
+            endpoint.consume(message)
+    finally:
+        endpoint.shutdown()
+        await writing
+        await endpoint.join()
+        writer.close()
+
+
+async def _stdio_streams(rfile, wfile):
+    loop = asyncio.get_event_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), rfile)
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, wfile)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+def start_io_lang_server(rfile, wfile, check_parent_process, handler_class,
+                         max_workers, timeout=None):
+    """Serve a language server on stdio with an asyncio event loop."""
+    log.info('Starting %s in asyncio IO mode', handler_class.__name__)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    async def main():
+        reader, writer = await _stdio_streams(rfile, wfile)
+        await serve(reader, writer, handler_class, executor,
+                    check_parent_process, timeout)
+
+    try:
+        loop.run_until_complete(main())
+    finally:
+        executor.shutdown(wait=False)
+        loop.close()
+
+
+def start_tcp_lang_server(bind_addr, port, handler_class, max_workers,
+                          timeout=None):
+    """Serve a language server per TCP connection with an asyncio loop.
+
+    All connections share the thread pool of the model calls.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    async def handle(reader, writer):
+        await serve(reader, writer, handler_class, executor, False, timeout)
+
+    server = loop.run_until_complete(
+        asyncio.start_server(handle, bind_addr, port))
+    try:
+        log.info('Serving {} at {}:{} with asyncio'.format(
+            handler_class.__name__, bind_addr, port))
+        loop.run_forever()
+    finally:
+        log.info('Shutting down')
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        executor.shutdown(wait=False)
+        loop.close()
+
+
+def start_unix_lang_server(socket_path, handler_class, max_workers,
+                           timeout=None):
+    """Serve a language server per Unix domain socket connection with asyncio.
+
+    Only the current user can connect to the socket.
+    """
+    if not shim.remove_stale_socket(socket_path):
+        raise OSError(errno.EADDRINUSE, 'A server is already listening on '
+                      '{}'.format(socket_path))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    async def handle(reader, writer):
+        await serve(reader, writer, handler_class, executor, False, timeout)
+
+    umask = os.umask(0o177)
+    try:
+        server = loop.run_until_complete(
+            asyncio.start_unix_server(handle, socket_path))
+    finally:
+        os.umask(umask)
+    try:
+        log.info('Serving {} at {} with asyncio'.format(
+            handler_class.__name__, socket_path))
+        loop.run_forever()
+    finally:
+        log.info('Shutting down')
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        executor.shutdown(wait=False)
+        loop.close()
+        os.unlink(socket_path)
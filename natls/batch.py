@@ -0,0 +1,222 @@
+"""Generate completions for files of prompts outside the language server.
+
+Prompts are read from JSONL files, where each line is a JSON string or an
+object with a "prompt" and an optional "id", or from text files with a prompt
+per line. Prompts are sorted by length into batches, so that little compute is
+spent on padding, and the batches run concurrently on the model workers if
+there are any. A JSON object with the id, the completion and the
+log-probabilities of its tokens is written per prompt in the order that the
+batches finish. Prompts that have no tokens or whose batch fails get an
+"error" instead, and the other batches still run.
+"""
+
+import collections
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from . import lang_model
+from .lang_model import config
+
+log = logging.getLogger(__name__)
+
+
+class BatchStats(collections.namedtuple('BatchStats', [
+        'n_prompts', 'n_batches', 'prompt_tokens', 'padding_tokens',
+        'generated_tokens', 'seconds', 'n_errors'])):
+    """Throughput of a batch run.
+
+    The counts are those of the batches that succeeded.
+
+    Attributes:
+        n_prompts: The number of completed prompts.
+        n_batches: The number of batches.
+        prompt_tokens: The number of prompt tokens that the model saw.
+        padding_tokens: The number of tokens that pad prompts to the longest
+            prompt of their batch.
+        generated_tokens: The number of generated tokens.
+        seconds: The wall time of the run.
+        n_errors: The number of prompts that got an error instead of a
+            completion.
+    """
+
+    __slots__ = ()
+
+    def report(self):
+        """Return a human readable summary."""
+        seconds = max(self.seconds, 1e-9)
+        padding = self.padding_tokens / max(
+            1, self.prompt_tokens + self.padding_tokens)
+        return ('{} prompts in {} batches took {:.2f}s: {:.1f} prompts/s, '
+                '{:.1f} prompt tokens/s, {:.1f} generated tokens/s, '
+                '{:.1%} padding, {} errors').format(
+                    self.n_prompts, self.n_batches, self.seconds,
+                    self.n_prompts / seconds, self.prompt_tokens / seconds,
+                    self.generated_tokens / seconds, padding, self.n_errors)
+
+
+def read_prompts(f, jsonl=False):
+    """Read prompts from a file.
+
+    Arguments:
+        f: A text file.
+        jsonl: Parse lines as JSON instead of taking them as prompts. Empty
+            lines are skipped either way.
+
+    Returns: A list of (id, prompt) tuples. The id is the line number unless
+        a JSON object has an "id".
+
+    Raises: ValueError if a JSON line is invalid.
+
+    """
+    prompts = []
+    for i, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if not jsonl:
+            prompts.append((i, line))
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError as e:
+            raise ValueError('Invalid JSON on line {}: {}'.format(i, e))
+        if isinstance(value, dict):
+            if not isinstance(value.get('prompt'), str):
+                raise ValueError('Missing "prompt" on line {}'.format(i))
+            prompts.append((value.get('id', i), value['prompt']))
+        elif isinstance(value, str):
+            prompts.append((i, value))
+        else:
+            raise ValueError('Expected a string or an object on line '
+                             '{}'.format(i))
+    return prompts
+
+
+def make_batches(encoded, batch_size):
+    """Group encoded prompts of similar length into batches.
+
+    Arguments:
+        encoded: List of (id, token ids) tuples.
+        batch_size: The maximum number of prompts per batch.
+
+    Returns: A list of lists of (id, token ids) tuples.
+
+    """
+    encoded = sorted(encoded, key=lambda item: len(item[1]))
+    return [encoded[i:i + batch_size]
+            for i in range(0, len(encoded), batch_size)]
+
+
+def run_batch(prompts, out, batch_size, gen_len=None, context_tokens=None):
+    """Generate completions for prompts and write them as JSONL.
+
+    Arguments:
+        prompts: List of (id, prompt) tuples.
+        out: The text file that the results are written to.
+        batch_size: The maximum number of prompts per forward pass.
+        gen_len: The number of tokens to generate. Defaults to
+            `config.gen_len`.
+        context_tokens: The number of tokens at the end of each prompt that
+            the model sees. Defaults to `config.context_tokens`. Prompts are
+            cropped further if the completion wouldn't fit into the model
+            context.
+
+    Returns: The `BatchStats` of the run.
+
+    Raises: ValueError if gen_len doesn't fit into the model context.
+
+    """
+    if gen_len is None:
+        gen_len = config.gen_len
+    if context_tokens is None:
+        context_tokens = config.context_tokens
+    if gen_len >= config.n_ctx:
+        raise ValueError('gen_len must be less than {}'.format(config.n_ctx))
+    # Cropped here rather than by the model, so that batches are formed and
+    # counted by the lengths that the model sees.
+    context_tokens = min(context_tokens, config.n_ctx - gen_len)
+
+    def write_error(prompt_id, error):
+        out.write(json.dumps({'id': prompt_id, 'error': error}) + '\n')
+
+    t0 = time.perf_counter()
+    n_errors = 0
+    encoded = []
+    for prompt_id, prompt in prompts:
+        X = lang_model.encode(prompt, context_tokens)
+        if X:
+            encoded.append((prompt_id, X))
+        else:
+            write_error(prompt_id, 'Prompt has no tokens')
+            n_errors += 1
+
+    completed = []
+    # Batches run concurrently only if the workers can take them.
+    with ThreadPoolExecutor(max(1, config.n_workers)) as executor:
+        futures = {executor.submit(lang_model.generate_batch,
+                                   [X for _, X in batch], gen_len): batch
+                   for batch in make_batches(encoded, batch_size)}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                log.exception('Batch of %d prompts failed', len(batch))
+                for prompt_id, _ in batch:
+                    write_error(prompt_id,
+                                '{}: {}'.format(type(e).__name__, e))
+                n_errors += len(batch)
+                continue
+            for (prompt_id, _), (completion, logprobs) in zip(batch, results):
+                out.write(json.dumps({'id': prompt_id,
+                                      'completion': completion,
+                                      'logprobs': logprobs}) + '\n')
+            out.flush()
+            completed.append(batch)
+
+    n_prompts = sum(len(batch) for batch in completed)
+    prompt_tokens = sum(len(X) for batch in completed for _, X in batch)
+    padding_tokens = sum(len(batch) * len(batch[-1][1])
+                         for batch in completed) - prompt_tokens
+    return BatchStats(n_prompts, len(completed), prompt_tokens,
+                      padding_tokens, n_prompts * gen_len,
+                      time.perf_counter() - t0, n_errors)
+
+
+def start_batch(inputs, output=None, batch_size=16, gen_len=None,
+                context_tokens=None, jsonl=None):
+    """Run the batch command and print the throughput report to stderr.
+
+    Arguments:
+        inputs: Paths of the prompt files. '-' reads standard input.
+        output: Path of the JSONL output. Defaults to standard output.
+        batch_size: See `run_batch`.
+        gen_len: See `run_batch`.
+        context_tokens: See `run_batch`.
+        jsonl: Parse the inputs as JSONL. Defaults to files ending with
+            '.jsonl'.
+    """
+    prompts = []
+    for path in inputs:
+        is_jsonl = jsonl if jsonl is not None else path.endswith('.jsonl')
+        if path == '-':
+            prompts += read_prompts(sys.stdin, is_jsonl)
+        else:
+            with open(path, encoding='utf-8') as f:
+                prompts += read_prompts(f, is_jsonl)
+
+    lang_model.initialize()
+    try:
+        if output is None:
+            stats = run_batch(prompts, sys.stdout, batch_size, gen_len,
+                              context_tokens)
+        else:
+            with open(output, 'w', encoding='utf-8') as out:
+                stats = run_batch(prompts, out, batch_size, gen_len,
+                                  context_tokens)
+    finally:
+        lang_model.stop_workers()
+    print(stats.report(), file=sys.stderr)
@@ -0,0 +1,83 @@
+"""Diagnostics for words that are improbable in their context."""
+
+import bisect
+import re
+
+from . import constants, lang_model
+
+SOURCE = 'natls'
+
+# Runs of lines that aren't blank. Paragraphs are scored independently, so
+# that an edit only invalidates the cached scores of its paragraph.
+_RE_PARAGRAPH = re.compile(r'[^\S\n]*\S[^\n]*(?:\n[^\S\n]*\S[^\n]*)*')
+
+
+def paragraphs(source):
+    """Return the (offset, text) tuples of the paragraphs of a document."""
+    return [(m.start(), m.group()) for m in _RE_PARAGRAPH.finditer(source)]
+
+
+def improbable_phrases(words, threshold):
+    """Merge adjacent improbable words into phrases.
+
+    Arguments:
+        words: List of (start, end, log_prob) tuples, see
+            `lang_model.word_log_probs`.
+        threshold: Words with a lower log-probability are improbable.
+
+    Returns: A list of (start, end, log_probs) tuples, where log_probs is the
+        list of the log-probabilities of the words of the phrase.
+
+    """
+    phrases = []
+    previous = None
+    for i, (start, end, log_prob) in enumerate(words):
+        if log_prob >= threshold:
+            continue
+        if previous is not None and previous == i - 1:
+            phrase_start, _, log_probs = phrases[-1]
+            phrases[-1] = (phrase_start, end, log_probs + [log_prob])
+        else:
+            phrases.append((start, end, [log_prob]))
+        previous = i
+    return phrases
+
+
+def lint(source, threshold, background=True):
+    """Return diagnostics for the improbable words of a document.
+
+    Scores of paragraphs that haven't changed are taken from the cache of
+    `lang_model.word_log_probs`, so only edited paragraphs are scored again.
+
+    Arguments:
+        source: The text of the document.
+        threshold: Words with a lower log-probability are flagged.
+        background: See `lang_model.word_log_probs`.
+
+    Returns: A list of LSP diagnostics.
+
+    """
+    doc_paragraphs = paragraphs(source)
+    scores = lang_model.word_log_probs([text for _, text in doc_paragraphs],
+                                       background=background)
+    line_starts = [0] + [m.end() for m in re.finditer('\n', source)]
+
+    def position(offset):
+        line = bisect.bisect_right(line_starts, offset) - 1
+        return {'line': line, 'character': offset - line_starts[line]}
+
+    diagnostics = []
+    for (offset, _), words in zip(doc_paragraphs, scores):
+        for start, end, log_probs in improbable_phrases(words, threshold):
+            kind = 'word' if len(log_probs) == 1 else 'phrase'
+            diagnostics.append({
+                'source': SOURCE,
+                'range': {
+                    'start': position(offset + start),
+                    'end': position(offset + end)
+                },
+                'message': 'Improbable {} (log-probability {:.1f})'.format(
+                    kind, sum(log_probs)),
+                'severity': constants.DiagnosticSeverity.Information
+            })
+    return diagnostics
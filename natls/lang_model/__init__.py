@@ -1 +1,6 @@
-from .generate import generate, initialize
+from .document_tokens import DocumentTokens
+from .scheduler import Cancelled, cancel_context, client_context
+from .generate import GenerationState, after_fork, cache_stats, encode, \
+    encode_context, generate, generate_batch, generate_state, initialize, \
+    latency_stats, next_words, prefetch, resume, score, start_workers, \
+    stop_workers, word_log_probs
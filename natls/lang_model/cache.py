@@ -0,0 +1,125 @@
+"""Thread-safe caches for model results."""
+
+import collections
+import sys
+import threading
+from concurrent.futures import Future
+
+
+def deep_sizeof(value):
+    """Return the size of a value in bytes including its items.
+
+    Lists, tuples and dicts are measured recursively, which covers the
+    results that the model caches. Shared items are counted once per
+    reference.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(deep_sizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(deep_sizeof(k) + deep_sizeof(v)
+                    for k, v in value.items())
+    return size
+
+
+class LRUCache(object):
+    """Least recently used cache bounded by the total size of its values.
+
+    Arguments:
+        max_size: The maximum total size of the cached values.
+        sizeof: Function that returns the size of a value. Defaults to
+            `deep_sizeof`, which makes `max_size` a memory cap in bytes.
+    """
+
+    def __init__(self, max_size, sizeof=deep_sizeof):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._sizeof = sizeof
+        self._size = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self._size -= self._items.pop(key)[1]
+            if size > self.max_size:
+                return
+            self._items[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._size = 0
+
+    def stats(self):
+        """Return a dict with the hit and miss counters and the size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'items': len(self._items),
+            'size': self._size,
+            'max_size': self.max_size
+        }
+
+
+class SingleFlight(object):
+    """Deduplicates concurrent calls with the same key.
+
+    The first caller for a key computes the result and callers that arrive
+    while the computation is in flight wait for it and share the result.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Call `fn` unless a call for `key` is in flight and return result."""
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
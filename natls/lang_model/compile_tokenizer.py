@@ -0,0 +1,50 @@
+"""Compile the tokenizer into a file that the server loads at startup.
+
+Usage: python -m natls.lang_model.compile_tokenizer [--output PATH]
+"""
+
+import argparse
+import time
+
+from . import config
+from .text_encoder import TextEncoder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--encoder-path', default=config.encoder_path,
+        help='JSON file that maps BPE tokens to ids'
+    )
+    parser.add_argument(
+        '--bpe-path', default=config.bpe_path,
+        help='File with the BPE merges in rank order'
+    )
+    parser.add_argument(
+        '--output', default=config.compiled_tokenizer_path,
+        help='Path of the compiled tokenizer'
+    )
+    parser.add_argument(
+        '--words',
+        help='Optional file with frequent words, one per line, whose token '
+             'ids are stored in addition to the words of the vocabulary'
+    )
+    args = parser.parse_args(argv)
+
+    words = []
+    if args.words:
+        with open(args.words, encoding='utf-8') as f:
+            words = [line.strip().lower() for line in f if line.strip()]
+
+    text_encoder = TextEncoder(args.encoder_path, args.bpe_path)
+    text_encoder.compile(args.output, words)
+
+    t0 = time.perf_counter()
+    text_encoder = TextEncoder(args.encoder_path, args.bpe_path,
+                               compiled_path=args.output)
+    print('Compiled {} words to {}, loads in {:.3f}s'.format(
+        len(text_encoder.word_ids), args.output, time.perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    main()
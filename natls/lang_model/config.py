@@ -22,6 +22,14 @@ lr_schedule = 'warmup_linear'
 # TODO
 encoder_path = '/home/abiro/repos/natural-language-server/model/encoder_bpe_40000.json'
 bpe_path = '/home/abiro/repos/natural-language-server/model/vocab_40000.bpe'
+# Written by `python -m natls.lang_model.compile_tokenizer`. The source files
+# above are used if it doesn't exist.
+compiled_tokenizer_path = '/home/abiro/repos/natural-language-server/model/tokenizer_40000.bin'  # noqa 501
+# Splits text into words before BPE. 'regex' reproduces the spaCy tokenizer
+# without loading spaCy, 'spacy' needs the en_core_web_sm model.
+pre_tokenizer = 'regex'
+# Number of words whose BPE is cached.
+bpe_cache_size = 2 ** 16
 n_transfer = 12
 lm_coef = 0.5
 b1 = 0.9
@@ -30,3 +38,36 @@ e = 1e-8
 n_valid = 374
 gen_len = 20
 topk = 10
+# Maximum number of prompt tokens that the model sees. The prompt length is the
+# main driver of the cost of a forward pass, so this trades quality for latency.
+context_tokens = 256
+# Maximum number of tokens sampled to complete a word fragment in next word
+# suggestions.
+word_lookahead = 3
+# Maximum number of tokens proposed by the n-gram draft in speculative
+# decoding. 0 disables speculative decoding, which is the default, because
+# the draft needs the sampled tokens on the host after each forward pass.
+draft_len = 0
+# Longest n-gram the draft matches against the prompt and workspace text.
+draft_order = 3
+# Memory cap of the completion result cache in bytes.
+cache_max_bytes = 4 * 1024 * 1024
+# Maximum share of the time that prefetching completions in the background
+# keeps the model busy, between 0 and 1. 0 disables prefetching.
+prefetch_cpu_share = 0.5
+# Completion latency target in seconds. If set, the default context length and
+# the generated length are shortened when completions are slower than the
+# target, based on the timings of recent completions. None disables it.
+latency_target = None
+# Lower bounds of the lengths chosen for the latency target.
+min_context_tokens = 32
+min_gen_len = 4
+# Number of tokens that the windows overlap by when scoring texts longer than
+# n_ctx. Tokens at the start of a window are scored with this many tokens of
+# context from the previous window.
+score_overlap = 256
+# Number of worker processes that run the model with shared weights. 0 runs
+# the model in the server process.
+n_workers = 0
+# Number of torch threads per worker. None divides the CPUs among the workers.
+worker_threads = None
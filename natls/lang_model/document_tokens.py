@@ -0,0 +1,195 @@
+"""Incremental tokenization of documents."""
+
+import re
+
+# Text is standardized so that any whitespace with a line break becomes a
+# single line break token and spaCy tokenizes whitespace separated chunks
+# independently, so encoding the text piece by piece at whitespace gives the
+# same tokens as encoding it at once.
+_RE_LINE_BREAK = re.compile(r'\s*\n\s*')
+_RE_SENTENCE_END = re.compile(r'(?<=[.!?])[^\S\n]+')
+
+LINE_BREAK_TOKEN = '\n</w>'
+
+# Span kinds
+SENTENCE = 'sentence'
+SPACE = 'space'
+LINE_BREAK = 'line_break'
+# Text that has changed and must be split into spans again.
+DIRTY = 'dirty'
+
+
+class _Span(object):
+    __slots__ = ('start', 'end', 'kind', 'tokens')
+
+    def __init__(self, start, end, kind):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.tokens = None
+
+    def __repr__(self):
+        return '_Span({}, {}, {})'.format(self.start, self.end, self.kind)
+
+
+class DocumentTokens(object):
+    """Token ids of a document aligned to its sentences and line breaks.
+
+    The document is split into sentence, space and line break spans, which are
+    encoded lazily and cached. Edits only invalidate the spans that they touch,
+    so the context before the cursor is mostly assembled from cached tokens.
+    """
+
+    def __init__(self):
+        # Spans that tile the document or None if the document hasn't been
+        # seen yet.
+        self._spans = None
+
+    def apply_change(self, start, end, length):
+        """Invalidate the spans touched by an edit.
+
+        Arguments:
+            start: Offset of the start of the replaced text before the edit.
+            end: Offset of the end of the replaced text before the edit.
+            length: Length of the inserted text.
+        """
+        if self._spans is None:
+            return
+
+        delta = length - (end - start)
+        spans = self._spans
+        # Spans that end at the start or start at the end of the edit are
+        # touched too, because text is inserted right next to them.
+        lo = 0
+        while lo < len(spans) and spans[lo].end < start:
+            lo += 1
+        hi = lo
+        while hi < len(spans) and spans[hi].start <= end:
+            hi += 1
+
+        for span in spans[hi:]:
+            span.start += delta
+            span.end += delta
+
+        if lo < hi:
+            start = min(start, spans[lo].start)
+            end = max(end, spans[hi - 1].end)
+        dirty = []
+        if end + delta > start:
+            dirty.append(_Span(start, end + delta, DIRTY))
+        spans[lo:hi] = dirty
+
+    def tokens_before(self, source, offset, context_tokens, text_encoder):
+        """Return the tokens of the context before an offset.
+
+        Sentences and paragraphs are taken backward from the offset until the
+        budget is reached, so the context starts at a sentence or paragraph
+        boundary unless the last sentence alone exceeds the budget.
+
+        Arguments:
+            source: The text of the document.
+            offset: The offset of the cursor.
+            context_tokens: The token budget.
+            text_encoder: The `TextEncoder` that encodes the spans.
+
+        Returns: A list of token ids.
+
+        """
+        if not self._spans or self._spans[-1].end != len(source):
+            # Either the document is new or it got out of sync.
+            self._spans = [_Span(0, len(source), DIRTY)] if source else []
+
+        line_break = text_encoder.encoder.get(LINE_BREAK_TOKEN, 0)
+        chunks = self._reversed_chunks(source, offset, text_encoder,
+                                       line_break)
+        return select_context(chunks, context_tokens, line_break)
+
+    def _reversed_chunks(self, source, offset, text_encoder, line_break):
+        """Yield the token lists of the spans before the offset backward."""
+        spans = self._spans
+        i = len(spans) - 1
+        while i >= 0 and spans[i].start >= offset:
+            i -= 1
+
+        while i >= 0:
+            span = spans[i]
+            if span.kind == DIRTY:
+                new_spans = _split(source, span.start, span.end)
+                spans[i:i + 1] = new_spans
+                i += len(new_spans) - 1
+                while i >= 0 and spans[i].start >= offset:
+                    i -= 1
+                continue
+
+            if span.end > offset:
+                # The span under the cursor is only partially in the context.
+                if span.kind == SENTENCE:
+                    yield text_encoder.encode([source[span.start:offset]])[0]
+            else:
+                if span.tokens is None:
+                    span.tokens = _encode_span(source, span, text_encoder,
+                                               line_break)
+                yield span.tokens
+            i -= 1
+
+
+def select_context(chunks, context_tokens, line_break):
+    """Select token chunks from the end backward within a token budget.
+
+    Arguments:
+        chunks: Iterable of token id lists from the end of the text backward.
+        context_tokens: The token budget.
+        line_break: The id of the line break token.
+
+    Returns: A list of token ids.
+
+    """
+    selected = []
+    n_tokens = 0
+    for tokens in chunks:
+        if not tokens:
+            continue
+        if n_tokens + len(tokens) > context_tokens:
+            if not selected:
+                selected.append(tokens[-context_tokens:])
+            break
+        selected.append(tokens)
+        n_tokens += len(tokens)
+
+    # Standardization strips line breaks from the ends of the text.
+    if selected and selected[0] == [line_break]:
+        selected.pop(0)
+    if selected and selected[-1] == [line_break]:
+        selected.pop()
+    return [idx for tokens in reversed(selected) for idx in tokens]
+
+
+def _encode_span(source, span, text_encoder, line_break):
+    if span.kind == LINE_BREAK:
+        return [line_break]
+    if span.kind == SPACE:
+        return []
+    return text_encoder.encode([source[span.start:span.end]])[0]
+
+
+def _split(source, start, end):
+    """Split a part of the source into spans."""
+    spans = []
+    pos = start
+    for m in _RE_LINE_BREAK.finditer(source, start, end):
+        _split_line(source, pos, m.start(), spans)
+        spans.append(_Span(m.start(), m.end(), LINE_BREAK))
+        pos = m.end()
+    _split_line(source, pos, end, spans)
+    return spans
+
+
+def _split_line(source, start, end, spans):
+    pos = start
+    for m in _RE_SENTENCE_END.finditer(source, start, end):
+        if m.start() > pos:
+            spans.append(_Span(pos, m.start(), SENTENCE))
+        spans.append(_Span(m.start(), m.end(), SPACE))
+        pos = m.end()
+    if end > pos:
+        spans.append(_Span(pos, end, SENTENCE))
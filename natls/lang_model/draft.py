@@ -0,0 +1,66 @@
+"""Cheap draft models for speculative decoding."""
+
+
+class NGramDraft(object):
+    """Proposes continuations by looking up n-grams in known token sequences.
+
+    The longest suffix of the context (up to `order` tokens) that occurs in one
+    of the indexed sequences is looked up and the tokens that followed its most
+    recent occurrence are proposed. This works well for repetitive text, eg.
+    names, boilerplate or phrases repeated across the workspace.
+    """
+
+    def __init__(self, order=3):
+        self.order = order
+        # Maps n-gram tuples to a (sequence, index of the next token) tuple.
+        self._index = {}
+        # The sequence that `extend` appends to.
+        self._last = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, tokens):
+        """Index a sequence of token ids."""
+        self._last = list(tokens)
+        self._add_ngrams(self._last, 1)
+
+    def extend(self, tokens):
+        """Append token ids to the last added sequence and index them.
+
+        This keeps the draft up to date with the tokens sampled after the
+        context, so that text repeated within a completion is proposed too.
+        """
+        if self._last is None:
+            self.add(tokens)
+            return
+        start = len(self._last)
+        self._last.extend(tokens)
+        # The n-grams that end at the old end are followed by a token now.
+        self._add_ngrams(self._last, max(1, start))
+
+    def _add_ngrams(self, tokens, start):
+        for end in range(start, len(tokens)):
+            for n in range(1, min(self.order, end) + 1):
+                self._index[tuple(tokens[end - n:end])] = (tokens, end)
+
+    def propose(self, context, n_tokens):
+        """Propose up to `n_tokens` tokens that follow the context.
+
+        Arguments:
+            context: Sequence of token ids.
+            n_tokens: Maximum number of tokens to propose.
+
+        Returns: A possibly empty list of token ids.
+
+        """
+        if n_tokens <= 0:
+            return []
+
+        for n in range(min(self.order, len(context)), 0, -1):
+            match = self._index.get(tuple(context[-n:]))
+            if match is not None:
+                tokens, end = match
+                return tokens[end:end + n_tokens]
+
+        return []
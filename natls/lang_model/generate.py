@@ -26,29 +26,112 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import collections
+import hashlib
 import random
 import logging
+import os
+import re
 import time
+from functools import partial
 from threading import Lock
 
 import numpy as np
 import torch
 
 from . import config
+from .cache import LRUCache, SingleFlight
+from .document_tokens import LINE_BREAK_TOKEN, DocumentTokens
+from .draft import NGramDraft
 from .gpt_lang_model import LMModel, load_openai_pretrained_model
+from .latency import LatencyController
+from .scheduler import Cancelled, FairSemaphore, raise_if_cancelled
 from .text_encoder import TextEncoder
+from .workers import WorkerPool
 
 
-_lock = Lock()
+# Model calls are granted round robin between clients, so that clients of a
+# shared server can't starve each other.
+_lock = FairSemaphore()
+# Encoding doesn't touch the model, so it shouldn't wait for generation.
+_encoder_lock = Lock()
 _device = None
 _text_encoder = None
 _lm_model = None
+# `WorkerPool` that runs the model if it runs in worker processes.
+_workers = None
+# Slots of the workers, granted like `_lock`.
+_worker_slots = None
+# Results of deterministic or already sampled computations by prompt and
+# settings.
+_result_cache = LRUCache(config.cache_max_bytes)
+_single_flight = SingleFlight()
+_MISSING = object()
+# Timings of recent completions that the lengths for `config.latency_target`
+# are chosen by.
+_latency = LatencyController()
+# Upper bound on the characters per token used to crop text prompts, so that
+# the cost of very long prompts stays bounded.
+_MAX_CHARS_PER_TOKEN = 16
+# Maximum number of padded tokens per forward pass when scoring texts, which
+# bounds the memory of the attention weights.
+_SCORE_BATCH_TOKENS = 4096
+# Number of hidden states that go through the language model head at once
+# when scoring, which bounds the memory of the vocabulary logits.
+_SCORE_HEAD_CHUNK = 512
+_RE_WORD = re.compile(r'\S+')
+
+
+class GenerationState(collections.namedtuple('GenerationState',
+                                             ['batch', 'ids', 'text'])):
+    """Generation progress that can be resumed with `resume`.
+
+    Attributes:
+        batch: The model input tensor with the prompt and the generated tokens.
+        ids: List of the generated token ids.
+        text: The continuation generated so far as a string.
+    """
+
+    __slots__ = ()
 
 
 def _append_batch(X, next_idx):
-    next_pos = X[:, -1:, 1] + 1
-    next_x = torch.cat((next_idx, next_pos), -1).unsqueeze(1)
-    return torch.cat((X, next_x), 1)
+    """Append a (batch, n) tensor of token ids to the batch.
+
+    The oldest tokens are dropped if the batch doesn't fit into the context.
+    """
+    offsets = torch.arange(1, next_idx.size(1) + 1, device=X.device)
+    next_pos = X[:, -1:, 1] + offsets
+    next_x = torch.stack((next_idx, next_pos), -1)
+    return _slide_window(torch.cat((X, next_x), 1))
+
+
+def _cache_key(kind, X, *settings):
+    """Hash of the encoded prompt and the settings that affect the result."""
+    key = hashlib.blake2b(np.asarray(X, dtype=np.int64).tobytes(),
+                          digest_size=16)
+    key.update(repr((kind,) + settings).encode('utf-8'))
+    return key.digest()
+
+
+def _cached(key, compute):
+    """Return a cached result or compute it once for concurrent callers."""
+    def compute_and_cache():
+        # Looked up once per call, so that the hit and miss counters add up
+        # to the number of calls that aren't joined to one in flight.
+        result = _result_cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = compute()
+            _result_cache.put(key, result)
+        return result
+
+    while True:
+        try:
+            return _single_flight.do(key, compute_and_cache)
+        except Cancelled:
+            # The call that computed the result for concurrent callers might
+            # have been cancelled instead of this one.
+            raise_if_cancelled()
 
 
 def _get_device():
@@ -89,47 +172,746 @@ def _get_text_encoder():
     global _text_encoder
 
     if _text_encoder is None:
-        _text_encoder = TextEncoder(config.encoder_path, config.bpe_path)
+        _text_encoder = TextEncoder(config.encoder_path, config.bpe_path,
+                                    config.pre_tokenizer,
+                                    config.bpe_cache_size,
+                                    config.compiled_tokenizer_path)
 
     return _text_encoder
 
 
+def _last_log_probs(lm_model, XMB, ends):
+    """Return the next token log-probabilities after the end of each row.
+
+    Only the hidden states at the ends go through the language model head,
+    whose projection to the vocabulary dominates the cost of short contexts.
+    """
+    h = lm_model.transformer(XMB)
+    h = h[torch.arange(h.size(0), device=h.device), ends - 1]
+    logits = lm_model.lm_head(h) + lm_model.pos_emb_mask[0]
+    return logits.log_softmax(-1)
+
+
 def _make_batch(X, n_vocab, device):
     X = np.array(X)
     assert X.ndim in [1, 2]
     if X.ndim == 1:
         X = np.expand_dims(X, axis=0)
+    # The model has no position embeddings beyond n_ctx.
+    X = X[:, -config.n_ctx:]
     pos_enc = np.arange(n_vocab, n_vocab + X.shape[-1])
-    pos_enc = np.expand_dims(pos_enc, axis=0)
+    pos_enc = np.broadcast_to(pos_enc, X.shape)
     batch = np.stack([X, pos_enc], axis=-1)
     batch = torch.tensor(batch, dtype=torch.long).to(device)
     return batch
 
 
-def generate(text):
+def _default_context_tokens():
+    """The context length, shortened to meet the latency target."""
+    if config.latency_target is None:
+        return config.context_tokens
+    context_tokens, _ = _latency.lengths(
+        config.latency_target, config.context_tokens, config.gen_len,
+        config.min_context_tokens, config.min_gen_len)
+    return context_tokens
+
+
+def _default_gen_len(X):
+    """The generated length, shortened to meet the latency target."""
+    if config.latency_target is None:
+        return config.gen_len
+    return _latency.gen_len(config.latency_target, min(len(X), config.n_ctx),
+                            config.gen_len, config.min_gen_len)
+
+
+def _make_draft(draft_tokens):
+    if config.draft_len <= 0:
+        return None
+
+    draft = NGramDraft(config.draft_order)
+    for tokens in draft_tokens or ():
+        draft.add(tokens)
+    return draft
+
+
+def _prompt_tokens(prompt, context_tokens):
+    if isinstance(prompt, str):
+        return encode_context(prompt, context_tokens)
+    return list(prompt)
+
+
+def _slide_window(X, room=0):
+    """Make room for more tokens in the model context.
+
+    The oldest tokens are dropped so that `room` more tokens fit into the
+    `config.n_ctx` long context and the positions of the remaining tokens are
+    re-based to start from the first position again.
+    """
+    overflow = X.size(1) + room - config.n_ctx
+    if overflow <= 0:
+        return X
+
+    X = X[:, overflow:].clone()
+    X[:, :, 1] -= overflow
+    return X
+
+
+def _verify_draft(lm_probs, n_context, draft_ids):
+    """Speculative sampling with a deterministic draft.
+
+    Draft token `d` is accepted with probability `p(d)` and on rejection the
+    replacement is sampled from `p` with `d` removed, which makes the output
+    distribution identical to sampling from `p` token by token.
+
+    Returns: The accepted draft ids followed by one id sampled from the model.
+    """
+    # Next token distributions after the context and after each draft token.
+    probs = lm_probs[0, n_context - 1:]
+    draft_probs = probs[torch.arange(len(draft_ids)), draft_ids].tolist()
+    for i, (idx, prob) in enumerate(zip(draft_ids, draft_probs)):
+        if torch.rand(1).item() >= prob:
+            residual = probs[i].clone()
+            residual[idx] = 0
+            return draft_ids[:i] + [torch.multinomial(residual, 1).item()]
+
+    return draft_ids + [torch.multinomial(probs[len(draft_ids)], 1).item()]
+
+
+def _sample(state, gen_len, callback, draft=None):
+    log = logging.getLogger(__name__)
+    text_encoder = _get_text_encoder()
+    lm_model = _get_lang_model()
+    device = _get_device()
+
+    XMB = state.batch
+    if draft is None:
+        draft = _make_draft(None)
+    if draft is not None:
+        context = XMB[0, :, 0].tolist()
+        draft.add(context)
+    # Sampled ids stay on the device unless the draft or the callback needs
+    # them, because copying them to the host waits for the forward pass.
+    to_host = draft is not None or callback is not None
+    ids = list(state.ids)
+    sampled = []
+
+    n_forward = 0
+    n_sampled = 0
+    while n_sampled < gen_len:
+        raise_if_cancelled()
+        draft_ids = []
+        if draft is not None:
+            # Leave room for the token sampled from the model after the draft.
+            draft_ids = draft.propose(
+                context, min(config.draft_len, gen_len - n_sampled - 1))
+
+        if draft_ids:
+            # Slide the window before appending the draft, so that the
+            # position of the draft in the output is known.
+            XMB = _slide_window(XMB, len(draft_ids))
+            draft_idx = torch.tensor([draft_ids], dtype=torch.long,
+                                     device=device)
+            lm_probs = lm_model(_append_batch(XMB, draft_idx))
+            next_ids = _verify_draft(lm_probs, XMB.size(1), draft_ids)
+            next_idx = torch.tensor([next_ids], dtype=torch.long,
+                                    device=device)
+        else:
+            lm_probs = lm_model(XMB)
+            next_idx = torch.multinomial(lm_probs[0, -1, :], 1).unsqueeze(0)
+            next_ids = next_idx[0].tolist() if to_host else None
+        n_forward += 1
+        n_sampled += next_idx.size(1)
+        sampled.append(next_idx)
+
+        if to_host:
+            if draft is not None:
+                context.extend(next_ids)
+                draft.extend(next_ids)
+            if callback is not None:
+                for idx in next_ids:
+                    ids.append(idx)
+                    callback(text_encoder.decode(ids))
+        XMB = _append_batch(XMB, next_idx)
+
+    if sampled:
+        ids = list(state.ids) + torch.cat(sampled, 1)[0].tolist()
+    log.debug('sampled %d tokens in %d forward passes', gen_len, n_forward)
+    return GenerationState(XMB, ids, text_encoder.decode(ids))
+
+
+def encode_context(text, context_tokens=None, offset=None,
+                   document_tokens=None):
+    """Encode the context before the cursor within a token budget.
+
+    Sentences and paragraphs are encoded backward from the cursor until the
+    budget is reached, so the context starts at a sentence or paragraph
+    boundary unless the last sentence alone exceeds the budget.
+
+    Arguments:
+        text: The text of the document or the text before the cursor.
+        context_tokens: The token budget. Defaults to `config.context_tokens`
+            shortened to meet `config.latency_target`.
+        offset: The offset of the cursor. Defaults to the end of the text.
+        document_tokens: Optional `DocumentTokens` of the document that the
+            text is the source of. Tokens of unchanged sentences are reused
+            from it instead of encoding them again.
+
+    Returns: A list of token ids.
+
+    """
+    if context_tokens is None:
+        context_tokens = _default_context_tokens()
+    if offset is None:
+        offset = len(text)
+    if document_tokens is None:
+        text = text[max(0, offset - context_tokens * _MAX_CHARS_PER_TOKEN):
+                    offset]
+        offset = len(text)
+        document_tokens = DocumentTokens()
+
+    with _encoder_lock:
+        return document_tokens.tokens_before(text, offset, context_tokens,
+                                             _get_text_encoder())
+
+
+def encode(text, context_tokens=None):
+    """Encode a whole text and keep its last tokens.
+
+    Unlike `encode_context`, the context doesn't start at a sentence boundary,
+    so no more text is dropped than the budget requires.
+
+    Arguments:
+        text: The text.
+        context_tokens: The number of tokens that are kept. Defaults to all.
+
+    Returns: A list of token ids.
+
+    """
+    with _encoder_lock:
+        X = _get_text_encoder().encode([text])[0]
+    if context_tokens is not None:
+        X = X[max(0, len(X) - context_tokens):]
+    return X
+
+
+def generate(prompt, callback=None, draft_tokens=None, context_tokens=None):
+    """Generate a continuation for a prompt.
+
+    Arguments:
+        prompt: The prompt as a string or as a list of token ids returned by
+            `encode_context`.
+        callback: Optional function that is called with the continuation
+            generated so far every time a new token is sampled. Meant to be
+            used for streaming partial results.
+        draft_tokens: Optional list of token id lists, eg. of open documents,
+            that the n-gram draft for speculative decoding is built from in
+            addition to the prompt.
+        context_tokens: The number of tokens of a string prompt that the model
+            sees. Defaults to `config.context_tokens`. Smaller values are
+            faster, larger values give better continuations.
+
+    The continuation is `config.gen_len` tokens long. If
+    `config.latency_target` is set, the default context length and the
+    generated length are shortened as far as needed to meet it.
+
+    Returns: The generated continuation as a string.
+
+    """
+    X = _prompt_tokens(prompt, context_tokens)
+    gen_len = _default_gen_len(X)
+    key = _cache_key('generate', X, gen_len)
+    computed = []
+
+    def compute():
+        computed.append(True)
+        return _timed_generate_state(X, gen_len, draft_tokens,
+                                     callback).text
+
+    continuation = _cached(key, compute)
+    if callback is not None and not computed:
+        # Served from the cache or by a concurrent identical request.
+        callback(continuation)
+    return continuation
+
+
+def generate_state(prompt, gen_len=None, callback=None, draft_tokens=None,
+                   context_tokens=None):
+    """Generate a continuation for a prompt and return resumable state.
+
+    Arguments:
+        prompt: See `generate`.
+        gen_len: The number of tokens to generate. Defaults to
+            `config.gen_len` shortened to meet `config.latency_target`.
+        callback: See `generate`.
+        draft_tokens: See `generate`.
+        context_tokens: See `generate`.
+
+    Returns: A `GenerationState` that can be passed to `resume` to extend the
+        continuation without re-encoding the prompt.
+
+    """
+    X = _prompt_tokens(prompt, context_tokens)
+    if gen_len is None:
+        gen_len = _default_gen_len(X)
+    return _timed_generate_state(X, gen_len, draft_tokens, callback)
+
+
+def _timed_generate_state(X, gen_len, draft_tokens, callback):
+    """Generate and record the latency for the latency target."""
+    log = logging.getLogger(__name__)
+
+    # The latency includes waiting for the model, which is what clients see.
+    t0 = time.perf_counter()
+    state = _run('_generate_state', X, gen_len, draft_tokens,
+                 callback=callback)
+    elapsed = time.perf_counter() - t0
+    n_context = min(len(X), config.n_ctx)
+    _latency.observe(n_context, gen_len, elapsed)
+    if config.latency_target is not None:
+        log.info('completion of {} tokens after {} context tokens took {:.2f} '
+                 '(target {:.2f})'.format(gen_len, n_context, elapsed,
+                                          config.latency_target))
+    return state
+
+
+def _generate_state(X, gen_len, draft_tokens, callback=None):
     log = logging.getLogger(__name__)
 
     # Multiple threads might access this function and CUDA isn't thread-safe.
     # TODO switch to a LIFO queue
+    with _lock:
+        text_encoder = _get_text_encoder()
+
+        t0 = time.perf_counter()
+        XMB = _make_batch(X, text_encoder.n_vocab, _get_device())
+        draft = _make_draft(draft_tokens)
+        state = _sample(GenerationState(XMB, [], ''), gen_len, callback,
+                        draft)
+
+        log.info('prediction took {:.2f}'.format(time.perf_counter() - t0))
+        return state
+
+
+def resume(state, gen_len=None, callback=None):
+    """Extend a continuation returned by `generate_state` or `resume`.
+
+    Arguments:
+        state: A `GenerationState`.
+        gen_len: The number of tokens to add. Defaults to the number of tokens
+            missing from a `config.gen_len` long continuation.
+        callback: See `generate`.
+
+    Returns: A new `GenerationState` with the extended continuation.
+
+    """
+    if gen_len is None:
+        gen_len = max(0, config.gen_len - len(state.ids))
+    return _run('_resume', state, gen_len, callback=callback)
+
+
+def _resume(state, gen_len, callback=None):
+    log = logging.getLogger(__name__)
+
+    with _lock:
+        t0 = time.perf_counter()
+        state = _sample(state, gen_len, callback)
+        log.info('resuming prediction took {:.2f}'.format(
+            time.perf_counter() - t0))
+        return state
+
+
+def prefetch(prompt, context_tokens=None, cancelled=None):
+    """Generate a continuation in the background and cache it for `generate`.
+
+    Tokens are sampled one forward pass at a time with background priority,
+    so model calls of clients take over between passes, and the passes are
+    spaced out so that prefetching takes at most `config.prefetch_cpu_share`
+    of the time.
+
+    Arguments:
+        prompt: See `generate`.
+        context_tokens: See `generate`.
+        cancelled: Optional `threading.Event` that stops prefetching.
+
+    Returns: True if the continuation is cached, False if it was cancelled
+        or prefetching is disabled.
+
+    Raises: ValueError if `config.prefetch_cpu_share` isn't between 0 and 1.
+
+    """
+    share = config.prefetch_cpu_share
+    if share == 0:
+        return False
+    if not 0 < share <= 1:
+        raise ValueError('prefetch_cpu_share must be between 0 and 1, got '
+                         '{}'.format(share))
+
+    X = _prompt_tokens(prompt, context_tokens)
+    gen_len = _default_gen_len(X)
+    key = _cache_key('generate', X, gen_len)
+    state = None
+    while state is None or len(state.ids) < gen_len:
+        # A client might have generated the continuation in the meantime.
+        if key in _result_cache:
+            return True
+        if cancelled is not None and cancelled.is_set():
+            return False
+        state, elapsed = _run('_prefetch_step', X, state, background=True)
+        time.sleep(elapsed * (1 - share) / share)
+
+    _result_cache.put(key, state.text)
+    return True
+
+
+def _prefetch_step(X, state):
+    with _lock.background():
+        t0 = time.perf_counter()
+        if state is None:
+            XMB = _make_batch(X, _get_text_encoder().n_vocab, _get_device())
+            state = GenerationState(XMB, [], '')
+        state = _sample(state, 1, None)
+        return state, time.perf_counter() - t0
+
+
+def generate_batch(prompts, gen_len=None, context_tokens=None):
+    """Generate continuations for a batch of prompts at once.
+
+    The prompts are padded to the longest one and sampled in lockstep, so the
+    batch takes as many forward passes as a single prompt. Padding costs
+    compute, so prompts of similar length should be batched together. Prompts
+    are cropped so that the continuations fit into the model context and
+    results aren't cached.
+
+    Arguments:
+        prompts: List of prompts, see `generate`.
+        gen_len: The number of tokens to generate. Defaults to
+            `config.gen_len`.
+        context_tokens: See `generate`.
+
+    Returns: A list of (continuation, logprobs) tuples in the order of the
+        prompts, where logprobs is the list of the log-probabilities of the
+        generated tokens.
+
+    Raises: ValueError if a prompt has no tokens.
+
+    """
+    if gen_len is None:
+        gen_len = config.gen_len
+    if gen_len >= config.n_ctx:
+        raise ValueError('gen_len must be less than {}'.format(config.n_ctx))
+    Xs = [_prompt_tokens(prompt, context_tokens) for prompt in prompts]
+    if not all(Xs):
+        raise ValueError('Prompts must have at least one token')
+    if not Xs or gen_len <= 0:
+        return [('', []) for _ in Xs]
+    return _run('_generate_batch', Xs, gen_len)
+
+
+def _generate_batch(Xs, gen_len):
+    log = logging.getLogger(__name__)
+
+    with _lock, torch.no_grad():
+        text_encoder = _get_text_encoder()
+        lm_model = _get_lang_model()
+        device = _get_device()
+
+        t0 = time.perf_counter()
+        # Prompts are cropped instead of sliding the window, so that the
+        # positions of the rows stay aligned.
+        Xs = [X[-(config.n_ctx - gen_len):] for X in Xs]
+        width = max(len(X) for X in Xs)
+        padded = np.zeros((len(Xs), width + gen_len), dtype=np.int64)
+        for i, X in enumerate(Xs):
+            padded[i, :len(X)] = X
+        XMB = _make_batch(padded, text_encoder.n_vocab, device)
+        rows = torch.arange(len(Xs), device=device)
+        ends = torch.tensor([len(X) for X in Xs], device=device)
+
+        sampled = []
+        logprobs = []
+        for i in range(gen_len):
+            # The padding after the end of a row doesn't affect the tokens
+            # before it, because the attention is causal.
+            log_probs = _last_log_probs(lm_model, XMB[:, :width + i], ends)
+            next_idx = torch.multinomial(log_probs.exp(), 1)[:, 0]
+            sampled.append(next_idx)
+            logprobs.append(log_probs[rows, next_idx])
+            XMB[rows, ends, 0] = next_idx
+            ends += 1
+
+        ids = torch.stack(sampled, 1).tolist()
+        logprobs = torch.stack(logprobs, 1).tolist()
+        log.info('batch prediction of {} prompts took {:.2f}'.format(
+            len(Xs), time.perf_counter() - t0))
+        return [(text_encoder.decode(row_ids), row_logprobs)
+                for row_ids, row_logprobs in zip(ids, logprobs)]
+
+
+def next_words(prompt, k=None, context_tokens=None):
+    """Suggest the most likely next words for a prompt.
+
+    The top-k tokens are taken from a single next-token distribution and
+    tokens that are only word fragments are extended to whole words by a short
+    greedy lookahead, batched over all candidates.
+
+    Arguments:
+        prompt: See `generate`.
+        k: The number of candidate tokens. Defaults to `config.topk`.
+        context_tokens: See `generate`.
+
+    Returns: A list of (word, probability) tuples ordered by decreasing
+        probability. The probability is that of the first token of the word.
+
+    """
+    if k is None:
+        k = config.topk
+    X = _prompt_tokens(prompt, context_tokens)
+    key = _cache_key('next_words', X, k, config.word_lookahead)
+    return _cached(key, partial(_run, '_next_words', X, k))
+
+
+def _next_words(X, k):
+    log = logging.getLogger(__name__)
+
     with _lock:
         text_encoder = _get_text_encoder()
         lm_model = _get_lang_model()
 
         t0 = time.perf_counter()
-        X = text_encoder.encode([text,])
         XMB = _make_batch(X, text_encoder.n_vocab, _get_device())
+        lm_probs = lm_model(XMB)
+        probs, idxs = lm_probs[0, -1, :].topk(k)
+
+        words = [text_encoder.decoder[idx] for idx in idxs.tolist()]
+        pending = [i for i, word in enumerate(words)
+                   if not word.endswith('</w>')]
+        if pending:
+            XMB = XMB.repeat(len(pending), 1, 1)
+            XMB = _append_batch(XMB, idxs[pending].unsqueeze(-1))
+            for _ in range(config.word_lookahead):
+                lm_probs = lm_model(XMB)
+                next_idxs = lm_probs[:, -1, :].argmax(-1, keepdim=True)
+                for i, idx in zip(pending, next_idxs.squeeze(-1).tolist()):
+                    if not words[i].endswith('</w>'):
+                        words[i] += text_encoder.decoder[idx]
+                if all(words[i].endswith('</w>') for i in pending):
+                    break
+                XMB = _append_batch(XMB, next_idxs)
+
+        suggestions = collections.OrderedDict()
+        for word, prob in zip(words, probs.tolist()):
+            word = word.replace('</w>', '')
+            if word not in suggestions:
+                suggestions[word] = prob
+
+        log.info('next word prediction took {:.2f}'.format(
+            time.perf_counter() - t0))
+        return list(suggestions.items())
+
+
+def score(texts, background=False):
+    """Return the log-probabilities of the tokens of texts.
+
+    Each text is scored after a line break, so its first token is scored
+    too. The texts are padded and scored in batched forward passes without
+    sampling. Texts longer than the model context are scored in windows that
+    overlap by `config.score_overlap` tokens, so that the tokens at the start
+    of a window are scored with the end of the previous window as context.
+
+    Arguments:
+        texts: List of strings or of token id lists. Strings are encoded in
+            full.
+        background: Give way to model calls that aren't in the background.
+
+    Returns: A list per text of the natural log-probabilities of its tokens.
 
-        tokens = []
-        for _ in range(config.gen_len):
-            lm_probs = lm_model(XMB)
-            next_idx = torch.multinomial(lm_probs[:, -1, :], 1)
-            next_token = text_encoder.decoder[next_idx.item()]
-            clean_token = next_token.replace('</w>', '')
-            tokens.append(clean_token)
-            XMB = _append_batch(XMB, next_idx)
+    """
+    Xs = []
+    with _encoder_lock:
+        text_encoder = _get_text_encoder()
+        line_break = text_encoder.encoder.get(LINE_BREAK_TOKEN, 0)
+        for text in texts:
+            if isinstance(text, str):
+                text = text_encoder.encode([text])[0]
+            Xs.append([line_break] + list(text))
+    return _score_tokens(Xs, background)
 
-        log.info('prediction took {:.2f}'.format(time.perf_counter() - t0))
-        return ' '.join(tokens)
+
+def word_log_probs(texts, background=False):
+    """Score the whitespace separated words of texts in their context.
+
+    Each text is scored on its own like by `score`. Results are cached by
+    text, and the texts that aren't cached are scored in batched forward
+    passes.
+
+    Arguments:
+        texts: List of strings, eg. paragraphs.
+        background: See `score`.
+
+    Returns: A list per text of (start, end, log_prob) tuples of its words,
+        where start and end are the offsets of the word in the text and
+        log_prob is the natural log-probability of the tokens of the word.
+
+    """
+    keys = [_cache_key('word_log_probs', [], text) for text in texts]
+    results = [_result_cache.get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    words = []
+    encoded = []
+    Xs = []
+    with _encoder_lock:
+        text_encoder = _get_text_encoder()
+        line_break = text_encoder.encoder.get(LINE_BREAK_TOKEN, 0)
+        for i in pending:
+            text_words = list(_RE_WORD.finditer(texts[i]))
+            word_tokens = text_encoder.encode([m.group() for m in text_words])
+            words.append(text_words)
+            encoded.append(word_tokens)
+            Xs.append([line_break] +
+                      [idx for tokens in word_tokens for idx in tokens])
+
+    scores = _score_tokens(Xs, background)
+    for n, i in enumerate(pending):
+        result = []
+        # The first score is that of the first token after the line break.
+        pos = 0
+        for m, tokens in zip(words[n], encoded[n]):
+            log_prob = sum(scores[n][pos:pos + len(tokens)])
+            pos += len(tokens)
+            result.append((m.start(), m.end(), log_prob))
+        _result_cache.put(keys[i], result)
+        results[i] = result
+    return results
+
+
+def _score_windows(X):
+    """Split token ids into windows that fit into the model context.
+
+    Returns: A list of (window, n_context) tuples, where the scores of the
+        first n_context - 1 tokens after the first of the window are
+        already known from the previous window.
+
+    """
+    n_ctx = config.n_ctx
+    overlap = max(1, min(config.score_overlap, n_ctx - 1))
+    windows = [(X[:n_ctx], 1)]
+    end = min(len(X), n_ctx)
+    while end < len(X):
+        start = end - overlap
+        windows.append((X[start:start + n_ctx], overlap))
+        end = min(len(X), start + n_ctx)
+    return windows
+
+
+def _score_tokens(Xs, background):
+    """Score the tokens after the first of token lists of any length.
+
+    Windows of similar length are batched together, with at most
+    `_SCORE_BATCH_TOKENS` padded tokens per forward pass.
+    """
+    windows = [(i, window, n_context) for i, X in enumerate(Xs)
+               for window, n_context in _score_windows(X)]
+    order = sorted(range(len(windows)), key=lambda w: len(windows[w][1]))
+    window_scores = [None] * len(windows)
+    batch = []
+    for w in order + [None]:
+        width = len(windows[w][1]) if w is not None else 0
+        if batch and (w is None or
+                      width * (len(batch) + 1) > _SCORE_BATCH_TOKENS):
+            batch_scores = _run('_token_log_probs',
+                                [windows[b][1] for b in batch], background,
+                                background=background)
+            for b, b_scores in zip(batch, batch_scores):
+                window_scores[b] = b_scores
+            batch = []
+        if w is not None:
+            batch.append(w)
+
+    scores = [[] for _ in Xs]
+    for (i, _, n_context), w_scores in zip(windows, window_scores):
+        scores[i].extend(w_scores[n_context - 1:])
+    return scores
+
+
+def _token_log_probs(Xs, background=False):
+    """Return the log-probabilities of the tokens after the first.
+
+    The token lists are padded to the longest one and scored in a single
+    forward pass.
+    """
+    log = logging.getLogger(__name__)
+
+    _lock.acquire(background=background)
+    try:
+        with torch.no_grad():
+            text_encoder = _get_text_encoder()
+            lm_model = _get_lang_model()
+            device = _get_device()
+
+            t0 = time.perf_counter()
+            lengths = np.array([len(X) for X in Xs])
+            padded = np.zeros((len(Xs), lengths.max()), dtype=np.int64)
+            for i, X in enumerate(Xs):
+                padded[i, :len(X)] = X
+            # Positions whose hidden state predicts a token of the row.
+            rows, cols = np.nonzero(
+                np.arange(padded.shape[1] - 1) < lengths[:, None] - 1)
+            if not len(rows):
+                return [[] for _ in Xs]
+
+            h = lm_model.transformer(
+                _make_batch(padded, text_encoder.n_vocab, device))
+            h = h[torch.from_numpy(rows).to(device),
+                  torch.from_numpy(cols).to(device)]
+            targets = torch.from_numpy(padded[rows, cols + 1]).to(device)
+            log_probs = []
+            for i in range(0, h.size(0), _SCORE_HEAD_CHUNK):
+                logits = lm_model.lm_head(h[i:i + _SCORE_HEAD_CHUNK]) + \
+                    lm_model.pos_emb_mask[0]
+                log_probs.append(logits.log_softmax(-1).gather(
+                    1, targets[i:i + _SCORE_HEAD_CHUNK, None])[:, 0])
+            log_probs = torch.cat(log_probs).tolist()
+
+            log.info('scoring {} tokens took {:.2f}'.format(
+                len(log_probs), time.perf_counter() - t0))
+            ends = np.cumsum(np.maximum(lengths - 1, 0))
+            return [log_probs[end - n:end]
+                    for end, n in zip(ends, np.maximum(lengths - 1, 0))]
+    finally:
+        _lock.release()
+
+
+def _run(name, *args, callback=None, background=False):
+    """Call a model function in a worker process if there are workers."""
+    raise_if_cancelled()
+    workers, slots = _workers, _worker_slots
+    if workers is not None:
+        slots.acquire(background=background)
+        try:
+            return workers.call(name, *args, callback=callback)
+        finally:
+            slots.release()
+
+    kwargs = {} if callback is None else {'callback': callback}
+    return globals()[name](*args, **kwargs)
+
+
+def cache_stats():
+    """Return the hit and miss counters and the size of the result cache."""
+    return _result_cache.stats()
+
+
+def latency_stats():
+    """Return the fitted timings and the lengths of the last completion.
+
+    The timings are the seconds per generated token and per context token
+    of each generated token that the lengths for `config.latency_target` are
+    chosen by.
+    """
+    return _latency.stats()
 
 
 def initialize():
@@ -142,3 +924,69 @@ def initialize():
         _get_device()
         _get_text_encoder()
         _get_lang_model()
+    if config.n_workers > 0:
+        start_workers()
+
+
+def after_fork():
+    """Prepare the model for a child process forked after it was loaded.
+
+    Fork copies none of the threads of the torch thread pools. Setting the
+    number of threads again makes torch start its pools anew in the child
+    instead of handing work to threads that only exist in the parent. GNU
+    OpenMP can't restart a pool that the parent already used though, so with
+    torch builds that use it a child can still hang in its first parallel
+    operation. Serve connections in threads on such hosts.
+    """
+    torch.set_num_threads(torch.get_num_threads())
+
+
+def start_workers(n_workers=None, n_threads=None):
+    """Run the model in worker processes that share its weights.
+
+    The weights are loaded once in this process and mapped from shared memory
+    by the workers. Prompts are still encoded and results are still cached in
+    this process. Does nothing if the workers are already running.
+
+    Arguments:
+        n_workers: The number of worker processes. Defaults to
+            `config.n_workers`.
+        n_threads: The number of torch threads per worker. Defaults to
+            `config.worker_threads` or to the CPUs divided among the workers.
+
+    Raises: ValueError if n_workers is less than 1.
+
+    """
+    global _workers, _worker_slots
+
+    if n_workers is None:
+        n_workers = config.n_workers
+    if n_workers < 1:
+        raise ValueError('n_workers must be at least 1, got {}'.format(
+            n_workers))
+    if n_threads is None:
+        n_threads = config.worker_threads
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    with _lock:
+        if _workers is not None:
+            return
+        # The workers must use the same settings as this process, even if
+        # they were changed at runtime.
+        settings = {name: value for name, value in vars(config).items()
+                    if not name.startswith('_')}
+        _workers = WorkerPool(_get_lang_model(), n_workers, n_threads,
+                              _get_device(), settings)
+        _worker_slots = FairSemaphore(n_workers)
+
+
+def stop_workers():
+    """Stop the worker processes and run the model in this process again."""
+    global _workers, _worker_slots
+
+    with _lock:
+        workers, _workers = _workers, None
+        _worker_slots = None
+    if workers is not None:
+        workers.close()
@@ -0,0 +1,159 @@
+"""Adaptive context and generation lengths for a completion latency target."""
+
+import math
+import threading
+
+
+class LatencyController(object):
+    """Choose the context and generated lengths that meet a latency target.
+
+    The model has no key-value cache, so each forward pass processes the
+    whole context again and generating `g` tokens after a `c` token long
+    context takes about
+
+        g * per_token + (g * c + g * (g - 1) / 2) * per_prompt_token
+
+    seconds. The two timings are fitted to the latencies of recent
+    completions by least squares with exponentially decaying weights, so they
+    follow changes in the load of the host. Lengths are chosen from the
+    maximums down: the context is shortened first, because short
+    continuations are less useful than continuations of a shorter context.
+
+    Arguments:
+        decay: The weight of an observation relative to the next one.
+    """
+
+    def __init__(self, decay=0.9):
+        self._decay = decay
+        self._mutex = threading.Lock()
+        # Decaying sums of the normal equations of the fit.
+        self._sums = [0.] * 5
+        self._n_observations = 0
+        self._last = None
+
+    @staticmethod
+    def _features(context_tokens, gen_len):
+        return gen_len, gen_len * context_tokens + gen_len * (gen_len - 1) / 2
+
+    def observe(self, context_tokens, gen_len, seconds):
+        """Record the latency of a completion.
+
+        Arguments:
+            context_tokens: The number of context tokens.
+            gen_len: The number of generated tokens.
+            seconds: The latency of the completion.
+        """
+        if gen_len <= 0:
+            return
+        x1, x2 = self._features(context_tokens, gen_len)
+        with self._mutex:
+            self._sums = [self._decay * s + v for s, v in zip(
+                self._sums,
+                [x1 * x1, x1 * x2, x2 * x2, x1 * seconds, x2 * seconds])]
+            self._n_observations += 1
+            self._last = (context_tokens, gen_len, seconds)
+
+    def timings(self):
+        """Return the fitted (per_token, per_prompt_token) timings in seconds.
+
+        Returns: The timings or None if no completion was observed yet.
+
+        """
+        with self._mutex:
+            if not self._n_observations:
+                return None
+            s11, s12, s22, s1y, s2y = self._sums
+
+        det = s11 * s22 - s12 * s12
+        if det > 1e-9 * s11 * s22:
+            per_token = (s22 * s1y - s12 * s2y) / det
+            per_prompt_token = (s11 * s2y - s12 * s1y) / det
+            if per_token >= 0 and per_prompt_token >= 0:
+                return per_token, per_prompt_token
+            if per_token < 0:
+                return 0., max(0., s2y / s22)
+            return max(0., s1y / s11), 0.
+        # Completions of a single size don't tell the timings apart, so the
+        # latency is attributed to the tokens that the passes process.
+        return 0., max(0., s2y / s22)
+
+    def predict(self, context_tokens, gen_len):
+        """Return the predicted latency in seconds or None without timings."""
+        timings = self.timings()
+        if timings is None:
+            return None
+        x1, x2 = self._features(context_tokens, gen_len)
+        return timings[0] * x1 + timings[1] * x2
+
+    def _max_context(self, timings, target, gen_len):
+        """The longest context that meets the target or inf."""
+        per_token, per_prompt_token = timings
+        if per_prompt_token <= 0:
+            return math.inf if gen_len * per_token <= target else -math.inf
+        budget = target - gen_len * per_token - \
+            gen_len * (gen_len - 1) / 2 * per_prompt_token
+        return math.floor(budget / (gen_len * per_prompt_token))
+
+    def gen_len(self, target, context_tokens, max_gen_len, min_gen_len=1):
+        """Return the longest generated length that meets the target.
+
+        Arguments:
+            target: The latency target in seconds.
+            context_tokens: The number of context tokens.
+            max_gen_len: The length without latency constraints.
+            min_gen_len: The length that is used even if it misses the
+                target.
+
+        Returns: The generated length.
+
+        """
+        timings = self.timings()
+        if timings is None:
+            return max_gen_len
+        gen_len = max_gen_len
+        while gen_len > min_gen_len and \
+                self._max_context(timings, target, gen_len) < context_tokens:
+            gen_len -= 1
+        return gen_len
+
+    def lengths(self, target, max_context_tokens, max_gen_len,
+                min_context_tokens=1, min_gen_len=1):
+        """Return the longest context and generated lengths for the target.
+
+        Arguments:
+            target: The latency target in seconds.
+            max_context_tokens: The context length without latency
+                constraints.
+            max_gen_len: The generated length without latency constraints.
+            min_context_tokens: The context length that is used even if it
+                misses the target.
+            min_gen_len: See `gen_len`.
+
+        Returns: A (context_tokens, gen_len) tuple.
+
+        """
+        min_context_tokens = min(min_context_tokens, max_context_tokens)
+        gen_len = self.gen_len(target, min_context_tokens, max_gen_len,
+                               min_gen_len)
+        timings = self.timings()
+        if timings is None:
+            return max_context_tokens, gen_len
+        context_tokens = self._max_context(timings, target, gen_len)
+        context_tokens = int(max(min_context_tokens,
+                                 min(max_context_tokens, context_tokens)))
+        return context_tokens, gen_len
+
+    def stats(self):
+        """Return the fitted timings and the last observed completion."""
+        timings = self.timings() or (None, None)
+        with self._mutex:
+            last = self._last or (None, None, None)
+            n_observations = self._n_observations
+        return {
+            'per_token': timings[0],
+            'per_prompt_token': timings[1],
+            'observations': n_observations,
+            'context_tokens': last[0],
+            'gen_len': last[1],
+            'seconds': last[2],
+        }
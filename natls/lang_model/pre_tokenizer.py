@@ -0,0 +1,322 @@
+"""Regex word splitter that reproduces spaCy's English tokenizer.
+
+`TextEncoder` only needs spaCy to split standardized text into words before
+BPE, but loading a spaCy model takes seconds and hundreds of MB. This module
+implements the same algorithm as the spaCy tokenizer (whitespace splitting,
+special cases, prefixes, suffixes and infixes) with the English rules
+restricted to Latin text. Emoticons and URLs aren't special cased, because
+standardization splits most of them apart before tokenization anyway.
+"""
+
+import functools
+import re
+import unicodedata
+
+_ALPHA_LOWER = r'a-zß-öø-ÿ'
+_ALPHA_UPPER = r'A-ZÀ-ÖØ-Þ'
+_ALPHA = _ALPHA_LOWER + _ALPHA_UPPER
+
+_PUNCT = r'… …… , : ; \! \? ¿ ¡ \( \) \[ \] \{ \} < > _ # \* & ～ ·'
+_QUOTES = r'\' " ” “ ` ‘ ´ ’ ‚ , „ » «'
+_CURRENCY = r'\$ £ € ¥ ฿ US\$ C\$ A\$ ₽ ₴ ₹ ₩ ₪ ₫ ₱ ₿'
+_UNITS = ('km km² km³ m m² m³ dm dm² dm³ cm cm² cm³ mm mm² mm³ ha µm nm yd '
+          'in ft kg g mg µg t lb oz m/s km/h kmh mph hPa Pa mbar mb MB kb KB '
+          'gb GB tb TB T G M K %')
+_HYPHENS = '- – — -- --- —— ~'
+_ELLIPSES = [r'\.\.+', '…']
+# Symbols like dingbats, box drawing characters and emoji.
+_ICONS = ''.join(chr(i) for i in range(0x80, 0x10000)
+                 if unicodedata.category(chr(i)) == 'So') + \
+    '\U0001F000-\U0001FAFF'
+
+_CONCAT_QUOTES = _QUOTES.replace(' ', '')
+
+
+def _merge(chars):
+    return chars.replace(' ', '|')
+
+
+_PREFIXES = (['§', '%', '=', '—', '–', r'\+(?![0-9])'] + _PUNCT.split(' ') +
+             _ELLIPSES + _QUOTES.split(' ') + _CURRENCY.split(' ') +
+             ['[{}]'.format(_ICONS)])
+
+_SUFFIXES = (_PUNCT.split(' ') + _ELLIPSES + _QUOTES.split(' ') +
+             ['[{}]'.format(_ICONS)] + ["'s", "'S", '’s', '’S', '—', '–'] + [
+                 r'(?<=[0-9])\+',
+                 r'(?<=°[FfCcKk])\.',
+                 r'(?<=[0-9])(?:{})'.format(_merge(_CURRENCY)),
+                 r'(?<=[0-9])(?:{})'.format(_merge(_UNITS)),
+                 r'(?<=[0-9{}{}{}(?:{})])\.'.format(
+                     _ALPHA_LOWER, r'%²\-\+', _merge(_PUNCT), _CONCAT_QUOTES),
+                 r'(?<=[{au}][{au}])\.'.format(au=_ALPHA_UPPER),
+             ])
+
+_INFIXES = _ELLIPSES + ['[{}]'.format(_ICONS)] + [
+    r'(?<=[0-9])[+\-\*^](?=[0-9-])',
+    r'(?<=[{}{}])\.(?=[{}{}])'.format(_ALPHA_LOWER, _CONCAT_QUOTES,
+                                      _ALPHA_UPPER, _CONCAT_QUOTES),
+    r'(?<=[{a}]),(?=[{a}])'.format(a=_ALPHA),
+    r'(?<=[{a}])(?:{h})(?=[{a}])'.format(a=_ALPHA, h=_merge(_HYPHENS)),
+    r'(?<=[{a}0-9])[:<>=/](?=[{a}])'.format(a=_ALPHA),
+]
+
+_RE_PREFIX = re.compile('|'.join('^' + p for p in _PREFIXES))
+_RE_SUFFIX = re.compile('|'.join(s + '$' for s in _SUFFIXES))
+_RE_INFIX = re.compile('|'.join(_INFIXES))
+# URLs and email addresses are kept whole.
+_RE_URL = re.compile(
+    r'(?:(?:[\w\+\-\.]{2,})://)?'
+    r'(?:\S+(?::\S*)?@)?'
+    r'(?:'
+    r'(?!(?:10|127)(?:\.\d{1,3}){3})'
+    r'(?!(?:169\.254|192\.168)(?:\.\d{1,3}){2})'
+    r'(?!172\.(?:1[6-9]|2\d|3[0-1])(?:\.\d{1,3}){2})'
+    r'(?:[1-9]\d?|1\d\d|2[01]\d|22[0-3])'
+    r'(?:\.(?:1?\d{1,2}|2[0-4]\d|25[0-5])){2}'
+    r'(?:\.(?:[1-9]\d?|1\d\d|2[0-4]\d|25[0-4]))'
+    r'|'
+    r'(?:(?:[A-Za-z0-9\u00a1-\uffff][A-Za-z0-9\u00a1-\uffff_-]{0,62})?'
+    r'[A-Za-z0-9\u00a1-\uffff]\.)+'
+    r'(?:[' + _ALPHA_LOWER + r']{2,63})'
+    r')'
+    r'(?::\d{2,5})?'
+    r'(?:[/?#]\S*)?')
+# Chunks that no rule applies to, which are most words.
+_RE_PLAIN = re.compile(r'[A-Za-z]+|[0-9]+')
+_RE_CHUNK = re.compile(r'\S+|\s+')
+
+
+_EMOTICONS = r"""
+:) :-) :)) :-)) :))) :-))) (: (-: =) (= :] :-] [: [-: [= =] :o) (o: :} :-}
+8) 8-) (-8 ;) ;-) (; (-; =[ ]= :( :-( :(( :-(( :((( :-((( ): )-: =( >:( :') :'-)
+:'( :'-( :/ :-/ =/ :| :-| =| :1 :P :-P :p :-p :O :-O :o :-o :0 :-0 :() >:o
+:* :-* :3 :-3 =3 :> :-> :X :-X :x :-x :D :-D ;D ;-D =D xD XD xDD XDD 8D 8-D
+^_^ ^__^ ^___^ >.< >.> <.< ._. ;_; -_- -__- v.v V.V v_v V_V o_o o_O O_o O_O
+0_o o_0 0_0 o.O O.o O.O o.o 0.0 o.0 0.o @_@ <3 <33 <333 </3 (^_^) (-_-)
+(._.) (>_<) (*_*) (¬_¬) ಠ_ಠ ಠ︵ಠ (ಠ_ಠ) ¯\(ツ)/¯ (╯°□°）╯︵┻━┻ ><(((*>
+""".split()
+
+_ABBREVIATIONS = """
+Adm. Ak. Ala. Apr. Ariz. Ark. Aug. Bros. Calif. co. Co. Colo. Conn. Corp.
+D.C. Dec. Del. Dr. e.g. E.g. E.G. Feb. Fla. Ga. Gen. Gov. i.e. I.e. I.E. Ia.
+Id. Ill. Inc. Ind. Jan. Jr. Jul. Jun. Kan. Kans. Ky. La. Ltd. Mar. Mass. Md.
+Messrs. Mich. Minn. Miss. Mo. Mont. Mr. Mrs. Ms. Mt. N.C. N.D. N.H. N.J. N.M.
+N.Y. Neb. Nebr. Nev. Nov. Oct. Okla. Ore. Pa. Ph.D. Prof. Rep. Rev. S.C. Sen.
+Sep. Sept. St. Tenn. Va. vs. v.s. Wash. Wis.
+""".split()
+
+
+def _special_cases():
+    """Return a dict that maps strings to the tokens they're split into."""
+    cases = {}
+
+    def add(orth, *tokens):
+        cases[orth] = list(tokens) if tokens else [orth]
+
+    def add_title(word, suffixes):
+        for orth in [word, word.title()]:
+            for suffix in suffixes:
+                add(orth + suffix.replace('|', ''), orth, *suffix.split('|'))
+
+    for orth in ['\t', '\\t', '\n', '\\n', ' ', '\u00a0', '\u2014', "'",
+                 '\\")', "''", 'C++', '<space>', "'d", "'s", "'S", '‘s', '‘S',
+                 "'re", "'bout", "'cause", "'Cause", "'cos", "'Cos", "'coz",
+                 "'Coz", "'cuz", "'Cuz", 'and/or', 'w/o', 'a.m.', 'p.m.'] + \
+            [c + '.' for c in 'abcdefghijklmnopqrstuvwxyzäöü'] + \
+            _EMOTICONS + _ABBREVIATIONS:
+        add(orth)
+    for unit in 'cfkCFK':
+        add('°' + unit + '.', '°', unit, '.')
+
+    add_title('i', ["'m", 'm', "'m|a", 'm|a'])
+    for pron in ['i', 'you', 'he', 'she', 'it', 'we', 'they']:
+        add_title(pron, ["'ll", 'll', "'ll|'ve", 'll|ve', "'d", 'd',
+                         "'d|'ve", 'd|ve'])
+    for pron in ['i', 'you', 'we', 'they']:
+        add_title(pron, ["'ve", 've'])
+    for pron in ['you', 'we', 'they']:
+        add_title(pron, ["'re", 're'])
+    for pron in ['he', 'she', 'it']:
+        add_title(pron, ["'s", 's'])
+
+    for word, number in [('who', None), ('what', None), ('when', None),
+                         ('where', None), ('why', None), ('how', None),
+                         ('there', None), ('that', 'sing'), ('this', 'sing'),
+                         ('these', 'plur'), ('those', 'plur')]:
+        if number != 'plur':
+            add_title(word, ["'s", 's'])
+        add_title(word, ["'ll", 'll', "'ll|'ve", 'll|ve', "'d", 'd',
+                         "'d|'ve", 'd|ve'])
+        if number != 'sing':
+            add_title(word, ["'re", 're', "'ve", 've'])
+
+    for verb in ['ca', 'could', 'do', 'does', 'did', 'had', 'may', 'might',
+                 'must', 'need', 'ought', 'sha', 'should', 'wo', 'would']:
+        add_title(verb, ["n't", 'nt', "n't|'ve", 'nt|ve'])
+    for verb in ['could', 'might', 'must', 'should', 'would']:
+        add_title(verb, ["'ve", 've'])
+    for verb in ['ai', 'are', 'is', 'was', 'were', 'have', 'has', 'dare']:
+        add_title(verb, ["n't", 'nt'])
+
+    for word in ['doin', 'goin', 'nothin', 'nuthin', 'ol', 'somethin']:
+        for orth in [word, word.title()]:
+            add(orth)
+            add(orth + "'")
+    for word in ['em', 'll', 'nuff']:
+        add(word)
+        add("'" + word)
+
+    for hour in range(1, 13):
+        for period in ['a.m.', 'am', 'p.m.', 'pm']:
+            add(str(hour) + period, str(hour), period)
+
+    for orth, tokens in [('yall', ['y', 'all']), ("y'all", ["y'", 'all']),
+                         ("how'd'y", ['how', "'d", "'y"]),
+                         ("not've", ['not', "'ve"]), ('notve', ['not', 've']),
+                         ('cannot', ['can', 'not']),
+                         ('gonna', ['gon', 'na']), ('gotta', ['got', 'ta']),
+                         ("let's", ['let', "'s"]), ("c'mon", ["c'm", 'on'])]:
+        add(orth, *tokens)
+        if orth != "y'all" and orth != 'yall':
+            add(orth.capitalize(), tokens[0].capitalize(), *tokens[1:])
+    for orth in ["ma'am", "o'clock", "lovin'", 'lovin', "havin'", 'havin']:
+        add(orth)
+        add(orth.capitalize())
+
+    # Words that the contraction rules above would split.
+    for orth in ['Ill', 'ill', 'Its', 'its', 'Hell', 'hell', 'Shell', 'shell',
+                 'Shed', 'shed', 'were', 'Were', 'Well', 'well', 'Whore',
+                 'whore']:
+        cases.pop(orth, None)
+
+    # The same contractions with typographic apostrophes.
+    for orth, tokens in list(cases.items()):
+        if "'" in orth:
+            add(orth.replace("'", '’'), *[t.replace("'", '’') for t in tokens])
+
+    return cases
+
+
+_SPECIAL_CASES = _special_cases()
+
+
+def pre_tokenize(text):
+    """Split text into words like the spaCy English tokenizer.
+
+    Arguments:
+        text: A string, typically standardized by `text_standardize`.
+
+    Returns: A list of token strings.
+
+    """
+    tokens = []
+    for m in _RE_CHUNK.finditer(text):
+        chunk = m.group()
+        if not chunk.isspace():
+            tokens.extend(_tokenize_chunk(chunk))
+            continue
+        # A single space after a word is the word's trailing whitespace,
+        # the rest of the whitespace is a token.
+        if chunk[0] == ' ' and m.start() > 0:
+            chunk = chunk[1:]
+        if chunk:
+            tokens.append(chunk)
+    return tokens
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def _tokenize_chunk(chunk):
+    if _RE_PLAIN.fullmatch(chunk) and chunk not in _SPECIAL_CASES:
+        return (chunk,)
+
+    tokens = _split(chunk, _SPECIAL_CASES)
+    if len(tokens) > 1:
+        tokens = _merge_special_cases(tokens)
+    return tuple(tokens)
+
+
+def _split(string, special_cases):
+    """Split a chunk without whitespace into tokens."""
+    prefixes = []
+    suffixes = []
+    last_len = 0
+    while string and len(string) != last_len:
+        if string in special_cases:
+            break
+        last_len = len(string)
+
+        m = _RE_PREFIX.search(string)
+        pre_len = m.end() if m else 0
+        if pre_len:
+            minus_pre = string[pre_len:]
+            if minus_pre in special_cases:
+                prefixes.append(string[:pre_len])
+                string = minus_pre
+                break
+
+        m = _RE_SUFFIX.search(string[pre_len:])
+        suf_len = len(m.group()) if m else 0
+        if suf_len:
+            minus_suf = string[:-suf_len]
+            if minus_suf in special_cases:
+                suffixes.append(string[-suf_len:])
+                string = minus_suf
+                break
+
+        if pre_len and suf_len and pre_len + suf_len <= len(string):
+            prefixes.append(string[:pre_len])
+            suffixes.append(string[-suf_len:])
+            string = string[pre_len:-suf_len]
+        elif pre_len:
+            prefixes.append(string[:pre_len])
+            string = string[pre_len:]
+        elif suf_len:
+            suffixes.append(string[-suf_len:])
+            string = string[:-suf_len]
+
+    tokens = prefixes
+    if string in special_cases:
+        tokens.extend(special_cases[string])
+    elif _RE_URL.fullmatch(string):
+        tokens.append(string)
+    elif string:
+        start = 0
+        for m in _RE_INFIX.finditer(string):
+            if m.start() == 0:
+                continue
+            if m.start() != start:
+                tokens.append(string[start:m.start()])
+            if m.end() > m.start():
+                tokens.append(m.group())
+            start = m.end()
+        if start < len(string):
+            tokens.append(string[start:])
+    tokens.extend(reversed(suffixes))
+    return tokens
+
+
+# Special cases that contain affixes, eg. "''" or "u.", aren't found by
+# splitting when they're glued to other affixes, so like spaCy their pieces
+# are merged back afterwards. Maps the pieces to the special case tokens.
+_AFFIXED_SPECIAL_CASES = {}
+for _orth, _tokens in _SPECIAL_CASES.items():
+    _pieces = tuple(_split(_orth, {}))
+    if len(_pieces) > 1:
+        _AFFIXED_SPECIAL_CASES[_pieces] = _tokens
+_MAX_PIECES = max(len(p) for p in _AFFIXED_SPECIAL_CASES)
+
+
+def _merge_special_cases(tokens):
+    merged = []
+    i = 0
+    while i < len(tokens):
+        for n in range(min(_MAX_PIECES, len(tokens) - i), 1, -1):
+            special = _AFFIXED_SPECIAL_CASES.get(tuple(tokens[i:i + n]))
+            if special is not None:
+                merged.extend(special)
+                i += n
+                break
+        else:
+            merged.append(tokens[i])
+            i += 1
+    return merged
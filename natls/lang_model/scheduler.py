@@ -0,0 +1,139 @@
+"""Fair scheduling of model calls between clients."""
+
+import collections
+import contextlib
+import threading
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def client_context(client):
+    """Attribute the model calls of the current thread to a client.
+
+    Arguments:
+        client: Hashable id of the client, eg. of a language server session.
+    """
+    previous = getattr(_local, 'client', None)
+    _local.client = client
+    try:
+        yield
+    finally:
+        _local.client = previous
+
+
+def current_client():
+    """Return the client of the current thread or None."""
+    return getattr(_local, 'client', None)
+
+
+class Cancelled(Exception):
+    """Raised by model calls of a thread whose cancel event is set."""
+
+
+@contextlib.contextmanager
+def cancel_context(event):
+    """Stop the model calls of the current thread when an event is set.
+
+    Generation checks the event between forward passes and raises
+    `Cancelled`, so a cancelled request stops taking model time. Calls that
+    run in worker processes are only stopped before they start.
+
+    Arguments:
+        event: A `threading.Event`.
+    """
+    previous = getattr(_local, 'cancelled', None)
+    _local.cancelled = event
+    try:
+        yield
+    finally:
+        _local.cancelled = previous
+
+
+def raise_if_cancelled():
+    """Raise `Cancelled` if the cancel event of the current thread is set."""
+    event = getattr(_local, 'cancelled', None)
+    if event is not None and event.is_set():
+        raise Cancelled()
+
+
+class FairSemaphore(object):
+    """Semaphore that is granted round robin between clients.
+
+    Waiters are queued per client and a released slot is handed to the oldest
+    waiter of the next client in turn, so a client with many queued calls
+    can't starve the others. Background waiters only get a slot when no
+    client waits. Can be used as a context manager, which attributes the call
+    to `current_client`.
+
+    Arguments:
+        value: The number of slots.
+    """
+
+    def __init__(self, value=1):
+        self._value = value
+        self._mutex = threading.Lock()
+        # Queues of waiting events by client in the order of their turns.
+        self._waiters = collections.OrderedDict()
+        self._background_waiters = collections.deque()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.release()
+
+    @contextlib.contextmanager
+    def background(self):
+        """Hold a slot with background priority in a with statement."""
+        self.acquire(background=True)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def n_waiting(self):
+        """The number of waiters that aren't in the background."""
+        with self._mutex:
+            return sum(len(events) for events in self._waiters.values())
+
+    def acquire(self, client=None, background=False):
+        """Wait for a slot.
+
+        Arguments:
+            client: The client that waits. Defaults to `current_client`.
+            background: Wait until no client waits.
+        """
+        if client is None:
+            client = current_client()
+        with self._mutex:
+            if self._value > 0 and not self._waiters and \
+                    not self._background_waiters:
+                self._value -= 1
+                return
+            event = threading.Event()
+            if background:
+                self._background_waiters.append(event)
+            else:
+                self._waiters.setdefault(client, collections.deque()).append(
+                    event)
+        # The slot is handed over by `release` without incrementing the value.
+        event.wait()
+
+    def release(self):
+        with self._mutex:
+            if self._waiters:
+                client, events = next(iter(self._waiters.items()))
+                event = events.popleft()
+                if events:
+                    self._waiters.move_to_end(client)
+                else:
+                    del self._waiters[client]
+            elif self._background_waiters:
+                event = self._background_waiters.popleft()
+            else:
+                self._value += 1
+                return
+        event.set()
@@ -0,0 +1,97 @@
+import sys
+import threading
+import time
+from unittest import TestCase
+
+from .cache import LRUCache, SingleFlight, deep_sizeof
+
+
+class TestLRUCache(TestCase):
+    def test_get_put(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put('a', 'aaa')
+        self.assertEqual(cache.get('a'), 'aaa')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.size, 3)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(6, sizeof=len)
+        cache.put('a', 'aaa')
+        cache.put('b', 'bbb')
+        # Touch 'a' so that 'b' is the least recently used.
+        cache.get('a')
+        cache.put('c', 'cc')
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.size, 5)
+
+    def test_too_large_value(self):
+        cache = LRUCache(2, sizeof=len)
+        cache.put('a', 'aaa')
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 0)
+
+    def test_replace(self):
+        cache = LRUCache(10, sizeof=len)
+        cache.put('a', 'aaa')
+        cache.put('a', 'a')
+        self.assertEqual(cache.get('a'), 'a')
+        self.assertEqual(cache.size, 1)
+
+
+class TestSingleFlight(TestCase):
+    def test_concurrent_calls_share_result(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(True)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        owner = threading.Thread(
+            target=lambda: results.append(single_flight.do('key', compute)))
+        owner.start()
+        started.wait()
+        followers = [threading.Thread(
+            target=lambda: results.append(single_flight.do('key', compute)))
+            for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        # Give the followers time to join the call in flight.
+        time.sleep(0.1)
+        release.set()
+        for thread in [owner] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+
+    def test_exception_is_raised(self):
+        single_flight = SingleFlight()
+
+        def compute():
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            single_flight.do('key', compute)
+        # Failed calls are not remembered.
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+
+
+class TestDeepSizeof(TestCase):
+    def test_nested(self):
+        value = [('word', 0.5), ('other', 0.25)]
+        self.assertEqual(
+            deep_sizeof(value),
+            sys.getsizeof(value) + sum(
+                sys.getsizeof(item) + sys.getsizeof(item[0]) +
+                sys.getsizeof(item[1]) for item in value))
+        self.assertGreater(deep_sizeof(value), sys.getsizeof(value) * 2)
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from .document_tokens import DocumentTokens
+from .test_generate import WhitespaceEncoder
+
+
+class CountingEncoder(WhitespaceEncoder):
+    """Whitespace encoder that records the texts it encodes."""
+
+    def __init__(self):
+        super().__init__()
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return super().encode(texts)
+
+
+class TestDocumentTokens(TestCase):
+    def setUp(self):
+        self.text_encoder = CountingEncoder()
+
+    def _fresh(self, source, offset=None, context_tokens=100):
+        offset = len(source) if offset is None else offset
+        return DocumentTokens().tokens_before(source, offset, context_tokens,
+                                              self.text_encoder)
+
+    def _edit(self, document_tokens, source, start, end, text):
+        document_tokens.apply_change(start, end, len(text))
+        return source[:start] + text + source[end:]
+
+    def test_fresh(self):
+        source = 'One two. Three four!\n\nFive six'
+        self.assertEqual(self._fresh(source),
+                         self.text_encoder.encode([source])[0])
+
+    def test_reuses_unchanged_sentences(self):
+        source = 'One two. Three four.\nFive six'
+        document_tokens = DocumentTokens()
+        document_tokens.tokens_before(source, len(source), 100,
+                                      self.text_encoder)
+
+        self.text_encoder.encoded = []
+        source = self._edit(document_tokens, source, len(source),
+                            len(source), ' seven')
+        tokens = document_tokens.tokens_before(source, len(source), 100,
+                                               self.text_encoder)
+        self.assertEqual(self.text_encoder.encoded, ['Five six seven'])
+        self.assertEqual(tokens, self._fresh(source))
+
+    def test_edits(self):
+        source = 'One two. Three four.\n\nFive six. Seven'
+        document_tokens = DocumentTokens()
+        edits = [
+            (0, 0, 'Zero. '),
+            (10, 14, 'Eight'),
+            (20, 21, ''),
+            (15, 15, '\n'),
+            (len('Zero. One two. ') - 1, len('Zero. One two. '), ''),
+        ]
+        for start, end, text in edits:
+            document_tokens.tokens_before(source, len(source), 100,
+                                          self.text_encoder)
+            source = self._edit(document_tokens, source, start, end, text)
+            for offset in [len(source), len(source) // 2, 0]:
+                self.assertEqual(
+                    document_tokens.tokens_before(source, offset, 100,
+                                                  self.text_encoder),
+                    self._fresh(source, offset), (source, offset))
+
+    def test_out_of_sync(self):
+        document_tokens = DocumentTokens()
+        document_tokens.tokens_before('One. Two', 8, 100, self.text_encoder)
+        self.assertEqual(document_tokens.tokens_before(
+            'Three. Four five', 16, 100, self.text_encoder),
+            self._fresh('Three. Four five'))
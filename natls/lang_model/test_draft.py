@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+import torch
+
+from .draft import NGramDraft
+from .generate import _verify_draft
+
+
+class TestNGramDraft(TestCase):
+    def test_propose_longest_match(self):
+        draft = NGramDraft(order=2)
+        draft.add([1, 2, 3, 4, 5])
+        draft.add([9, 2, 7, 8])
+        # (1, 2) occurs only in the first sequence, while (2,) was last seen in
+        # the second one.
+        self.assertEqual(draft.propose([0, 1, 2], 2), [3, 4])
+        self.assertEqual(draft.propose([0, 6, 2], 2), [7, 8])
+
+    def test_propose_no_match(self):
+        draft = NGramDraft(order=3)
+        draft.add([1, 2, 3])
+        self.assertEqual(draft.propose([4], 2), [])
+        self.assertEqual(draft.propose([1], 0), [])
+        self.assertEqual(draft.propose([], 2), [])
+
+    def test_propose_end_of_sequence(self):
+        draft = NGramDraft(order=3)
+        draft.add([1, 2, 3])
+        self.assertEqual(draft.propose([1, 2], 5), [3])
+        # Nothing follows the last token, so there is nothing to propose.
+        self.assertEqual(draft.propose([3], 5), [])
+
+    def test_extend(self):
+        draft = NGramDraft(order=2)
+        draft.add([1, 2, 3])
+        self.assertEqual(draft.propose([3], 2), [])
+        draft.extend([4, 1, 2])
+        self.assertEqual(draft.propose([3], 2), [4, 1])
+        # Nothing follows the repeated (1, 2) yet, so the first occurrence is
+        # proposed until the sequence is extended.
+        self.assertEqual(draft.propose([1, 2], 1), [3])
+        draft.extend([5])
+        self.assertEqual(draft.propose([1, 2], 1), [5])
+
+
+class TestVerifyDraft(TestCase):
+    def test_distribution_is_preserved(self):
+        torch.manual_seed(0)
+        probs = torch.tensor([0.5, 0.3, 0.2])
+        # Context of one token and a draft of one token.
+        lm_probs = torch.stack([probs, probs]).unsqueeze(0)
+        n_samples = 20000
+        counts = torch.zeros(3)
+        for _ in range(n_samples):
+            next_ids = _verify_draft(lm_probs, 1, [1])
+            counts[next_ids[0]] += 1
+        self.assertTrue(torch.allclose(counts / n_samples, probs, atol=0.02))
+
+    def test_accepts_certain_draft(self):
+        probs = torch.tensor([0., 1., 0.])
+        lm_probs = torch.stack([probs] * 3).unsqueeze(0)
+        self.assertEqual(_verify_draft(lm_probs, 1, [1, 1]),
+                         [1, 1, 1])
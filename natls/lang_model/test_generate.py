@@ -0,0 +1,304 @@
+import re
+import sys
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+import torch
+
+from .cache import LRUCache
+from .generate import encode_context
+from .latency import LatencyController
+from .gpt_lang_model import DEFAULT_CONFIG, LMModel, dotdict
+
+# The package exports a function with the same name as the module.
+generate = sys.modules[encode_context.__module__]
+
+
+class WhitespaceEncoder(object):
+    """Text encoder stub with a token per word and one per line break."""
+
+    def __init__(self):
+        self.encoder = {'\n</w>': 0}
+
+    def encode(self, texts):
+        texts_tokens = []
+        for text in texts:
+            text = re.sub(r'\s*\n\s*', '\n', text.strip())
+            texts_tokens.append([self.encoder.setdefault(t + '</w>',
+                                                         len(self.encoder))
+                                 for t in re.findall(r'\S+|\n', text)])
+        return texts_tokens
+
+    def decode(self, X):
+        decoder = {v: k for k, v in self.encoder.items()}
+        return ' '.join(decoder.get(idx, '?</w>')[:-len('</w>')] for idx in X)
+
+
+class TestEncodeContext(TestCase):
+    def setUp(self):
+        self.text_encoder = WhitespaceEncoder()
+        patcher = patch.object(generate, '_text_encoder', self.text_encoder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _context(self, text, context_tokens):
+        X = encode_context(text, context_tokens)
+        return self.text_encoder.decode(X)
+
+    def test_fits(self):
+        text = 'One two. Three four!\n\nFive six'
+        self.assertEqual(encode_context(text, 100),
+                         self.text_encoder.encode([text])[0])
+
+    def test_snaps_to_sentence(self):
+        text = 'One two three. Four five. Six'
+        self.assertEqual(self._context(text, 4), 'Four five. Six')
+        self.assertEqual(self._context(text, 2), 'Six')
+
+    def test_snaps_to_paragraph(self):
+        text = 'One two\n\nThree four\nFive'
+        self.assertEqual(self._context(text, 4), 'Three four \n Five')
+        self.assertEqual(self._context(text, 3), 'Five')
+
+    def test_long_sentence(self):
+        text = 'One. Two three four five six'
+        self.assertEqual(self._context(text, 2), 'five six')
+
+    def test_trailing_line_break(self):
+        text = 'One two\n'
+        self.assertEqual(self._context(text, 10), 'One two')
+
+
+def patch_tiny_model(test_case, n_vocab=10, n_ctx=8):
+    """Run the model calls of a test with a small random model."""
+    torch.manual_seed(0)
+    text_encoder = WhitespaceEncoder()
+    text_encoder.n_vocab = n_vocab
+    text_encoder.decoder = {i: 'w{}</w>'.format(i) for i in range(n_vocab)}
+    cfg = dotdict(DEFAULT_CONFIG, n_embd=8, n_head=2, n_layer=1)
+    lm_model = LMModel(cfg, n_vocab + n_ctx, n_ctx, return_probs=True)
+    lm_model.eval()
+
+    patches = [
+        patch.object(generate, '_text_encoder', text_encoder),
+        patch.object(generate, '_lm_model', lm_model),
+        patch.object(generate, '_device', torch.device('cpu')),
+        patch.object(generate, '_result_cache', LRUCache(2 ** 20)),
+        patch.object(generate.config, 'n_ctx', n_ctx),
+    ]
+    for patcher in patches:
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+class TinyModelMixin(object):
+    """Runs the tests of a TestCase with a small random model."""
+
+    n_vocab = 10
+    n_ctx = 8
+
+    def setUp(self):
+        patch_tiny_model(self, self.n_vocab, self.n_ctx)
+
+    def _assert_positions(self, X):
+        self.assertLessEqual(X.size(1), self.n_ctx)
+        self.assertEqual(X[0, :, 1].tolist(),
+                         list(range(self.n_vocab, self.n_vocab + X.size(1))))
+
+
+class TestSlidingWindow(TinyModelMixin, TestCase):
+    def test_slide_window(self):
+        X = generate._make_batch(list(range(self.n_ctx)), self.n_vocab,
+                                 torch.device('cpu'))
+        X = generate._slide_window(X, 3)
+        self.assertEqual(X[0, :, 0].tolist(), list(range(3, self.n_ctx)))
+        self._assert_positions(X)
+
+    def test_generate_beyond_context(self):
+        for draft_len in [0, 4]:
+            with patch.object(generate.config, 'draft_len', draft_len):
+                state = generate._generate_state([1, 2, 3, 1, 2, 3], 20,
+                                                 None, None)
+            self.assertEqual(len(state.ids), 20)
+            X = state.batch
+            self.assertEqual(X[0, :, 0].tolist(),
+                             ([1, 2, 3, 1, 2, 3] + state.ids)[-X.size(1):])
+            self._assert_positions(state.batch)
+
+
+class TestResume(TinyModelMixin, TestCase):
+    def test_same_as_generating_at_once(self):
+        # The continuation outgrows the context, so resuming slides the
+        # window too.
+        torch.manual_seed(1)
+        state = generate.generate_state([1, 2, 3], gen_len=3)
+        state = generate.resume(state, gen_len=4)
+        state = generate.resume(state, gen_len=5)
+
+        torch.manual_seed(1)
+        expected = generate.generate_state([1, 2, 3], gen_len=12)
+        self.assertEqual(state.ids, expected.ids)
+        self.assertEqual(state.text, expected.text)
+        self.assertTrue(torch.equal(state.batch, expected.batch))
+
+    def test_default_gen_len(self):
+        state = generate.generate_state([1, 2, 3], gen_len=3)
+        with patch.object(generate.config, 'gen_len', 10):
+            self.assertEqual(len(generate.resume(state).ids), 10)
+            state = generate.resume(state, gen_len=9)
+            self.assertEqual(len(generate.resume(state).ids), 12)
+
+
+class TestPrefetch(TinyModelMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(generate.config, 'prefetch_cpu_share', 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_generate_from_cache(self):
+        self.assertTrue(generate.prefetch([1, 2, 3]))
+        with patch.object(generate, '_generate_state') as generate_state:
+            continuation = generate.generate([1, 2, 3])
+        generate_state.assert_not_called()
+        self.assertEqual(generate._result_cache.stats()['hits'], 1)
+        self.assertEqual(generate._result_cache.stats()['misses'], 0)
+        self.assertIsInstance(continuation, str)
+
+    def test_cancelled(self):
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertFalse(generate.prefetch([1, 2, 3], cancelled=cancelled))
+        self.assertEqual(len(generate._result_cache), 0)
+
+    def test_cpu_share(self):
+        with patch.object(generate.config, 'prefetch_cpu_share', 0):
+            self.assertFalse(generate.prefetch([1, 2, 3]))
+        self.assertEqual(len(generate._result_cache), 0)
+        for share in [-0.5, 1.5]:
+            with patch.object(generate.config, 'prefetch_cpu_share', share), \
+                    self.assertRaises(ValueError):
+                generate.prefetch([1, 2, 3])
+
+
+class TestLatencyTarget(TinyModelMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        controller = LatencyController()
+        # One second per generated token.
+        controller.observe(4, 10, 10)
+        controller.observe(2, 5, 5)
+        patches = [
+            patch.object(generate, '_latency', controller),
+            patch.object(generate.config, 'latency_target', 5.5),
+            patch.object(generate.config, 'gen_len', 20),
+            patch.object(generate.config, 'min_gen_len', 2),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shortens_generation(self):
+        state = generate.generate_state([1, 2, 3])
+        self.assertEqual(len(state.ids), 5)
+        self.assertEqual(generate.latency_stats()['observations'], 3)
+        self.assertEqual(generate.latency_stats()['gen_len'], 5)
+
+        with patch.object(generate.config, 'latency_target', None):
+            self.assertEqual(len(generate.generate_state([1, 2, 3]).ids), 20)
+
+
+class TestGenerateBatch(TinyModelMixin, TestCase):
+    def test_padding(self):
+        Xs = [[1, 2, 3, 4, 5], [6, 7], [3]]
+        padded = [X + [0] * (5 - len(X)) for X in Xs]
+        XMB = generate._make_batch(padded, self.n_vocab, torch.device('cpu'))
+        ends = torch.tensor([len(X) for X in Xs])
+        log_probs = generate._last_log_probs(generate._lm_model, XMB, ends)
+        for i, X in enumerate(Xs):
+            XMB = generate._make_batch(X, self.n_vocab, torch.device('cpu'))
+            probs = generate._lm_model(XMB)[0, -1]
+            self.assertTrue(torch.allclose(log_probs[i].exp(), probs,
+                                           atol=1e-6))
+
+    def test_generate_batch(self):
+        results = generate.generate_batch([[1, 2, 3], [4], [5, 6, 7, 8, 9]],
+                                          gen_len=3)
+        self.assertEqual(len(results), 3)
+        for continuation, logprobs in results:
+            self.assertEqual(len(continuation.split()), 3)
+            self.assertEqual(len(logprobs), 3)
+            self.assertTrue(all(logprob <= 0 for logprob in logprobs))
+
+    def test_invalid(self):
+        self.assertEqual(generate.generate_batch([], gen_len=3), [])
+        with self.assertRaises(ValueError):
+            generate.generate_batch([[1], []], gen_len=3)
+        with self.assertRaises(ValueError):
+            generate.generate_batch([[1]], gen_len=self.n_ctx)
+
+
+class TestWordLogProbs(TinyModelMixin, TestCase):
+    def test_token_log_probs(self):
+        Xs = [[1, 2, 3, 4], [5], [6, 7]]
+        scores = generate._token_log_probs(Xs)
+        self.assertEqual([len(s) for s in scores], [3, 0, 1])
+        for X, X_scores in zip(Xs, scores):
+            XMB = generate._make_batch(X, self.n_vocab, torch.device('cpu'))
+            probs = generate._lm_model(XMB)[0]
+            expected = [probs[i, idx].log().item()
+                        for i, idx in enumerate(X[1:])]
+            for score, expected_score in zip(X_scores, expected):
+                self.assertAlmostEqual(score, expected_score, places=4)
+
+    def test_word_log_probs(self):
+        texts = ['a b  c', '', ' '.join('abcab' * 3)]
+        results = generate.word_log_probs(texts)
+        self.assertEqual([(start, end) for start, end, _ in results[0]],
+                         [(0, 1), (2, 3), (5, 6)])
+        self.assertEqual(results[1], [])
+        # The last text is longer than the context.
+        self.assertEqual(len(results[2]), 15)
+        for text_results in results:
+            for _, _, log_prob in text_results:
+                self.assertLess(log_prob, 0)
+
+        with patch.object(generate, '_token_log_probs') as token_log_probs:
+            self.assertEqual(generate.word_log_probs(texts), results)
+        token_log_probs.assert_not_called()
+
+
+class TestScore(TinyModelMixin, TestCase):
+    def _expected(self, X, k, n_context):
+        """Log-probability of token k with n_context tokens of context."""
+        start = max(0, k - n_context)
+        return generate._token_log_probs([X[start:k + 1]])[0][-1]
+
+    def test_score(self):
+        texts = [[1, 2, 3], [4, 5, 6, 7, 8, 9, 1, 2, 3, 4, 5, 6, 7], 'a b']
+        for overlap in [1, 3, 7]:
+            with patch.object(generate.config, 'score_overlap', overlap):
+                scores = generate.score(texts)
+            self.assertEqual([len(s) for s in scores], [3, 13, 2])
+            X = [0] + texts[1]
+            start, end = 0, self.n_ctx
+            for k in range(1, len(X)):
+                if k == end:
+                    start = end - overlap
+                    end = start + self.n_ctx
+                # Tokens after the first window have at least `overlap`
+                # tokens of context.
+                self.assertGreaterEqual(k - start, min(k, overlap))
+                self.assertAlmostEqual(scores[1][k - 1],
+                                       self._expected(X, k, k - start),
+                                       places=4)
+
+    def test_batches(self):
+        texts = [[i % 9 + 1] * (i + 1) for i in range(20)]
+        expected = generate.score(texts)
+        with patch.object(generate, '_SCORE_BATCH_TOKENS', 16):
+            scores = generate.score(texts)
+        for text_scores, expected_scores in zip(scores, expected):
+            for score, expected_score in zip(text_scores, expected_scores):
+                self.assertAlmostEqual(score, expected_score, places=4)
@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+from .latency import LatencyController
+
+
+def _latency(context_tokens, gen_len, per_token=0.01, per_prompt_token=1e-4):
+    return gen_len * per_token + per_prompt_token * (
+        gen_len * context_tokens + gen_len * (gen_len - 1) / 2)
+
+
+class TestLatencyController(TestCase):
+    def _observe(self, controller, sizes, **timings):
+        for context_tokens, gen_len in sizes:
+            controller.observe(context_tokens, gen_len,
+                               _latency(context_tokens, gen_len, **timings))
+
+    def test_no_observations(self):
+        controller = LatencyController()
+        self.assertIsNone(controller.timings())
+        self.assertEqual(controller.lengths(0.1, 256, 20), (256, 20))
+
+    def test_timings(self):
+        controller = LatencyController()
+        self._observe(controller, [(256, 20), (100, 5), (30, 20)])
+        per_token, per_prompt_token = controller.timings()
+        self.assertAlmostEqual(per_token, 0.01)
+        self.assertAlmostEqual(per_prompt_token, 1e-4)
+        self.assertAlmostEqual(controller.predict(50, 10), _latency(50, 10))
+
+    def test_single_size(self):
+        controller = LatencyController()
+        self._observe(controller, [(256, 20)] * 3)
+        self.assertAlmostEqual(controller.predict(256, 20), _latency(256, 20))
+
+    def test_lengths(self):
+        controller = LatencyController()
+        self._observe(controller, [(256, 20), (100, 5)])
+        self.assertEqual(controller.lengths(10, 256, 20), (256, 20))
+
+        target = _latency(128.5, 20)
+        self.assertEqual(controller.lengths(target, 256, 20, 32, 4), (128, 20))
+
+        # The context is shortened to the minimum before the completions.
+        target = _latency(32.5, 10)
+        self.assertEqual(controller.lengths(target, 256, 20, 32, 4), (32, 10))
+        self.assertEqual(controller.gen_len(target, 32, 20, 4), 10)
+        self.assertEqual(controller.lengths(0, 256, 20, 32, 4), (32, 4))
+
+    def test_follows_load(self):
+        controller = LatencyController(decay=0.5)
+        sizes = [(256, 20), (100, 5)]
+        self._observe(controller, sizes)
+        target = _latency(256.5, 20)
+        self.assertEqual(controller.lengths(target, 256, 20), (256, 20))
+
+        # The host gets twice as slow.
+        self._observe(controller, sizes * 10, per_token=0.02,
+                      per_prompt_token=2e-4)
+        context_tokens, gen_len = controller.lengths(target, 256, 20)
+        self.assertLess(context_tokens, 256)
+        self.assertLessEqual(
+            _latency(context_tokens, gen_len, 0.02, 2e-4), target * 1.01)
+
+        self._observe(controller, sizes * 10)
+        self.assertEqual(controller.lengths(target, 256, 20), (256, 20))
+
+    def test_stats(self):
+        controller = LatencyController()
+        self.assertEqual(controller.stats()['observations'], 0)
+        controller.observe(100, 10, 0.5)
+        stats = controller.stats()
+        self.assertEqual(stats['observations'], 1)
+        self.assertEqual((stats['context_tokens'], stats['gen_len'],
+                          stats['seconds']), (100, 10, 0.5))
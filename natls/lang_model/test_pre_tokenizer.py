@@ -0,0 +1,92 @@
+import unittest
+from unittest import TestCase
+
+import ftfy
+
+from .pre_tokenizer import pre_tokenize
+from .text_encoder import text_standardize
+
+try:
+    import spacy
+except ImportError:
+    spacy = None
+
+CORPUS = [
+    "I'm sure you'll like it. Don't worry, he's fine; they'd've gone.",
+    "Mr. Smith & Dr. Jones met at 5pm in the U.S., e.g. at St. Louis.",
+    'Well, its shell was ill... Price: $5.00 (approx. 10%). It was 3.5km!',
+    'She said “yes” — then left… Café, naïve résumé. C\'mon y\'all, gonna '
+    'cannot Can\'t WON\'T o\'clock.',
+    'Email me at jane.doe@example.com or see https://example.com/a?b=c#d.',
+    "The '90s were fun. Rock 'n' roll ''quoted'' text: A.B.C. vs. x.y.z",
+    'Numbers: 1,000,000 3-4 5*6 2^10 10km/h 20°C. 100MB 1.5x 7am 12p.m.',
+    'Emoticons :) :-( <3 and symbols ★ → ✓ ☺ 😀 in text.\n\nNew paragraph.',
+    'He wrote hello.World and foo:bar, a<b>c, x=y and/or w/o help.',
+    'tabs\tand  double  spaces   and trailing space ',
+    "Let's see: what's up? Who'd've thought; how'd'y do.",
+]
+# The tokens of the standardized CORPUS texts as split by spaCy's English
+# tokenizer (spacy.blank('en') of spaCy 3.8), so that the pre-tokenizer is
+# checked against spaCy even if it isn't installed.
+SPACY_TOKENS = [
+    ['I', "'m", 'sure', 'you', "'ll", 'like', 'it', '.', 'Do', "n't", 'worry',
+     ',', 'he', "'s", 'fine', ';', 'they', "'d", "'ve", 'gone', '.'],
+    ['Mr.', 'Smith', '&', 'Dr.', 'Jones', 'met', 'at', '5', 'pm', 'in', 'the',
+     'U.S.', ',', 'e.g.', 'at', 'St.', 'Louis', '.'],
+    ['Well', ',', 'its', 'shell', 'was', 'ill', '...', 'Price', ':', '$',
+     '5.00', '(', 'approx', '.', '10', '%', ')', '.', 'It', 'was', '3.5', 'km',
+     '!'],
+    ['She', 'said', '"', 'yes', '"', '-', 'then', 'left', '...', 'Café', ',',
+     'naïve', 'résumé', '.', "C'm", 'on', "y'", 'all', ',', 'gon', 'na', 'can',
+     'not', 'Ca', "n't", "WON'T", "o'clock", '.'],
+    ['Email', 'me', 'at', 'jane.doe@example.com', 'or', 'see', 'https', ':',
+     '//', 'example.com', '/', 'a', '?', 'b', '=', 'c#d', '.'],
+    ['The', "'", '90s', 'were', 'fun', '.', 'Rock', "'", 'n', "'", 'roll',
+     "''", 'quoted', "''", 'text', ':', 'A.B.C.', 'vs.', 'x.y.z'],
+    ['Numbers', ':', '1', ',', '000', ',', '000', '3', '-', '4', '5', '*', '6',
+     '2', '^', '10', '10', 'km', '/', 'h', '20', '°', 'C', '.', '100', 'MB',
+     '1.5x', '7', 'am', '12', 'p.m.'],
+    ['Emoticons', ':', ')', ':', '-', '(', '<3', 'and', 'symbols', '★', '→',
+     '✓', '☺', '😀', 'in', 'text', '.', '\n ', 'New', 'paragraph', '.'],
+    ['He', 'wrote', 'hello', '.', 'World', 'and', 'foo', ':', 'bar', ',', 'a',
+     '<', 'b', '>', 'c', ',', 'x', '=', 'y', 'and', '/', 'or', 'w', '/', 'o',
+     'help', '.'],
+    ['tabs', 'and', 'double', 'spaces', 'and', 'trailing', 'space'],
+    ['Let', "'s", 'see', ':', 'what', "'s", 'up', '?', 'Who', "'d", "'ve",
+     'thought', ';', 'how', "'d", "'y", 'do', '.'],
+]
+
+
+class TestPreTokenize(TestCase):
+    def test_contractions(self):
+        self.assertEqual(pre_tokenize("I don't think he'll go"),
+                         ['I', 'do', "n't", 'think', 'he', "'ll", 'go'])
+
+    def test_excluded_contractions(self):
+        self.assertEqual(pre_tokenize('well its shell'),
+                         ['well', 'its', 'shell'])
+
+    def test_abbreviations(self):
+        self.assertEqual(pre_tokenize('Mr. Smith at 5pm.'),
+                         ['Mr.', 'Smith', 'at', '5', 'pm', '.'])
+
+    def test_line_break(self):
+        self.assertEqual(pre_tokenize(text_standardize('One.\n\nTwo')),
+                         ['One', '.', '\n ', 'Two'])
+
+    def test_url(self):
+        self.assertEqual(pre_tokenize('see https://example.com/a?b=c.'),
+                         ['see', 'https://example.com/a?b=c', '.'])
+
+    def test_same_as_spacy_tokens(self):
+        for text, tokens in zip(CORPUS, SPACY_TOKENS):
+            text = text_standardize(ftfy.fix_text(text))
+            self.assertEqual(pre_tokenize(text), tokens)
+
+    @unittest.skipUnless(spacy, 'spaCy is not installed')
+    def test_same_as_spacy(self):
+        nlp = spacy.blank('en')
+        for text in CORPUS:
+            text = text_standardize(ftfy.fix_text(text))
+            self.assertEqual(pre_tokenize(text),
+                             [token.text for token in nlp(text)])
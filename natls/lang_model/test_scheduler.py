@@ -0,0 +1,94 @@
+import threading
+import time
+from unittest import TestCase
+
+from .scheduler import Cancelled, FairSemaphore, cancel_context, \
+    client_context, current_client, raise_if_cancelled
+
+
+class TestFairSemaphore(TestCase):
+    def _wait_for(self, semaphore, n_waiting):
+        deadline = time.monotonic() + 5
+        while semaphore.n_waiting < n_waiting:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_round_robin(self):
+        semaphore = FairSemaphore()
+        semaphore.acquire()
+        order = []
+
+        def call(client, name):
+            with client_context(client):
+                with semaphore:
+                    order.append(name)
+
+        threads = []
+        calls = [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1'),
+                 ('c', 'c1'), ('b', 'b2')]
+        for n_waiting, (client, name) in enumerate(calls, 1):
+            thread = threading.Thread(target=call, args=(client, name))
+            thread.start()
+            threads.append(thread)
+            self._wait_for(semaphore, n_waiting)
+
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['a1', 'b1', 'c1', 'a2', 'b2', 'a3'])
+
+    def test_background(self):
+        semaphore = FairSemaphore()
+        semaphore.acquire()
+        order = []
+
+        def call(name, background):
+            semaphore.acquire(background=background)
+            order.append(name)
+            semaphore.release()
+
+        threads = [threading.Thread(target=call, args=('background', True))]
+        threads[0].start()
+        time.sleep(0.01)
+        threads.append(threading.Thread(target=call, args=('client', False)))
+        threads[1].start()
+        self._wait_for(semaphore, 1)
+
+        semaphore.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['client', 'background'])
+
+    def test_slots(self):
+        semaphore = FairSemaphore(2)
+        semaphore.acquire()
+        semaphore.acquire()
+        acquired = threading.Event()
+
+        def call():
+            semaphore.acquire()
+            acquired.set()
+
+        threading.Thread(target=call).start()
+        self._wait_for(semaphore, 1)
+        self.assertFalse(acquired.is_set())
+        semaphore.release()
+        self.assertTrue(acquired.wait(5))
+
+    def test_client_context(self):
+        self.assertIsNone(current_client())
+        with client_context(1):
+            with client_context(2):
+                self.assertEqual(current_client(), 2)
+            self.assertEqual(current_client(), 1)
+        self.assertIsNone(current_client())
+
+    def test_cancel_context(self):
+        cancelled = threading.Event()
+        raise_if_cancelled()
+        with cancel_context(cancelled):
+            raise_if_cancelled()
+            cancelled.set()
+            with self.assertRaises(Cancelled):
+                raise_if_cancelled()
+        raise_if_cancelled()
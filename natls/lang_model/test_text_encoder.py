@@ -0,0 +1,207 @@
+import collections
+import json
+import marshal
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+import ftfy
+
+from .text_encoder import COMPILED_VERSION, TextEncoder, get_pairs, \
+    normalize, text_standardize
+
+WORDS = ('the quick brown fox jumps over the lazy dog while the other '
+         'dogs sleep there then they went to sleep and slept deeply').split()
+
+
+def learn_merges(words, n_merges):
+    """Learn BPE merges the way the vocabulary was built."""
+    vocab = collections.Counter(
+        tuple(word[:-1]) + (word[-1] + '</w>',) for word in words)
+    merges = []
+    for _ in range(n_merges):
+        counts = collections.Counter()
+        for word, count in vocab.items():
+            for pair in zip(word, word[1:]):
+                counts[pair] += count
+        if not counts:
+            break
+        pair = max(counts, key=lambda p: (counts[p], p))
+        merges.append(pair)
+        new_vocab = collections.Counter()
+        for word, count in vocab.items():
+            new_word = []
+            i = 0
+            while i < len(word):
+                if word[i:i + 2] == pair:
+                    new_word.append(pair[0] + pair[1])
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            new_vocab[tuple(new_word)] += count
+        vocab = new_vocab
+    return merges
+
+
+def reference_bpe(bpe_ranks, token):
+    """The original BPE that rescans all pairs after each merge."""
+    word = tuple(token[:-1]) + (token[-1] + '</w>',)
+    pairs = get_pairs(word)
+    if not pairs:
+        return token + '</w>'
+    while True:
+        bigram = min(pairs,
+                     key=lambda pair: bpe_ranks.get(pair, float('inf')))
+        if bigram not in bpe_ranks:
+            break
+        first, second = bigram
+        new_word = []
+        i = 0
+        while i < len(word):
+            try:
+                j = word.index(first, i)
+                new_word.extend(word[i:j])
+                i = j
+            except ValueError:
+                new_word.extend(word[i:])
+                break
+            if word[i] == first and i < len(word) - 1 and \
+                    word[i + 1] == second:
+                new_word.append(first + second)
+                i += 2
+            else:
+                new_word.append(word[i])
+                i += 1
+        word = tuple(new_word)
+        if len(word) == 1:
+            break
+        pairs = get_pairs(word)
+    return ' '.join(word)
+
+
+def write_vocab(dirname, n_merges=60):
+    """Write a vocabulary learned from `WORDS` and return the paths."""
+    merges = learn_merges(WORDS, n_merges)
+    bpe_path = os.path.join(dirname, 'vocab.bpe')
+    with open(bpe_path, 'w', encoding='utf-8') as f:
+        f.write('#version: 0.2\n')
+        for first, second in merges:
+            f.write('{} {}\n'.format(first, second))
+
+    tokens = set(c for word in WORDS for c in word)
+    tokens.update(c + '</w>' for word in WORDS for c in word)
+    tokens.update(first + second for first, second in merges)
+    encoder_path = os.path.join(dirname, 'encoder.json')
+    with open(encoder_path, 'w') as f:
+        json.dump({token: i for i, token in enumerate(sorted(tokens))}, f)
+    return encoder_path, bpe_path
+
+
+class TestBPE(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        encoder_path, bpe_path = write_vocab(tmpdir.name)
+        self.text_encoder = TextEncoder(encoder_path, bpe_path, cache_size=4)
+
+    def test_same_as_reference(self):
+        rng = random.Random(0)
+        letters = 'abdeghilnopqrstuvwxyz'
+        tokens = WORDS + ['thethe', 'sleepsleep', 'eee', 'a', 'ab']
+        tokens += [''.join(rng.choice(letters)
+                           for _ in range(rng.randint(2, 30)))
+                   for _ in range(200)]
+        for token in tokens:
+            self.assertEqual(self.text_encoder.bpe(token),
+                             reference_bpe(self.text_encoder.bpe_ranks, token),
+                             token)
+
+    def test_decode_joins_word_pieces(self):
+        text = 'the lazy dogs slept while foxes jumped'
+        ids = self.text_encoder.encode([text])[0]
+        self.assertGreater(len(ids), len(text.split()))
+        self.assertEqual(self.text_encoder.decode(ids), text)
+        self.assertEqual(self.text_encoder.decode([]), '')
+
+    def test_cache_is_bounded(self):
+        for word in WORDS:
+            self.text_encoder.bpe(word)
+        self.text_encoder.bpe(WORDS[-1])
+        stats = self.text_encoder.cache.stats()
+        self.assertEqual(stats['items'], 4)
+        self.assertEqual(stats['hits'], 2)
+
+
+class TestCompiled(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.encoder_path, self.bpe_path = write_vocab(tmpdir.name)
+        self.compiled_path = os.path.join(tmpdir.name, 'tokenizer.bin')
+
+    def test_same_as_sources(self):
+        text_encoder = TextEncoder(self.encoder_path, self.bpe_path)
+        text_encoder.compile(self.compiled_path, ['jumped'])
+        compiled = TextEncoder(None, None, compiled_path=self.compiled_path)
+
+        self.assertEqual(compiled.encoder, text_encoder.encoder)
+        self.assertEqual(compiled.bpe_ranks, text_encoder.bpe_ranks)
+        self.assertIn('the', compiled.word_ids)
+        self.assertIn('jumped', compiled.word_ids)
+        texts = [' '.join(WORDS), 'The dog jumped. The fox slept!', 'xyz']
+        self.assertEqual(compiled.encode(texts), text_encoder.encode(texts))
+        self.assertEqual(compiled.decoder, text_encoder.decoder)
+        ids = text_encoder.encode(texts)[0]
+        self.assertEqual(compiled.decode(ids), text_encoder.decode(ids))
+
+    def test_stale(self):
+        text_encoder = TextEncoder(self.encoder_path, self.bpe_path)
+        text_encoder.compile(self.compiled_path)
+        compiled = TextEncoder(self.encoder_path, self.bpe_path,
+                               compiled_path=self.compiled_path)
+        self.assertTrue(compiled.word_ids)
+
+        # The merges change after the tokenizer was compiled.
+        with open(self.bpe_path, encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        with open(self.bpe_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines[:1] + lines[2:]))
+        text_encoder = TextEncoder(self.encoder_path, self.bpe_path,
+                                   compiled_path=self.compiled_path)
+        self.assertEqual(text_encoder.word_ids, {})
+        self.assertEqual(len(text_encoder.bpe_ranks),
+                         len(compiled.bpe_ranks) - 1)
+
+    def test_missing(self):
+        text_encoder = TextEncoder(self.encoder_path, self.bpe_path,
+                                   compiled_path=self.compiled_path)
+        self.assertEqual(text_encoder.word_ids, {})
+
+    def test_version_mismatch(self):
+        with open(self.compiled_path, 'wb') as f:
+            marshal.dump({'version': COMPILED_VERSION + 1, 'encoder': {},
+                          'bpe_ranks': {}, 'word_ids': {}}, f)
+        text_encoder = TextEncoder(self.encoder_path, self.bpe_path,
+                                   compiled_path=self.compiled_path)
+        self.assertTrue(text_encoder.encoder)
+
+
+class TestNormalize(TestCase):
+    def test_same_as_ftfy_and_standardize(self):
+        texts = [
+            '', ' ', '\n', 'Plain text.', ' One, two -- three!!\n\n  Four ',
+            'Tabs\tand\r\nwindows\rline breaks', 'Caf\u00e9 \u2014 na\u00efve',
+            '\u201cCurly\u201d quotes\u2019 and \u2026 ellipsis\u00b4',
+            'Fish &amp; chips &lt;3', '\x1b[31mred\x1b[0m', 'mojibake: caf\u00c3\u00a9',
+            'line\u2028separator\x0bvertical\x0cfeed', 'a_b|c/d\\e*f[g]h{i}j~k+l'
+        ]
+        rng = random.Random(0)
+        chars = list('ab XY 09.,;:!?-~"\'()[]{}|\\/*_+&<>\n\t\r\x0b\x85 '
+                     '\u2014\u2013\u2015\u2026\u00b4\u2019\u201c\u00e9\x00')
+        texts += [''.join(rng.choice(chars) for _ in range(rng.randint(0, 30)))
+                  for _ in range(1000)]
+        for text in texts:
+            self.assertEqual(normalize(text),
+                             text_standardize(ftfy.fix_text(text)), repr(text))
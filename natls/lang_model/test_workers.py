@@ -0,0 +1,93 @@
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+import torch
+
+from .generate import encode_context
+from .gpt_lang_model import DEFAULT_CONFIG, LMModel, dotdict
+from .scheduler import FairSemaphore
+from .test_generate import WhitespaceEncoder
+from .workers import WorkerPool, _error_message, _RemoteTraceback
+
+# The package exports a function with the same name as the module.
+generate = sys.modules[encode_context.__module__]
+
+
+class TestWorkerPool(TestCase):
+    n_vocab = 10
+    n_ctx = 8
+
+    @classmethod
+    def setUpClass(cls):
+        text_encoder = WhitespaceEncoder()
+        text_encoder.n_vocab = cls.n_vocab
+        # The model also predicts position ids.
+        text_encoder.decoder = {i: 'w{}</w>'.format(i)
+                                for i in range(cls.n_vocab + cls.n_ctx)}
+        cfg = dotdict(DEFAULT_CONFIG, n_embd=8, n_head=2, n_layer=1)
+        cls.lm_model = LMModel(cfg, cls.n_vocab + cls.n_ctx, cls.n_ctx,
+                               return_probs=True)
+        cls.lm_model.eval()
+        settings = {'n_ctx': cls.n_ctx, 'draft_len': 0, 'word_lookahead': 1}
+        cls.pool = WorkerPool(cls.lm_model, 2, 1, torch.device('cpu'),
+                              settings, text_encoder)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_weights_are_shared(self):
+        for param in self.lm_model.parameters():
+            self.assertTrue(param.is_shared())
+
+    def test_generate_state(self):
+        progress = []
+        state = self.pool.call('_generate_state', [1, 2, 3], 5, None,
+                               callback=progress.append)
+        self.assertEqual(len(state.ids), 5)
+        self.assertEqual(state.batch[0, :, 0].tolist(),
+                         ([1, 2, 3] + state.ids)[-self.n_ctx:])
+        self.assertEqual(len(progress), 5)
+
+        state = self.pool.call('_resume', state, 2)
+        self.assertEqual(len(state.ids), 7)
+
+    def test_next_words(self):
+        words = self.pool.call('_next_words', [1, 2, 3], 3)
+        self.assertEqual(len(words), 3)
+
+    def test_dispatch(self):
+        with patch.object(generate, '_workers', self.pool), \
+                patch.object(generate, '_worker_slots', FairSemaphore(2)):
+            states = [generate.generate_state([1, 2, i], 3) for i in range(4)]
+        self.assertEqual([len(state.ids) for state in states], [3] * 4)
+
+    def test_error(self):
+        # topk of more tokens than the vocabulary has.
+        with self.assertRaises(RuntimeError) as cm:
+            self.pool.call('_next_words', [1, 2, 3],
+                           self.n_vocab + self.n_ctx + 1)
+        self.assertIsInstance(cm.exception.__cause__, _RemoteTraceback)
+        self.assertIn('_next_words', str(cm.exception.__cause__))
+
+        # The exception keeps its class.
+        with self.assertRaises(TypeError):
+            self.pool.call('_next_words', [1, 2, 3], 'k')
+
+    def test_error_message(self):
+        class Unpicklable(Exception):
+            pass
+
+        try:
+            raise Unpicklable('Local classes can\'t be pickled')
+        except Unpicklable as e:
+            error, traceback_text = _error_message(e)
+        self.assertIsInstance(error, RuntimeError)
+        self.assertEqual(str(error),
+                         'Unpicklable: Local classes can\'t be pickled')
+        self.assertIn('test_error_message', traceback_text)
+
+    def test_start_no_workers(self):
+        with self.assertRaises(ValueError):
+            generate.start_workers(0)
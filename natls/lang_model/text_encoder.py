@@ -26,11 +26,23 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import hashlib
+import heapq
+import itertools
+import logging
+import marshal
+import os
 import re
 import json
 
 import ftfy
-import en_core_web_sm
+import numpy as np
+
+from .cache import LRUCache
+from .pre_tokenizer import pre_tokenize
+
+# Bump when the layout of compiled tokenizers changes.
+COMPILED_VERSION = 2
 
 
 def get_pairs(word):
@@ -62,70 +74,277 @@ def text_standardize(text):
     return text.strip()
 
 
+_STANDARDIZE_TABLE = str.maketrans({
+    '—': '-',
+    '–': '-',
+    '―': '-',
+    '…': '...',
+    '´': "'",
+})
+_RE_PUNCT = re.compile(r'''(-+|~+|!+|"+|;+|\?+|\++|,+|\)+|\(+|\\+|\/+|\*+|\[+|\]+|}+|{+|\|+|_+)''')
+# Text without these is left unchanged by ftfy: printable ASCII, tabs and line
+# feeds. HTML entities start with "&".
+_RE_NEEDS_FIX = re.compile(r'[^\t\n\x20-\x7e]|&')
+
+
+def standardize(text):
+    """Same as `text_standardize`, but with fewer passes over the text."""
+    text = _RE_PUNCT.sub(r' \1 ', text.translate(_STANDARDIZE_TABLE))
+    return ' \n '.join(' '.join(words)
+                       for words in (line.split() for line in text.split('\n'))
+                       if words)
+
+
+def normalize(text):
+    """Fix and standardize text for encoding.
+
+    Equivalent to `text_standardize(ftfy.fix_text(text))`, but ftfy is skipped
+    for plain ASCII text, which it doesn't change.
+    """
+    if _RE_NEEDS_FIX.search(text):
+        text = ftfy.fix_text(text)
+    return standardize(text)
+
+
 class TextEncoder(object):
-    """Wrapper for a public python bpe tokenizer."""
+    """Wrapper for a public python bpe tokenizer.
+
+    Words are split with `pre_tokenize` by default. Pass
+    `pre_tokenizer='spacy'` to split them with the spaCy model instead. The
+    BPE of the most recent `cache_size` words is cached.
 
-    def __init__(self, encoder_path, bpe_path):
-        # Spacy language model.
-        self.nlp = en_core_web_sm.load(disable=['parser', 'tagger', 'ner',
-                                                'textcat'])
-        self.encoder = json.load(open(encoder_path))
+    If `compiled_path` points to a tokenizer written by `compile`, the
+    vocabulary, the merges, the decoding tables and the token ids of common
+    words are loaded from it instead of parsing the source files. A compiled
+    tokenizer is ignored if the source files have changed since it was
+    written.
+    """
+
+    def __init__(self, encoder_path, bpe_path, pre_tokenizer='regex',
+                 cache_size=2 ** 16, compiled_path=None):
+        if pre_tokenizer == 'spacy':
+            import en_core_web_sm
+            # Spacy language model.
+            nlp = en_core_web_sm.load(disable=['parser', 'tagger', 'ner',
+                                               'textcat'])
+            self.pre_tokenize = lambda text: [t.text for t in nlp(text)]
+        elif pre_tokenizer == 'regex':
+            self.pre_tokenize = pre_tokenize
+        else:
+            raise ValueError(
+                'Unknown pre-tokenizer: {}'.format(pre_tokenizer))
+        self.encoder_path = encoder_path
+        self.bpe_path = bpe_path
+        compiled = _load_compiled(
+            compiled_path, _source_hash(encoder_path, bpe_path)) \
+            if compiled_path else None
+        if compiled is not None:
+            self.encoder = compiled['encoder']
+            self.bpe_ranks = compiled['bpe_ranks']
+            # Token ids of words that don't need BPE.
+            self.word_ids = compiled['word_ids']
+            self.decoder = compiled['decoder']
+            self.decode_table = np.array(compiled['decode_table'],
+                                         dtype=object)
+            self.ends_word = np.frombuffer(compiled['ends_word'], dtype=bool)
+        else:
+            self.encoder = json.load(open(encoder_path))
+            merges = open(bpe_path, encoding='utf-8').read().split('\n')[1:-1]
+            merges = [tuple(merge.split()) for merge in merges]
+            self.bpe_ranks = dict(zip(merges, range(len(merges))))
+            self.word_ids = {}
+            self.decoder = {v:k for k,v in self.encoder.items()}
+            self.decode_table, self.ends_word = _decode_tables(self.decoder)
         self.n_vocab = len(self.encoder)
-        self.decoder = {v:k for k,v in self.encoder.items()}
-        merges = open(bpe_path, encoding='utf-8').read().split('\n')[1:-1]
-        merges = [tuple(merge.split()) for merge in merges]
-        self.bpe_ranks = dict(zip(merges, range(len(merges))))
-        self.cache = {}
+        # Counts entries instead of bytes.
+        self.cache = LRUCache(cache_size, sizeof=lambda _: 1)
 
-    def bpe(self, token):
-        word = tuple(token[:-1]) + ( token[-1] + '</w>',)
-        if token in self.cache:
-            return self.cache[token]
-        pairs = get_pairs(word)
+    def compile(self, path, words=()):
+        """Write the tokenizer to a file that loads faster than the sources.
 
-        if not pairs:
-            return token+'</w>'
+        The token ids of the words that are tokens of the vocabulary, which
+        are the most frequent words of the corpus that the merges were learned
+        on, are stored so that encoding them skips BPE.
+
+        Arguments:
+            path: The path of the compiled tokenizer.
+            words: Optional iterable of additional lowercase words whose token
+                ids are stored.
+        """
+        vocab_words = [token[:-len('</w>')] for token in self.encoder
+                       if token.endswith('</w>') and len(token) > len('</w>')]
+        word_ids = {}
+        for word in itertools.chain(vocab_words, words):
+            word_ids[word] = tuple(self.encoder.get(t, 0)
+                                   for t in self.bpe(word).split(' '))
+        compiled = {
+            'version': COMPILED_VERSION,
+            'source_hash': _source_hash(self.encoder_path, self.bpe_path),
+            'encoder': self.encoder,
+            'bpe_ranks': self.bpe_ranks,
+            'word_ids': word_ids,
+            'decoder': self.decoder,
+            'decode_table': self.decode_table.tolist(),
+            'ends_word': self.ends_word.tobytes()
+        }
+        # Write to a temporary file first so that a running server never
+        # loads a partial file.
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(compiled, f)
+        os.replace(tmp_path, path)
 
-        while True:
-            bigram = min(pairs, key = lambda pair: self.bpe_ranks.get(pair, float('inf')))
-            if bigram not in self.bpe_ranks:
-                break
-            first, second = bigram
-            new_word = []
-            i = 0
-            while i < len(word):
-                try:
-                    j = word.index(first, i)
-                    new_word.extend(word[i:j])
-                    i = j
-                except:
-                    new_word.extend(word[i:])
-                    break
-
-                if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                    new_word.append(first+second)
-                    i += 2
-                else:
-                    new_word.append(word[i])
-                    i += 1
-            new_word = tuple(new_word)
-            word = new_word
-            if len(word) == 1:
-                break
-            else:
-                pairs = get_pairs(word)
-        word = ' '.join(word)
-        if word == '\n  </w>':
-            word = '\n</w>'
-        self.cache[token] = word
+    def bpe(self, token):
+        if len(token) < 2:
+            return token+'</w>'
+        word = self.cache.get(token)
+        if word is None:
+            word = ' '.join(self._merge(token))
+            if word == '\n  </w>':
+                word = '\n</w>'
+            self.cache.put(token, word)
         return word
 
+    def _merge(self, token):
+        """Apply the merges to a token in rank order.
+
+        The symbols are a linked list and the candidate pairs a heap ordered
+        by rank and position, so each merge costs O(log n) instead of a scan
+        over the whole word. Pairs in the heap that a merge invalidated are
+        skipped when popped.
+        """
+        symbols = list(token[:-1]) + [token[-1] + '</w>']
+        n = len(symbols)
+        prev = list(range(-1, n - 1))
+        next_ = list(range(1, n + 1))
+        bpe_ranks = self.bpe_ranks
+
+        heap = []
+        for i in range(n - 1):
+            rank = bpe_ranks.get((symbols[i], symbols[i + 1]))
+            if rank is not None:
+                heap.append((rank, i, symbols[i], symbols[i + 1]))
+        heapq.heapify(heap)
+
+        while heap:
+            rank, i, first, second = heapq.heappop(heap)
+            j = next_[i]
+            if symbols[i] != first or j >= n or symbols[j] != second:
+                continue
+
+            symbols[i] = first + second
+            symbols[j] = None
+            next_[i] = next_[j]
+            if next_[j] < n:
+                prev[next_[j]] = i
+
+            if prev[i] >= 0:
+                pair = (symbols[prev[i]], symbols[i])
+                rank = bpe_ranks.get(pair)
+                if rank is not None:
+                    heapq.heappush(heap, (rank, prev[i]) + pair)
+            if next_[i] < n:
+                pair = (symbols[i], symbols[next_[i]])
+                rank = bpe_ranks.get(pair)
+                if rank is not None:
+                    heapq.heappush(heap, (rank, i) + pair)
+
+        return [symbol for symbol in symbols if symbol is not None]
+
+    def decode(self, ids):
+        """Join token ids into text.
+
+        Pieces of a word are joined and words are separated by spaces. Ids
+        that aren't in the vocabulary are ignored.
+
+        Arguments:
+            ids: Sequence or array of token ids.
+
+        Returns: The text as a string.
+
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = ids[(ids >= 0) & (ids < len(self.decode_table))]
+        separators = np.where(self.ends_word[ids], ' ', '').astype(object)
+        return ''.join((self.decode_table[ids] + separators).tolist()) \
+            .rstrip(' ')
+
     def encode(self, texts):
         texts_tokens = []
         for text in texts:
-            text = self.nlp(text_standardize(ftfy.fix_text(text)))
+            text = self.pre_tokenize(normalize(text))
             text_tokens = []
             for token in text:
-                text_tokens.extend([self.encoder.get(t, 0) for t in self.bpe(token.text.lower()).split(' ')])
+                token = token.lower()
+                ids = self.word_ids.get(token)
+                if ids is None:
+                    ids = [self.encoder.get(t, 0) for t in self.bpe(token).split(' ')]
+                text_tokens.extend(ids)
             texts_tokens.append(text_tokens)
         return texts_tokens
+
+
+def _decode_tables(decoder):
+    """Return the decoding tables of a vocabulary.
+
+    Arguments:
+        decoder: Dict that maps token ids to tokens.
+
+    Returns: A (decode_table, ends_word) tuple of arrays indexed by token id
+        with the tokens without the end of word marker and whether the tokens
+        end a word.
+
+    """
+    n_ids = max(decoder, default=-1) + 1
+    decode_table = np.full(n_ids, '', dtype=object)
+    ends_word = np.zeros(n_ids, dtype=bool)
+    for idx, token in decoder.items():
+        ends_word[idx] = token.endswith('</w>')
+        decode_table[idx] = token.replace('</w>', '')
+    return decode_table, ends_word
+
+
+def _source_hash(encoder_path, bpe_path):
+    """Hash the source files of a tokenizer or return None if one is missing."""
+    if encoder_path is None or bpe_path is None:
+        return None
+    source_hash = hashlib.blake2b(digest_size=16)
+    try:
+        for path in [encoder_path, bpe_path]:
+            with open(path, 'rb') as f:
+                source_hash.update(f.read())
+    except FileNotFoundError:
+        return None
+    return source_hash.hexdigest()
+
+
+def _load_compiled(path, source_hash=None):
+    """Load a compiled tokenizer or return None if it's missing or stale.
+
+    Arguments:
+        path: The path of the compiled tokenizer.
+        source_hash: The `_source_hash` of the source files or None to skip
+            checking that the compiled tokenizer was written from them.
+    """
+    log = logging.getLogger(__name__)
+    try:
+        with open(path, 'rb') as f:
+            compiled = marshal.load(f)
+    except FileNotFoundError:
+        log.info('No compiled tokenizer at %s', path)
+        return None
+    except (EOFError, ValueError, TypeError):
+        log.warning('Invalid compiled tokenizer at %s', path)
+        return None
+
+    if not isinstance(compiled, dict) or \
+            compiled.get('version') != COMPILED_VERSION:
+        log.warning('Ignoring compiled tokenizer at %s with a different '
+                    'version, compile it again', path)
+        return None
+    if source_hash is not None and compiled.get('source_hash') != source_hash:
+        log.warning('Ignoring compiled tokenizer at %s, because the '
+                    'vocabulary or the merges have changed, compile it '
+                    'again', path)
+        return None
+    return compiled
@@ -0,0 +1,215 @@
+"""Model worker processes that share the weights of one model."""
+
+import importlib
+import itertools
+import logging
+import pickle
+import queue
+import threading
+import traceback
+from concurrent.futures import Future
+
+import torch
+import torch.multiprocessing
+
+# How often the result reader checks whether the workers are alive in seconds.
+_POLL_INTERVAL = 1
+
+# Kinds of messages from the workers.
+_RESULT = 'result'
+_ERROR = 'error'
+_PROGRESS = 'progress'
+
+
+class WorkerPool(object):
+    """Runs functions of the `generate` module in worker processes.
+
+    The weights of the model are moved to shared memory once and mapped by
+    every worker, so the workers don't load the model again and don't need
+    more memory for the weights. Each worker runs one request at a time with
+    its own torch threads, so requests don't contend for the GIL or for the
+    model lock.
+
+    Arguments:
+        lm_model: The loaded `LMModel`.
+        n_workers: The number of worker processes.
+        n_threads: The number of torch intra-op threads per worker.
+        device: The device of the model.
+        settings: Dict of `config` values to apply in the workers.
+        text_encoder: Optional text encoder for the workers. By default the
+            workers load it from the paths in the config.
+    """
+
+    def __init__(self, lm_model, n_workers, n_threads, device, settings,
+                 text_encoder=None):
+        log = logging.getLogger(__name__)
+
+        context = torch.multiprocessing.get_context('spawn')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._futures = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+
+        lm_model.share_memory()
+        self._processes = []
+        for _ in range(n_workers):
+            process = context.Process(
+                target=_worker_main,
+                args=(self._tasks, self._results, lm_model, n_threads, device,
+                      settings, text_encoder),
+                daemon=True)
+            process.start()
+            self._processes.append(process)
+
+        self._reader = threading.Thread(target=self._read_results,
+                                        daemon=True)
+        self._reader.start()
+        log.info('Started %d model workers with %d threads each', n_workers,
+                 n_threads)
+
+    def call(self, name, *args, callback=None):
+        """Call a function of the `generate` module in a worker.
+
+        Arguments:
+            name: The name of the function.
+            args: Picklable positional arguments.
+            callback: Optional function that is passed to the function as the
+                `callback` keyword argument. Its calls in the worker are
+                forwarded to it in this process.
+
+        Returns: The return value of the function.
+
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The model workers are stopped')
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            if callback is not None:
+                self._callbacks[task_id] = callback
+        self._tasks.put((task_id, name, args, callback is not None))
+        return future.result()
+
+    def close(self):
+        """Stop the workers and fail the calls that are in progress."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(_POLL_INTERVAL)
+            if process.is_alive():
+                process.terminate()
+        self._reader.join()
+        self._fail_all(RuntimeError('The model workers are stopped'))
+
+    def _read_results(self):
+        log = logging.getLogger(__name__)
+        while True:
+            try:
+                task_id, kind, value = self._results.get(
+                    timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                with self._lock:
+                    if self._closed:
+                        return
+                dead = [p for p in self._processes if not p.is_alive()]
+                if dead:
+                    log.error('%d model workers died', len(dead))
+                    with self._lock:
+                        self._closed = True
+                    self._fail_all(RuntimeError('A model worker died'))
+                    return
+                continue
+
+            if kind == _PROGRESS:
+                with self._lock:
+                    callback = self._callbacks.get(task_id)
+                if callback is not None:
+                    try:
+                        callback(value)
+                    except Exception:
+                        log.exception('Progress callback failed')
+                continue
+
+            with self._lock:
+                future = self._futures.pop(task_id, None)
+                self._callbacks.pop(task_id, None)
+            if future is None:
+                continue
+            if kind == _RESULT:
+                future.set_result(value)
+            else:
+                error, traceback_text = value
+                error.__cause__ = _RemoteTraceback(traceback_text)
+                future.set_exception(error)
+
+    def _fail_all(self, exception):
+        with self._lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+            self._callbacks.clear()
+        for future in futures:
+            future.set_exception(exception)
+
+
+class _RemoteTraceback(Exception):
+    """The traceback of an exception that was raised in a worker.
+
+    It is the cause of the exception that is raised in this process, so it is
+    shown with it.
+    """
+
+    def __str__(self):
+        return self.args[0]
+
+
+def _error_message(e):
+    """Return an exception and its traceback in a form that can be pickled."""
+    traceback_text = ''.join(traceback.format_exception(
+        type(e), e, e.__traceback__))
+    try:
+        # The queue pickles in a background thread, where a failure would
+        # leave the call waiting forever.
+        pickle.loads(pickle.dumps(e))
+    except Exception:
+        e = RuntimeError('{}: {}'.format(type(e).__name__, e))
+    return e, traceback_text
+
+
+def _worker_main(tasks, results, lm_model, n_threads, device, settings,
+                 text_encoder):
+    """Serve calls from the task queue until it yields None."""
+    # The package exports a function with the same name as the module.
+    generate = importlib.import_module('.generate', __package__)
+    torch.set_num_threads(n_threads)
+    for name, value in settings.items():
+        setattr(generate.config, name, value)
+    generate._device = device
+    generate._lm_model = lm_model
+    if text_encoder is not None:
+        generate._text_encoder = text_encoder
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        task_id, name, args, with_callback = task
+        kwargs = {}
+        if with_callback:
+            kwargs['callback'] = (lambda value, task_id=task_id:
+                                  results.put((task_id, _PROGRESS, value)))
+        try:
+            result = getattr(generate, name)(*args, **kwargs)
+        except Exception as e:
+            logging.getLogger(__name__).exception('%s failed', name)
+            results.put((task_id, _ERROR, _error_message(e)))
+        else:
+            results.put((task_id, _RESULT, result))
@@ -26,24 +26,73 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import asyncio
+import collections
+import errno
+import gc
+import itertools
 import logging
+import os
+import re
 import socketserver
 import threading
-from functools import partial
+from functools import partial, wraps
 
 from jsonrpc.dispatchers import MethodDispatcher
 from jsonrpc.endpoint import Endpoint
-from jsonrpc.streams import JsonRpcStreamReader, JsonRpcStreamWriter
 
-from . import constants, lang_model, uris, utils
+from . import constants, diagnostics, lang_model, shim, uris, utils
+from .streams import JsonRpcStreamReader, JsonRpcStreamWriter
 from .workspace import Workspace
 
 log = logging.getLogger(__name__)
 
 
 LINT_DEBOUNCE_S = 0.5  # 500 ms
+PREFETCH_DEBOUNCE_S = 0.3  # 300 ms
 PARENT_PROCESS_WATCH_INTERVAL = 10  # 10 s
 MAX_WORKERS = 16
+PROGRESS_METHOD = '$/progress'
+# Number of tokens generated for a suggestion in lazy completion mode before
+# it is resolved.
+LAZY_PREVIEW_LEN = 3
+# Maximum number of unresolved suggestions kept around in lazy completion mode.
+MAX_LAZY_COMPLETIONS = 64
+# Maximum number of tokens of workspace text that the draft model of
+# speculative decoding is built from.
+MAX_DRAFT_TOKENS = 2048
+
+# Edits that end a word or a sentence trigger prefetching.
+RE_PREFETCH_TRIGGER = re.compile(r'[\s.,;:!?]$')
+
+# Ids of the language server sessions of this process.
+_client_ids = itertools.count()
+
+
+class CompletionMode:
+    # Generate the full continuation in textDocument/completion.
+    FULL = 'full'
+    # Generate a short preview in textDocument/completion and extend the
+    # selected item in completionItem/resolve.
+    LAZY = 'lazy'
+    # Suggest a ranked list of likely next words.
+    NEXT_WORD = 'nextWord'
+
+
+DEFAULT_OPTIONS = {
+    'completionMode': CompletionMode.FULL,
+    # Maximum number of tokens before the cursor that the model sees. Smaller
+    # is faster, larger gives better completions. None means model default.
+    'contextTokens': None,
+    # Generate the completion in the background when typing pauses at the end
+    # of a word or sentence, so that textDocument/completion is answered from
+    # the cache. Only used in the full completion mode.
+    'prefetch': False,
+    # Publish diagnostics for words that are improbable in their context.
+    'diagnostics': False,
+    # Words with a lower log-probability (natural log) are flagged.
+    'diagnosticsThreshold': -14.0
+}
 
 
 class _StreamHandlerWrapper(socketserver.StreamRequestHandler):
@@ -60,19 +109,37 @@ class _StreamHandlerWrapper(socketserver.StreamRequestHandler):
         self.delegate.start()
 
 
-def start_tcp_lang_server(bind_addr, port, handler_class):
+class _ForkingUnixStreamServer(socketserver.ForkingMixIn,
+                               socketserver.UnixStreamServer):
+    """Serve each connection in a child process forked from the server."""
+
+    def finish_request(self, request, client_address):
+        # Only called in the child.
+        lang_model.after_fork()
+        super(_ForkingUnixStreamServer, self).finish_request(request,
+                                                             client_address)
+
+
+def _make_wrapper_class(handler_class):
     if not issubclass(handler_class, LanguageServer):
         raise TypeError('Handler class must be a subclass of '
                         'LanguageServer')
 
     # Construct a custom wrapper class around the user's handler_class
-    wrapper_class = type(
+    return type(
         handler_class.__name__ + 'Handler',
         (_StreamHandlerWrapper,),
         {'DELEGATE_CLASS': handler_class}
     )
 
-    server = socketserver.TCPServer((bind_addr, port), wrapper_class)
+
+def start_tcp_lang_server(bind_addr, port, handler_class):
+    wrapper_class = _make_wrapper_class(handler_class)
+
+    # Every connection gets its own language server, but they share the model
+    # which schedules their calls fairly.
+    server = socketserver.ThreadingTCPServer((bind_addr, port), wrapper_class)
+    server.daemon_threads = True
     try:
         log.info('Serving {} at {}:{}'.format(handler_class.__name__,
                                               bind_addr, port))
@@ -82,6 +149,96 @@ def start_tcp_lang_server(bind_addr, port, handler_class):
         server.server_close()
 
 
+def _bind_unix_server(socket_path, server_class, wrapper_class):
+    # Create the socket without access for others instead of restricting it
+    # after it is bound.
+    umask = os.umask(0o177)
+    try:
+        server = server_class(socket_path, wrapper_class)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    return server
+
+
+def _serve_unix_forever(server, socket_path, handler_class):
+    try:
+        log.info('Serving {} at {}'.format(handler_class.__name__,
+                                           socket_path))
+        server.serve_forever()
+    finally:
+        log.info('Shutting down')
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def start_unix_lang_server(socket_path, handler_class):
+    """Serve a language server per connection on a Unix domain socket.
+
+    Only the current user can connect to the socket. A socket file left
+    behind by a server that is gone is replaced.
+    """
+    wrapper_class = _make_wrapper_class(handler_class)
+    if not shim.remove_stale_socket(socket_path):
+        raise OSError(errno.EADDRINUSE, 'A server is already listening on '
+                      '{}'.format(socket_path))
+
+    server = _bind_unix_server(socket_path,
+                               socketserver.ThreadingUnixStreamServer,
+                               wrapper_class)
+    _serve_unix_forever(server, socket_path, handler_class)
+
+
+def start_daemon_lang_server(socket_path, handler_class, fork=False):
+    """Serve a language server per connection on a Unix domain socket.
+
+    The model is loaded once the socket is bound and shared by all
+    connections, so editors that connect through the stdio shim don't load it
+    again. Connections made while it loads wait until it is ready, and a
+    daemon that is started concurrently finds the socket taken instead of
+    loading the model too. Only the current user can connect to the socket.
+
+    Arguments:
+        socket_path: The path of the socket.
+        handler_class: The `LanguageServer` class.
+        fork: Serve each connection in a fresh child process that inherits
+            the loaded model copy-on-write instead of in a thread. Sessions
+            are isolated from each other and still start instantly.
+    """
+    if fork and lang_model.config.n_workers > 0:
+        raise ValueError('Model workers can\'t be inherited by forked '
+                         'servers')
+    wrapper_class = _make_wrapper_class(handler_class)
+
+    if not shim.remove_stale_socket(socket_path):
+        log.info('A daemon is already listening on %s', socket_path)
+        return
+
+    if fork:
+        server_class = _ForkingUnixStreamServer
+    else:
+        server_class = socketserver.ThreadingUnixStreamServer
+    try:
+        server = _bind_unix_server(socket_path, server_class, wrapper_class)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        log.info('A daemon is already listening on %s', socket_path)
+        return
+
+    try:
+        lang_model.initialize()
+        # Keep the garbage collector from touching the objects of the loaded
+        # model in the children, which would copy the pages they are on.
+        if fork and hasattr(gc, 'freeze'):
+            gc.freeze()
+    except BaseException:
+        server.server_close()
+        os.unlink(socket_path)
+        raise
+    _serve_unix_forever(server, socket_path, handler_class)
+
+
 def start_io_lang_server(rfile, wfile, check_parent_process, handler_class):
     if not issubclass(handler_class, LanguageServer):
         raise TypeError('Handler class must be a subclass of '
@@ -92,22 +249,108 @@ def start_io_lang_server(rfile, wfile, check_parent_process, handler_class):
     server.start()
 
 
+class _ModelCall(object):
+    """Awaitable model call of a handler under the synchronous endpoint."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __await__(self):
+        return (yield self)
+
+
+def _drive(coro):
+    """Run a handler coroutine for the synchronous endpoint.
+
+    The coroutine runs in the calling thread up to its first model call, so
+    that the document access stays in the thread that reads the messages, and
+    the rest is deferred to a callable, which the endpoint runs in its thread
+    pool.
+
+    Returns: The result of the coroutine or a callable that returns it.
+
+    """
+    try:
+        call = coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+    def resume():
+        model_call = call
+        while True:
+            try:
+                result = model_call.fn()
+            except Exception as e:  # pylint: disable=broad-except
+                step = partial(coro.throw, e)
+            else:
+                step = partial(coro.send, result)
+            try:
+                model_call = step()
+            except StopIteration as e:
+                return e.value
+
+    return resume
+
+
+def _change_end(change):
+    """Return the position after the text inserted by a change or None."""
+    change_range = change.get('range')
+    if not change_range:
+        return None
+
+    text = change['text']
+    start = change_range['start']
+    n_lines = text.count('\n')
+    if not n_lines:
+        return {'line': start['line'],
+                'character': start['character'] + len(text)}
+    return {'line': start['line'] + n_lines,
+            'character': len(text) - text.rfind('\n') - 1}
+
+
 class LanguageServer(MethodDispatcher):
     """Implementation of the Language Server Protocol 2.x for natural language.
 
     https://github.com/Microsoft/language-server-protocol/blob/master/versions/protocol-2-x.md  # noqa 501
     """
 
-    def __init__(self, rx, tx, check_parent_process=False):
+    def __init__(self, rx, tx, check_parent_process=False,
+                 make_endpoint=None):
+        """
+        Arguments:
+            rx: The binary stream that messages are read from.
+            tx: The binary stream that messages are written to.
+            check_parent_process: Exit when the editor process exits.
+            make_endpoint: Optional function that makes the JSON RPC endpoint
+                from the server, eg. an `aio.AsyncEndpoint`, in which case
+                the transport is handled by the endpoint and the streams are
+                ignored.
+        """
         self.workspace = None
 
-        self._jsonrpc_stream_reader = JsonRpcStreamReader(rx)
-        self._jsonrpc_stream_writer = JsonRpcStreamWriter(tx)
         self._check_parent_process = check_parent_process
-        self._endpoint = Endpoint(self, self._jsonrpc_stream_writer.write,
-                                  max_workers=MAX_WORKERS)
+        if make_endpoint is None:
+            self._jsonrpc_stream_reader = JsonRpcStreamReader(rx)
+            self._jsonrpc_stream_writer = JsonRpcStreamWriter(tx)
+            self._endpoint = Endpoint(self,
+                                      self._jsonrpc_stream_writer.write,
+                                      max_workers=MAX_WORKERS)
+        else:
+            self._jsonrpc_stream_reader = None
+            self._jsonrpc_stream_writer = None
+            self._endpoint = make_endpoint(self)
         self._dispatchers = []
         self._shutdown = False
+        self._options = dict(DEFAULT_OPTIONS)
+        # Last word and generation state of lazy completion items by item id.
+        self._lazy_completions = collections.OrderedDict()
+        self._lazy_completions_lock = threading.Lock()
+        self._lazy_completion_ids = itertools.count()
+        # Model calls of the sessions of a shared server are scheduled round
+        # robin by client.
+        self._client_id = next(_client_ids)
+        # Set to stop the prefetching for an earlier edit.
+        self._prefetch_cancelled = threading.Event()
 
     def start(self):
         """Blocking entry point for the server."""
@@ -121,19 +364,63 @@ class LanguageServer(MethodDispatcher):
             raise KeyError
 
         # MethodDispatcher super will find methods prefixed with "m_"
-        return super(LanguageServer, self).__getitem__(item)
+        method = super(LanguageServer, self).__getitem__(item)
+        return self._as_client(method)
+
+    def _as_client(self, fn):
+        """Attribute the model calls of a handler to this session.
+
+        Handlers that return a callable are run in a thread pool by the
+        endpoint, so the callable is wrapped too. The synchronous endpoint
+        can't await coroutines, so they are driven by `_drive` instead.
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with lang_model.client_context(self._client_id):
+                result = fn(*args, **kwargs)
+                if asyncio.iscoroutine(result) and \
+                        isinstance(self._endpoint, Endpoint):
+                    result = _drive(result)
+            if callable(result):
+                return self._as_client(result)
+            return result
+
+        return wrapper
+
+    def _in_executor(self, fn, *args, **kwargs):
+        """Run a model call of a handler in the thread pool of the endpoint.
+
+        Handlers await the result, so that the loop of an
+        `aio.AsyncEndpoint` isn't blocked while the model runs.
+        """
+        fn = self._as_client(partial(fn, *args, **kwargs))
+        if isinstance(self._endpoint, Endpoint):
+            return _ModelCall(fn)
+        return self._endpoint.run_in_executor(fn)
+
+    def _spawn(self, coro):
+        """Run a handler coroutine that no request waits for, eg. linting."""
+        if isinstance(self._endpoint, Endpoint):
+            result = _drive(coro)
+            if callable(result):
+                result()
+        else:
+            self._endpoint.spawn(coro)
 
     def m_shutdown(self, **_kwargs):
         self._shutdown = True
         return None
 
     def m_exit(self, **_kwargs):
+        self._prefetch_cancelled.set()
         self._endpoint.shutdown()
-        self._jsonrpc_stream_reader.close()
-        self._jsonrpc_stream_writer.close()
+        if self._jsonrpc_stream_reader is not None:
+            self._jsonrpc_stream_reader.close()
+            self._jsonrpc_stream_writer.close()
 
-    def m_initialize(self, processId=None, rootUri=None, rootPath=None,
-                     initializationOptions=None, **_kwargs):
+    async def m_initialize(self, processId=None, rootUri=None,
+                           rootPath=None, initializationOptions=None,
+                           **_kwargs):
         log.debug('Language server initialized with %s %s %s %s', processId,
                   rootUri, rootPath, initializationOptions)
         if rootUri is None:
@@ -142,9 +429,11 @@ class LanguageServer(MethodDispatcher):
             else:
                 rootUri = ''
 
-        self.workspace = Workspace(rootUri, self._endpoint)
+        self._options = dict(DEFAULT_OPTIONS, **(initializationOptions or {}))
+        self.workspace = Workspace(rootUri, self._endpoint,
+                                   tokenizer=lang_model)
 
-        lang_model.initialize()
+        await self._in_executor(lang_model.initialize)
 
         if self._check_parent_process and processId is not None:
             def watch_parent_process(pid):
@@ -168,10 +457,14 @@ class LanguageServer(MethodDispatcher):
         pass
 
     def m_text_document__did_close(self, textDocument=None, **_kwargs):
+        if self._options['diagnostics']:
+            self.workspace.publish_diagnostics(textDocument['uri'], [])
         self.workspace.rm_document(textDocument['uri'])
 
     def m_text_document__did_open(self, textDocument=None, **_kwargs):
         self.workspace.put_document(textDocument['uri'], textDocument['text'], version=textDocument.get('version'))
+        if self._options['diagnostics']:
+            self.lint(self.workspace.get_document(textDocument['uri']))
 
     def m_text_document__did_change(self, contentChanges=None, textDocument=None, **_kwargs):
         for change in contentChanges:
@@ -181,27 +474,96 @@ class LanguageServer(MethodDispatcher):
                 version=textDocument.get('version')
             )
 
+        if self._options['diagnostics']:
+            self.lint(self.workspace.get_document(textDocument['uri']))
+
+        if contentChanges and self._options['prefetch'] and \
+                self._options['completionMode'] == CompletionMode.FULL:
+            change = contentChanges[-1]
+            if RE_PREFETCH_TRIGGER.search(change['text']):
+                # The document isn't thread-safe, so the debounced call gets
+                # a snapshot of its text, which is encoded only once the
+                # edits pause.
+                doc = self.workspace.get_document(textDocument['uri'])
+                position = _change_end(change)
+                source = doc.source
+                offset = len(source) if position is None \
+                    else doc.offset_at_position(position)
+                self._cancel_prefetch()
+                self.prefetch(source, offset, self._prefetch_cancelled)
+
+    def _cancel_prefetch(self):
+        """Stop the prefetching for an earlier edit."""
+        self._prefetch_cancelled.set()
+        self._prefetch_cancelled = threading.Event()
+
+    @utils.debounce(PREFETCH_DEBOUNCE_S, keyed_by='self')
+    def prefetch(self, source, offset, cancelled):
+        """Generate the completion for a context in the background."""
+        if cancelled.is_set():
+            return
+        context_tokens = self._options['contextTokens']
+        with lang_model.client_context(self._client_id):
+            text = lang_model.encode_context(source, context_tokens,
+                                             offset=offset)
+            lang_model.prefetch(text, context_tokens=context_tokens,
+                                cancelled=cancelled)
+
+    @utils.debounce(LINT_DEBOUNCE_S, keyed_by='doc')
+    def lint(self, doc):
+        """Publish diagnostics for the improbable words of a document."""
+        self._spawn(self.lint_document(doc))
+
+    async def lint_document(self, doc):
+        """Lint a document now, see `lint`."""
+        # The document might have been closed or replaced in the meantime.
+        if self.workspace.documents.get(doc.uri) is not doc:
+            return
+        doc_diagnostics = await self._in_executor(
+            diagnostics.lint, doc.source,
+            self._options['diagnosticsThreshold'])
+        self.workspace.publish_diagnostics(doc.uri, doc_diagnostics)
+
     def m_text_document__did_save(self, textDocument=None, **_kwargs):
         # TODO
         pass
 
-    def m_text_document__completion(self, textDocument=None, position=None,
-                                    **_kwargs):
-        # If JSONRPC method handler returns a function, it will be invoked
-        # asynchronously in a thread pool, which is desirable here to avoid
-        # blocking other requests.
-        # Workspace and Document are not thread-safe, so access to them must
-        # happen outside of the handler function.
+    async def m_text_document__completion(self, textDocument=None,
+                                          position=None,
+                                          partialResultToken=None,
+                                          **_kwargs):
+        # The model calls are awaited in a thread pool, so that they don't
+        # block other requests. Workspace and Document are not thread-safe,
+        # so access to them must happen before.
+        # A prefetch that is still running would only compete with the
+        # completion for the model.
+        self._cancel_prefetch()
         doc = self.workspace.get_document(textDocument['uri'])
-        # TODO magic number
-        text = doc.read_before(position, 1024)
+        # Encoding happens here, because it reuses the tokens that are
+        # cached on the document.
+        context_tokens = self._options['contextTokens']
+        text = doc.tokens_before(position, context_tokens)
         last_word = doc.word_at_position(position)
-        return partial(self.completions, text, last_word)
+        completion_mode = self._options['completionMode']
+        if completion_mode == CompletionMode.LAZY:
+            return await self.lazy_completions(text, last_word,
+                                               partialResultToken)
+        if completion_mode == CompletionMode.NEXT_WORD:
+            return await self.next_word_completions(text, last_word)
+        draft_tokens = self._draft_tokens(doc)
+        return await self.completions(text, last_word, partialResultToken,
+                                      draft_tokens)
+
+    async def m_completion_item__resolve(self, **item):
+        if 'lazyId' not in (item.get('data') or {}):
+            return item
+        return await self.resolve_completion(item)
 
     def capabilities(self):
+        lazy = self._options['completionMode'] == CompletionMode.LAZY
         server_capabilities = {
             'completionProvider': {
-                'resolveProvider': False,
+                'resolveProvider': lazy,
                 'triggerCharacters': []
             },
             'textDocumentSync': constants.TextDocumentSyncKind.INCREMENTAL
@@ -209,14 +571,120 @@ class LanguageServer(MethodDispatcher):
         log.info('Server capabilities: %s', server_capabilities)
         return server_capabilities
 
+    async def completions(self, text, last_word, partial_result_token=None,
+                          draft_tokens=None):
+        """Generate completions for the text before the cursor.
+
+        The text is either a string or the token ids of the context.
+
+        If the client sent a partial result token, the continuation is
+        streamed to it in $/progress notifications while it is being
+        generated. The final response always carries the full completion.
+        """
+        callback = self._progress_callback(last_word, partial_result_token)
+        continuation = await self._in_executor(
+            lang_model.generate, text, callback=callback,
+            draft_tokens=draft_tokens,
+            context_tokens=self._options['contextTokens'])
+        return self._completion_list(last_word, continuation)
+
+    async def lazy_completions(self, text, last_word,
+                               partial_result_token=None):
+        """Generate a short preview completion that is extended on resolve."""
+        callback = self._progress_callback(last_word, partial_result_token)
+        state = await self._in_executor(
+            lang_model.generate_state, text, gen_len=LAZY_PREVIEW_LEN,
+            callback=callback, context_tokens=self._options['contextTokens'])
+
+        with self._lazy_completions_lock:
+            lazy_id = next(self._lazy_completion_ids)
+            self._lazy_completions[lazy_id] = (last_word, state)
+            while len(self._lazy_completions) > MAX_LAZY_COMPLETIONS:
+                self._lazy_completions.popitem(last=False)
+
+        completion_list = self._completion_list(last_word, state.text)
+        completion_list['items'][0]['data'] = {'lazyId': lazy_id}
+        return completion_list
+
+    async def next_word_completions(self, text, last_word):
+        """Suggest the most likely next words ranked by probability."""
+        next_words = await self._in_executor(
+            lang_model.next_words, text,
+            context_tokens=self._options['contextTokens'])
+        completions = [{
+            'label': self._complete_text(last_word, word),
+            'kind': constants.CompletionItemKind.Text,
+            # Clients sort items by sortText, so more probable words come first
+            'sortText': '{:.8f}'.format(1 - probability)
+        } for word, probability in next_words]
+        return {
+            'isIncomplete': False,
+            'items': completions
+        }
+
+    async def resolve_completion(self, item):
+        """Extend a lazy completion item to the full continuation."""
+        lazy_id = item['data']['lazyId']
+        with self._lazy_completions_lock:
+            lazy_completion = self._lazy_completions.get(lazy_id)
+        if lazy_completion is None:
+            log.debug('Unknown or expired lazy completion %s', lazy_id)
+            return item
+
+        last_word, state = lazy_completion
+        state = await self._in_executor(lang_model.resume, state)
+        # Keep the extended state so that repeated resolves are cheap.
+        with self._lazy_completions_lock:
+            if lazy_id in self._lazy_completions:
+                self._lazy_completions[lazy_id] = (last_word, state)
+
+        complete_text = self._complete_text(last_word, state.text)
+        return dict(item, insertText=complete_text, detail=complete_text)
+
+    def _draft_tokens(self, doc):
+        """Tokens of the document and other open documents for the draft.
+
+        Returns: A list of lists of token ids or None if speculative decoding
+            is disabled.
+
+        """
+        if lang_model.config.draft_len <= 0:
+            return None
+        draft_tokens = []
+        n_tokens = 0
+        docs = [doc] + [d for d in self.workspace.documents.values()
+                        if d is not doc]
+        for d in docs:
+            if n_tokens >= MAX_DRAFT_TOKENS:
+                break
+            tokens = d.tokens_before(None, MAX_DRAFT_TOKENS - n_tokens)
+            draft_tokens.append(tokens)
+            n_tokens += len(tokens)
+        return draft_tokens
+
+    def _progress_callback(self, last_word, partial_result_token):
+        if partial_result_token is None:
+            return None
+
+        def callback(continuation):
+            self._endpoint.notify(PROGRESS_METHOD, {
+                'token': partial_result_token,
+                'value': self._completion_list(last_word, continuation,
+                                               is_incomplete=True)
+            })
+        return callback
+
     @staticmethod
-    def completions(text, last_word):
-        complete_text = last_word + ' ' + lang_model.generate(text)
+    def _complete_text(last_word, continuation):
+        return last_word + ' ' + continuation
+
+    @classmethod
+    def _completion_list(cls, last_word, continuation, is_incomplete=False):
         completions = [{
-            'label': complete_text,
+            'label': cls._complete_text(last_word, continuation),
             'kind': constants.CompletionItemKind.Text
         }]
         return {
-            'isIncomplete': False,
+            'isIncomplete': is_incomplete,
             'items': completions
         }
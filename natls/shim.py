@@ -0,0 +1,158 @@
+"""Thin stdio shim that connects an editor to a shared language server daemon.
+
+The daemon owns the model and serves a language server per connection on a
+Unix domain socket. The shim only forwards bytes between stdio and the daemon
+and starts the daemon if it isn't running, so it must not import the model.
+"""
+
+import errno
+import logging
+import os
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# How long the shim waits for a daemon that it started to listen in seconds.
+DAEMON_START_TIMEOUT = 120
+_CONNECT_RETRY_INTERVAL = 0.05
+_BUFFER_SIZE = 64 * 1024
+
+
+def default_socket_path():
+    """Return the per-user path of the daemon socket."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, 'natls-{}.sock'.format(os.getuid()))
+
+
+def connect(socket_path):
+    """Connect to a Unix domain socket.
+
+    Returns: The connected socket or None if nothing listens on the path.
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+    return sock
+
+
+def is_listening(socket_path):
+    """Return whether a server listens on a Unix domain socket."""
+    sock = connect(socket_path)
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+
+def remove_stale_socket(socket_path):
+    """Remove a Unix domain socket that nothing listens on anymore.
+
+    Returns: False if a server listens on the socket, True otherwise.
+
+    Raises: FileExistsError if something other than a socket is at the path,
+        which is never removed.
+
+    """
+    try:
+        st = os.lstat(socket_path)
+    except FileNotFoundError:
+        return True
+    if not stat.S_ISSOCK(st.st_mode):
+        raise FileExistsError(errno.EEXIST, 'Not a socket', socket_path)
+    if is_listening(socket_path):
+        return False
+    os.unlink(socket_path)
+    return True
+
+
+def connect_or_start_daemon(socket_path, daemon_args=()):
+    """Connect to the daemon and start it first if it isn't running.
+
+    Arguments:
+        socket_path: The path of the daemon socket.
+        daemon_args: Extra command line arguments for the daemon, eg. for
+            logging.
+
+    Returns: The connected socket.
+
+    """
+    sock = connect(socket_path)
+    if sock is not None:
+        return sock
+
+    log.info('Starting language server daemon on %s', socket_path)
+    command = [sys.executable, '-m', 'natls', '--daemon',
+               '--daemon-socket', socket_path] + list(daemon_args)
+    # The daemon outlives the shim and must not hold on to the editor's stdio.
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        sock = connect(socket_path)
+        if sock is not None:
+            return sock
+        # Another shim might have started a daemon at the same time, in which
+        # case this one exits and the other one is waited for.
+        if process.poll() not in (None, 0):
+            raise RuntimeError('The language server daemon exited with code '
+                               '{}'.format(process.returncode))
+        time.sleep(_CONNECT_RETRY_INTERVAL)
+
+    raise RuntimeError('The language server daemon did not start listening '
+                       'on {}'.format(socket_path))
+
+
+def forward(in_fd, out_fd, sock):
+    """Forward bytes between file descriptors and a socket until it closes.
+
+    Arguments:
+        in_fd: File descriptor that is read and sent to the socket.
+        out_fd: File descriptor that data received from the socket is written
+            to.
+        sock: The connected socket.
+    """
+    def send():
+        try:
+            while True:
+                data = os.read(in_fd, _BUFFER_SIZE)
+                if not data:
+                    break
+                sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+
+    while True:
+        data = sock.recv(_BUFFER_SIZE)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            view = view[os.write(out_fd, view):]
+
+
+def start_shim(rfile, wfile, socket_path, daemon_args=()):
+    """Serve an editor over stdio through the daemon."""
+    sock = connect_or_start_daemon(socket_path, daemon_args)
+    log.info('Forwarding stdio to the language server daemon on %s',
+             socket_path)
+    try:
+        forward(rfile.fileno(), wfile.fileno(), sock)
+    finally:
+        sock.close()
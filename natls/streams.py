@@ -0,0 +1,176 @@
+"""Buffered JSON RPC streams with fast JSON.
+
+Drop-in replacements for the streams of `jsonrpc.streams`. Messages are
+parsed from a buffer instead of reading the headers line by line, messages
+written concurrently are coalesced into one write and JSON is handled by
+`orjson` when it is installed.
+"""
+
+import json
+import logging
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+_BUFFER_SIZE = 64 * 1024
+_HEADER_END = b'\r\n\r\n'
+_CONTENT_LENGTH = b'content-length:'
+
+
+def dumps(obj):
+    """Serialize an object to JSON as UTF-8 bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Eg. non-string keys or integers beyond 64 bits, which the
+            # standard library handles.
+            pass
+    return json.dumps(obj).encode('utf-8')
+
+
+def loads(data):
+    """Deserialize JSON from UTF-8 bytes.
+
+    Raises: ValueError if the data isn't valid JSON.
+
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+
+def encode_message(message):
+    """Serialize a JSON RPC message with its headers."""
+    body = dumps(message)
+    return (b'Content-Length: %d\r\n'
+            b'Content-Type: application/vscode-jsonrpc; charset=utf8\r\n\r\n'
+            % len(body)) + body
+
+
+def content_length(header):
+    """Return the content length of a message from its header block.
+
+    Raises: ValueError if the header is missing or invalid.
+
+    """
+    for line in header.split(b'\r\n'):
+        if line.lower().startswith(_CONTENT_LENGTH):
+            value = line[len(_CONTENT_LENGTH):].strip()
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError('Invalid Content-Length header: {}'.format(
+                    value))
+    raise ValueError('Missing Content-Length header: {}'.format(header))
+
+
+class JsonRpcStreamReader(object):
+
+    def __init__(self, rfile):
+        self._rfile = rfile
+        self._buffer = bytearray()
+        # Returns the available bytes instead of waiting for `size` bytes.
+        self._read1 = getattr(rfile, 'read1', rfile.read)
+
+    def close(self):
+        self._rfile.close()
+
+    def listen(self, message_consumer):
+        """Blocking call to listen for messages on the rfile.
+
+        Arguments:
+            message_consumer: Function that is passed each message as it is
+                read off the stream.
+        """
+        while not self._rfile.closed:
+            request_str = self._read_message()
+
+            if request_str is None:
+                break
+
+            try:
+                message_consumer(loads(request_str))
+            except ValueError:
+                log.exception('Failed to parse JSON message %s', request_str)
+                continue
+
+    def _fill(self):
+        """Read available bytes into the buffer and return False at EOF."""
+        data = self._read1(_BUFFER_SIZE)
+        if not data:
+            return False
+        self._buffer += data
+        return True
+
+    def _read_message(self):
+        """Reads the contents of a message.
+
+        Returns: The body of the message or None at the end of the stream.
+
+        """
+        while True:
+            end = self._buffer.find(_HEADER_END)
+            if end >= 0:
+                break
+            if not self._fill():
+                return None
+
+        length = content_length(bytes(self._buffer[:end]))
+        del self._buffer[:end + len(_HEADER_END)]
+
+        missing = length - len(self._buffer)
+        if missing <= 0:
+            body = bytes(self._buffer[:length])
+            del self._buffer[:length]
+            return body
+
+        # Large bodies are read in one call instead of chunk by chunk.
+        rest = self._rfile.read(missing)
+        if rest is None or len(rest) < missing:
+            return None
+        body = bytes(self._buffer) + rest
+        self._buffer.clear()
+        return body
+
+
+class JsonRpcStreamWriter(object):
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._wfile_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+
+    def close(self):
+        with self._wfile_lock:
+            self._wfile.close()
+
+    def write(self, message):
+        try:
+            data = encode_message(message)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Failed to write message to output file %s',
+                          message)
+            return
+
+        with self._pending_lock:
+            self._pending.append(data)
+
+        # The thread that gets the file writes the messages queued while it
+        # waited too, so bursts of messages take one write and flush.
+        with self._wfile_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            if not pending or self._wfile.closed:
+                return
+            try:
+                self._wfile.write(b''.join(pending))
+                self._wfile.flush()
+            except Exception:  # pylint: disable=broad-except
+                log.exception('Failed to write messages to output file')
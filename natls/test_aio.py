@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from threading import Thread
+from unittest import TestCase
+
+from jsonrpc.streams import JsonRpcStreamReader, JsonRpcStreamWriter
+
+from . import aio, lang_model
+from .lang_model.test_generate import patch_tiny_model
+from .lang_server import LanguageServer
+
+
+class _TestServer(LanguageServer):
+    release = threading.Event()
+    started = threading.Event()
+    stopped = threading.Event()
+
+    def _spin(self):
+        self.started.set()
+        try:
+            while True:
+                lang_model.scheduler.raise_if_cancelled()
+                time.sleep(0.01)
+        except lang_model.Cancelled:
+            self.stopped.set()
+            raise
+
+    async def m_spin(self, **_kwargs):
+        return await self._in_executor(self._spin)
+
+    def _wait(self):
+        self.release.wait(5)
+        return 'done'
+
+    async def m_slow(self, **_kwargs):
+        return await self._in_executor(self._wait)
+
+    async def m_echo(self, value=None, **_kwargs):
+        return value
+
+    def m_progress(self, **_kwargs):
+        def notify():
+            for i in range(3):
+                self._endpoint.notify('test/progress', {'i': i})
+            return 'done'
+        return notify
+
+
+class TestAsyncLangServer(TestCase):
+    def setUp(self):
+        server_read, client_write = os.pipe()
+        client_read, server_write = os.pipe()
+        sreadf = os.fdopen(server_read, 'rb')
+        swritef = os.fdopen(server_write, 'wb')
+        self.server_thread = Thread(
+            target=aio.start_io_lang_server,
+            args=(sreadf, swritef, False, _TestServer, 4, None))
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        self.cwritef = os.fdopen(client_write, 'wb')
+        self.writer = JsonRpcStreamWriter(self.cwritef)
+        self.creadf = os.fdopen(client_read, 'rb')
+        self.reader = JsonRpcStreamReader(self.creadf)
+        self.addCleanup(self.creadf.close)
+        for event in [_TestServer.release, _TestServer.started,
+                      _TestServer.stopped]:
+            event.clear()
+
+    def tearDown(self):
+        self._request(99, 'shutdown')
+        self.writer.write({'jsonrpc': '2.0', 'method': 'exit'})
+        self.server_thread.join(5)
+        self.assertFalse(self.server_thread.is_alive())
+        self.writer.close()
+
+    def _request(self, msg_id, method, params=None):
+        self.writer.write({'jsonrpc': '2.0', 'id': msg_id, 'method': method,
+                           'params': params or {}})
+        return self._read()
+
+    def _read(self):
+        raw_msg = self.reader._read_message()
+        return json.loads(raw_msg.decode('utf-8'))
+
+    def test_coroutine_handler(self):
+        response = self._request(1, 'echo', {'value': 'hello'})
+        self.assertEqual(response, {'jsonrpc': '2.0', 'id': 1,
+                                    'result': 'hello'})
+
+    def test_unknown_method(self):
+        response = self._request(1, 'unknown')
+        self.assertEqual(response['error']['code'], -32601)
+
+    def test_cancel(self):
+        self.writer.write({'jsonrpc': '2.0', 'id': 1, 'method': 'slow',
+                           'params': {}})
+        self.writer.write({'jsonrpc': '2.0', 'method': '$/cancelRequest',
+                           'params': {'id': 1}})
+        response = self._read()
+        _TestServer.release.set()
+        self.assertEqual(response['id'], 1)
+        self.assertEqual(response['error']['code'], -32800)
+
+    def test_notifications_from_thread_pool(self):
+        self.writer.write({'jsonrpc': '2.0', 'id': 1, 'method': 'progress',
+                           'params': {}})
+        messages = [self._read() for _ in range(4)]
+        self.assertEqual([m['params']['i'] for m in messages[:3]], [0, 1, 2])
+        self.assertEqual(messages[3]['result'], 'done')
+
+    def test_model_call_doesnt_block_loop(self):
+        self.writer.write({'jsonrpc': '2.0', 'id': 1, 'method': 'slow',
+                           'params': {}})
+        self.assertEqual(self._request(2, 'echo', {'value': 'hello'}),
+                         {'jsonrpc': '2.0', 'id': 2, 'result': 'hello'})
+        _TestServer.release.set()
+        self.assertEqual(self._read(), {'jsonrpc': '2.0', 'id': 1,
+                                        'result': 'done'})
+
+    def test_cancel_stops_model_calls(self):
+        self.writer.write({'jsonrpc': '2.0', 'id': 1, 'method': 'spin',
+                           'params': {}})
+        self.assertTrue(_TestServer.started.wait(5))
+        self.writer.write({'jsonrpc': '2.0', 'method': '$/cancelRequest',
+                           'params': {'id': 1}})
+        self.assertEqual(self._read()['error']['code'], -32800)
+        self.assertTrue(_TestServer.stopped.wait(5))
+
+    def test_completion(self):
+        patch_tiny_model(self)
+        self._request(1, 'initialize', {
+            'rootUri': None,
+            'initializationOptions': {'completionMode': 'nextWord'}
+        })
+        uri = 'file:///next_word.txt'
+        self.writer.write({
+            'jsonrpc': '2.0',
+            'method': 'textDocument/didOpen',
+            'params': {
+                'textDocument': {'uri': uri, 'text': 'Once upon a'}
+            }
+        })
+        result = self._request(2, 'textDocument/completion', {
+            'textDocument': {'uri': uri},
+            'position': {'line': 0, 'character': 11}
+        })['result']
+        items = sorted(result['items'], key=lambda item: item['sortText'])
+        self.assertEqual([item['label'] for item in items],
+                         [LanguageServer._complete_text('a', word)
+                          for word, _ in lang_model.next_words('Once upon a')])
@@ -0,0 +1,96 @@
+import io
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from . import batch
+
+
+def _fake_encode(text, context_tokens=None):
+    X = [ord(c) for c in text.split()]
+    return X[max(0, len(X) - context_tokens):]
+
+
+def _fake_generate_batch(Xs, gen_len):
+    return [(' '.join(str(idx) for idx in X), [-1.0] * gen_len) for X in Xs]
+
+
+class TestReadPrompts(TestCase):
+    def test_text(self):
+        f = io.StringIO('One two\n\nthree\r\n')
+        self.assertEqual(batch.read_prompts(f), [(1, 'One two'),
+                                                 (3, 'three')])
+
+    def test_jsonl(self):
+        f = io.StringIO('"One\\ntwo"\n{"id": "a", "prompt": "three"}\n'
+                        '{"prompt": "four"}\n')
+        self.assertEqual(batch.read_prompts(f, jsonl=True),
+                         [(1, 'One\ntwo'), ('a', 'three'), (3, 'four')])
+
+    def test_invalid_jsonl(self):
+        for line in ['{', '{"id": 1}', '[1]']:
+            with self.assertRaises(ValueError):
+                batch.read_prompts(io.StringIO(line), jsonl=True)
+
+
+class TestRunBatch(TestCase):
+    def test_make_batches(self):
+        encoded = [('a', [1, 2, 3]), ('b', [1]), ('c', [1, 2]), ('d', [1])]
+        self.assertEqual(
+            [[prompt_id for prompt_id, _ in b]
+             for b in batch.make_batches(encoded, 2)],
+            [['b', 'd'], ['c', 'a']])
+
+    def _run_batch(self, prompts, generate_batch=_fake_generate_batch,
+                   **kwargs):
+        out = io.StringIO()
+        with patch.object(batch.lang_model, 'encode', _fake_encode), \
+                patch.object(batch.lang_model, 'generate_batch',
+                             generate_batch):
+            stats = batch.run_batch(prompts, out, 2, gen_len=3, **kwargs)
+        records = map(json.loads, out.getvalue().splitlines())
+        return {r['id']: r for r in records}, stats
+
+    def test_run_batch(self):
+        prompts = [(1, 'a b c'), (2, ''), (3, 'd'), (4, 'e f')]
+        results, stats = self._run_batch(prompts)
+        self.assertEqual(results[2], {'id': 2,
+                                      'error': 'Prompt has no tokens'})
+        self.assertEqual(results[1]['completion'], '97 98 99')
+        self.assertEqual(results[3]['logprobs'], [-1.0] * 3)
+        self.assertEqual((stats.n_prompts, stats.n_batches,
+                          stats.prompt_tokens, stats.padding_tokens,
+                          stats.generated_tokens, stats.n_errors),
+                         (3, 2, 6, 1, 9, 1))
+        self.assertIn('3 prompts in 2 batches', stats.report())
+
+    def test_crops_by_tokens(self):
+        prompts = [(1, 'a b c'), (2, 'd')]
+        results, stats = self._run_batch(prompts, context_tokens=2)
+        self.assertEqual(results[1]['completion'], '98 99')
+        self.assertEqual((stats.prompt_tokens, stats.padding_tokens), (3, 1))
+
+        # The completion must fit into the model context too.
+        with patch.object(batch.config, 'n_ctx', 5):
+            results, stats = self._run_batch(prompts)
+        self.assertEqual(results[1]['completion'], '98 99')
+        with patch.object(batch.config, 'n_ctx', 3), \
+                self.assertRaises(ValueError):
+            self._run_batch(prompts)
+
+    def test_failed_batch(self):
+        def generate_batch(Xs, gen_len):
+            if [ord('x')] in Xs:
+                raise RuntimeError('Out of memory')
+            return _fake_generate_batch(Xs, gen_len)
+
+        prompts = [(1, 'a b c'), (2, 'x'), (3, 'd'), (4, 'e f')]
+        with self.assertLogs(batch.log, 'ERROR'):
+            results, stats = self._run_batch(prompts, generate_batch)
+        # The batch of the second prompt fails, the other one still runs.
+        self.assertEqual(results[2]['error'], 'RuntimeError: Out of memory')
+        self.assertEqual(results[3]['error'], 'RuntimeError: Out of memory')
+        self.assertEqual(results[1]['completion'], '97 98 99')
+        self.assertEqual(results[4]['completion'], '101 102')
+        self.assertEqual((stats.n_prompts, stats.n_batches, stats.n_errors),
+                         (2, 1, 2))
@@ -0,0 +1,33 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from . import diagnostics, lang_model
+
+
+class TestDiagnostics(TestCase):
+    def test_paragraphs(self):
+        source = 'One two.\nThree\n\n  \n  Four\n'
+        self.assertEqual(diagnostics.paragraphs(source),
+                         [(0, 'One two.\nThree'), (19, '  Four')])
+
+    def test_improbable_phrases(self):
+        words = [(0, 1, -1.), (2, 3, -20.), (4, 5, -15.), (6, 7, -2.),
+                 (8, 9, -30.)]
+        self.assertEqual(diagnostics.improbable_phrases(words, -10),
+                         [(2, 5, [-20., -15.]), (8, 9, [-30.])])
+
+    def test_lint(self):
+        def word_log_probs(texts, **_kwargs):
+            self.assertEqual(texts, ['One two', 'Three four'])
+            return [[(0, 3, -1.), (4, 7, -20.)], [(0, 5, -15.), (6, 10, -1.)]]
+
+        with patch.object(lang_model, 'word_log_probs', word_log_probs):
+            result = diagnostics.lint('One two\n\nThree four', -10)
+        self.assertEqual([d['range'] for d in result], [
+            {'start': {'line': 0, 'character': 4},
+             'end': {'line': 0, 'character': 7}},
+            {'start': {'line': 2, 'character': 0},
+             'end': {'line': 2, 'character': 5}},
+        ])
+        self.assertEqual(result[0]['message'],
+                         'Improbable word (log-probability -20.0)')
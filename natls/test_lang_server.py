@@ -1,11 +1,18 @@
 import json
 import os
+import socket
 import tempfile
 from unittest import TestCase
-from threading import Thread, Timer
+from threading import Event, Thread, Timer
+from unittest.mock import patch
 
-from .lang_server import start_io_lang_server, start_tcp_lang_server, \
-    LanguageServer
+import torch
+
+from . import lang_model, shim
+from .lang_model.test_generate import patch_tiny_model
+from .lang_server import start_daemon_lang_server, start_io_lang_server, \
+    start_tcp_lang_server, LanguageServer, PREFETCH_DEBOUNCE_S, \
+    _bind_unix_server, _ForkingUnixStreamServer, _make_wrapper_class
 
 from jsonrpc.streams import JsonRpcStreamWriter, JsonRpcStreamReader
 
@@ -49,10 +56,55 @@ class TestLangServer(TestCase):
             cls.cwritef.close()
             cls.tmpdir.cleanup()
 
+    def setUp(self):
+        # Encoding needs the model files, so the tests pass text around.
+        def encode_context(text, context_tokens=None, offset=None, **_kwargs):
+            return text[:offset]
+
+        patcher = patch.object(lang_model, 'encode_context', encode_context)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def _read_response(self):
         raw_msg = self.reader._read_message()
         return json.loads(raw_msg.decode('utf-8'))
 
+    def _open_document(self, uri, text, initialization_options=None):
+        with patch.object(lang_model, 'initialize'):
+            self.writer.write({
+                'jsonrpc': '2.0',
+                'method': 'initialize',
+                'id': 'initialize_' + uri,
+                'params': {
+                    'rootUri': self.tmpdir.name,
+                    'initializationOptions': initialization_options
+                }
+            })
+            self._read_response()
+        self.writer.write({
+            'jsonrpc': '2.0',
+            'method': 'textDocument/didOpen',
+            'params': {
+                'textDocument': {'uri': uri, 'text': text, 'version': 1}
+            }
+        })
+
+    def _did_change(self, uri, text, character):
+        self.writer.write({
+            'jsonrpc': '2.0',
+            'method': 'textDocument/didChange',
+            'params': {
+                'textDocument': {'uri': uri, 'version': 2},
+                'contentChanges': [{
+                    'range': {
+                        'start': {'line': 0, 'character': character},
+                        'end': {'line': 0, 'character': character}
+                    },
+                    'text': text
+                }]
+            }
+        })
+
     def test_m_initialize(self):
         message = {
             'jsonrpc': '2.0',
@@ -86,3 +138,263 @@ class TestLangServer(TestCase):
         self.assertEqual(item['kind'], 1)
         self.assertIsInstance(item['label'], str)
 
+    def test_m_text_document__completion_partial_results(self):
+        uri = 'file:///partial.txt'
+        self._open_document(uri, 'Once upon a')
+
+        def generate(_text, callback=None, **_kwargs):
+            for continuation in ['time', 'time there', 'time there was']:
+                callback(continuation)
+            return continuation
+
+        message = {
+            'jsonrpc': '2.0',
+            'method': 'textDocument/completion',
+            'id': 'test_m_text_document__completion_partial_results',
+            'params': {
+                'textDocument': {'uri': uri},
+                'position': {'line': 0, 'character': 11},
+                'partialResultToken': 'partial_token'
+            }
+        }
+        with patch.object(lang_model, 'generate', generate):
+            self.writer.write(message)
+            responses = [self._read_response() for _ in range(4)]
+
+        labels = []
+        for notification in responses[:3]:
+            self.assertEqual(notification['method'], '$/progress')
+            self.assertEqual(notification['params']['token'], 'partial_token')
+            value = notification['params']['value']
+            self.assertTrue(value['isIncomplete'])
+            labels.append(value['items'][0]['label'])
+        self.assertEqual(labels, ['a time', 'a time there',
+                                  'a time there was'])
+
+        result = responses[3]['result']
+        self.assertFalse(result['isIncomplete'])
+        self.assertEqual(result['items'][0]['label'], 'a time there was')
+
+    def test_m_completion_item__resolve(self):
+        uri = 'file:///lazy.txt'
+        self._open_document(uri, 'Once upon a',
+                            initialization_options={'completionMode': 'lazy'})
+
+        def generate_state(_text, gen_len=None, **_kwargs):
+            return lang_model.GenerationState(None, [0] * gen_len,
+                                              ' '.join(['time'] * gen_len))
+
+        def resume(state, **_kwargs):
+            return lang_model.GenerationState(None, state.ids + [1],
+                                              state.text + ' there')
+
+        message = {
+            'jsonrpc': '2.0',
+            'method': 'textDocument/completion',
+            'id': 'test_m_completion_item__resolve_completion',
+            'params': {
+                'textDocument': {'uri': uri},
+                'position': {'line': 0, 'character': 11}
+            }
+        }
+        with patch.object(lang_model, 'generate_state', generate_state):
+            self.writer.write(message)
+            result = self._read_response()['result']
+        item = result['items'][0]
+        self.assertEqual(item['label'], 'a time time time')
+
+        message = {
+            'jsonrpc': '2.0',
+            'method': 'completionItem/resolve',
+            'id': 'test_m_completion_item__resolve',
+            'params': item
+        }
+        with patch.object(lang_model, 'resume', resume):
+            self.writer.write(message)
+            resolved = self._read_response()['result']
+        self.assertEqual(resolved['label'], item['label'])
+        self.assertEqual(resolved['insertText'], 'a time time time there')
+
+    def test_m_completion_item__resolve_resumes(self):
+        patch_tiny_model(self)
+        uri = 'file:///lazy_resume.txt'
+        self._open_document(uri, 'Once upon a',
+                            initialization_options={'completionMode': 'lazy'})
+
+        torch.manual_seed(1)
+        self.writer.write({
+            'jsonrpc': '2.0',
+            'method': 'textDocument/completion',
+            'id': 'test_m_completion_item__resolve_resumes_completion',
+            'params': {
+                'textDocument': {'uri': uri},
+                'position': {'line': 0, 'character': 11}
+            }
+        })
+        item = self._read_response()['result']['items'][0]
+        self.writer.write({
+            'jsonrpc': '2.0',
+            'method': 'completionItem/resolve',
+            'id': 'test_m_completion_item__resolve_resumes',
+            'params': item
+        })
+        resolved = self._read_response()['result']
+
+        # The preview and its extension are the continuation that generating
+        # the full length at once samples from the same seed.
+        torch.manual_seed(1)
+        state = lang_model.generate_state('Once upon a')
+        self.assertEqual(len(state.ids), lang_model.config.gen_len)
+        self.assertEqual(resolved['insertText'],
+                         LanguageServer._complete_text('a', state.text))
+
+    def test_m_text_document__completion_next_word(self):
+        uri = 'file:///next_word.txt'
+        self._open_document(uri, 'Once upon a',
+                            initialization_options={
+                                'completionMode': 'nextWord'
+                            })
+
+        def next_words(_text, **_kwargs):
+            return [('time', 0.5), ('day', 0.25), ('night', 0.125)]
+
+        message = {
+            'jsonrpc': '2.0',
+            'method': 'textDocument/completion',
+            'id': 'test_m_text_document__completion_next_word',
+            'params': {
+                'textDocument': {'uri': uri},
+                'position': {'line': 0, 'character': 11}
+            }
+        }
+        with patch.object(lang_model, 'next_words', next_words):
+            self.writer.write(message)
+            result = self._read_response()['result']
+        items = sorted(result['items'], key=lambda item: item['sortText'])
+        self.assertEqual([item['label'] for item in items],
+                         ['a time', 'a day', 'a night'])
+
+    def test_m_text_document__did_change_prefetch(self):
+        uri = 'file:///prefetch.txt'
+        self._open_document(uri, 'Once upon',
+                            initialization_options={'prefetch': True})
+        prefetched = Event()
+
+        def prefetch(text, **_kwargs):
+            prefetched.text = text
+            prefetched.set()
+
+        with patch.object(lang_model, 'prefetch', prefetch):
+            self._did_change(uri, ' a', 9)
+            self._did_change(uri, ' ', 11)
+            self.assertTrue(prefetched.wait(self.timeout_sec))
+        self.assertEqual(prefetched.text, 'Once upon a ')
+
+    def test_m_text_document__completion_cancels_prefetch(self):
+        uri = 'file:///prefetch_cancelled.txt'
+        self._open_document(uri, 'Once upon',
+                            initialization_options={'prefetch': True})
+        prefetched = Event()
+
+        def prefetch(_text, cancelled=None, **_kwargs):
+            if not cancelled.is_set():
+                prefetched.set()
+
+        with patch.object(lang_model, 'prefetch', prefetch), \
+                patch.object(lang_model, 'generate', lambda *_, **__: 'time'):
+            self._did_change(uri, ' a ', 9)
+            self.writer.write({
+                'jsonrpc': '2.0',
+                'method': 'textDocument/completion',
+                'id': 'test_m_text_document__completion_cancels_prefetch',
+                'params': {
+                    'textDocument': {'uri': uri},
+                    'position': {'line': 0, 'character': 12}
+                }
+            })
+            self._read_response()
+            self.assertFalse(prefetched.wait(PREFETCH_DEBOUNCE_S * 2))
+
+    def test_publish_diagnostics(self):
+        uri = 'file:///diagnostics.txt'
+
+        def word_log_probs(texts, **_kwargs):
+            return [[(0, 4, -1.), (5, 9, -20.)] for _ in texts]
+
+        with patch.object(lang_model, 'word_log_probs', word_log_probs):
+            self._open_document(uri, 'Once uopn',
+                                initialization_options={'diagnostics': True})
+            message = self._read_response()
+        self.assertEqual(message['method'], 'textDocument/publishDiagnostics')
+        self.assertEqual(message['params']['uri'], uri)
+        [diagnostic] = message['params']['diagnostics']
+        self.assertEqual(diagnostic['range']['start'],
+                         {'line': 0, 'character': 5})
+
+
+class _ForkedLanguageServer(LanguageServer):
+    def m_process(self, **_kwargs):
+        return {'pid': os.getpid(), 'threads': torch.get_num_threads()}
+
+
+class TestDaemonLangServer(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.socket_path = os.path.join(tmpdir.name, 'natls.sock')
+
+    def test_binds_before_loading(self):
+        def initialize():
+            # Clients can connect while the model loads.
+            self.assertTrue(shim.is_listening(self.socket_path))
+            raise RuntimeError('Loading failed')
+
+        with patch.object(lang_model, 'initialize', initialize), \
+                self.assertRaises(RuntimeError):
+            start_daemon_lang_server(self.socket_path, LanguageServer)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_concurrent_start(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(sock.close)
+        sock.bind(self.socket_path)
+        sock.listen(1)
+
+        # Another daemon binds the socket after the check for a listening
+        # one.
+        with patch.object(shim, 'remove_stale_socket', return_value=True), \
+                patch.object(lang_model, 'initialize') as initialize:
+            start_daemon_lang_server(self.socket_path, LanguageServer)
+        initialize.assert_not_called()
+        self.assertTrue(os.path.exists(self.socket_path))
+
+    def test_forking_server(self):
+        server = _bind_unix_server(self.socket_path, _ForkingUnixStreamServer,
+                                   _make_wrapper_class(_ForkedLanguageServer))
+        server_thread = Thread(target=server.serve_forever)
+        server_thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server_thread.join)
+        self.addCleanup(server.shutdown)
+
+        # Both clients are connected at the same time, so their sessions are
+        # served by two children.
+        clients = []
+        for i in range(2):
+            sock = shim.connect(self.socket_path)
+            self.addCleanup(sock.close)
+            writer = JsonRpcStreamWriter(sock.makefile('wb'))
+            reader = JsonRpcStreamReader(sock.makefile('rb'))
+            writer.write({'jsonrpc': '2.0', 'method': 'process', 'id': i})
+            clients.append((writer, reader))
+
+        processes = []
+        for writer, reader in clients:
+            processes.append(json.loads(
+                reader._read_message().decode('utf-8'))['result'])
+            writer.write({'jsonrpc': '2.0', 'method': 'exit'})
+        pids = {process['pid'] for process in processes}
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(os.getpid(), pids)
+        for process in processes:
+            self.assertEqual(process['threads'], torch.get_num_threads())
@@ -0,0 +1,78 @@
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from unittest import TestCase
+
+from . import shim
+
+
+class _EchoHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            self.wfile.write(line.upper())
+
+
+class TestShim(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.socket_path = os.path.join(tmp_dir.name, 'natls.sock')
+
+    def _serve(self):
+        server = socketserver.ThreadingUnixStreamServer(self.socket_path,
+                                                        _EchoHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_not_listening(self):
+        self.assertFalse(shim.is_listening(self.socket_path))
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+        self.assertTrue(os.path.exists(self.socket_path))
+        self.assertFalse(shim.is_listening(self.socket_path))
+
+    def test_remove_stale_socket(self):
+        self.assertTrue(shim.remove_stale_socket(self.socket_path))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+        self.assertTrue(shim.remove_stale_socket(self.socket_path))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+        self._serve()
+        self.assertFalse(shim.remove_stale_socket(self.socket_path))
+        self.assertTrue(os.path.exists(self.socket_path))
+
+    def test_listening(self):
+        self._serve()
+        self.assertTrue(shim.is_listening(self.socket_path))
+
+    def test_forward(self):
+        self._serve()
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        os.write(in_w, b'hello\nworld\n')
+        os.close(in_w)
+
+        sock = shim.connect_or_start_daemon(self.socket_path)
+        shim.forward(in_r, out_w, sock)
+        sock.close()
+        os.close(out_w)
+
+        with os.fdopen(out_r, 'rb') as f:
+            self.assertEqual(f.read(), b'HELLO\nWORLD\n')
+        os.close(in_r)
+
+    def test_not_a_socket(self):
+        with open(self.socket_path, 'w') as f:
+            f.write('notes')
+        with self.assertRaises(FileExistsError):
+            shim.remove_stale_socket(self.socket_path)
+        self.assertTrue(os.path.isfile(self.socket_path))
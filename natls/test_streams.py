@@ -0,0 +1,125 @@
+import io
+import json
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from jsonrpc import streams as jsonrpc_streams
+
+from . import streams
+from .streams import JsonRpcStreamReader, JsonRpcStreamWriter
+
+
+class _ChunkedReader(io.RawIOBase):
+    """Raw stream that returns at most `chunk_size` bytes per read."""
+
+    def __init__(self, data, chunk_size):
+        self._data = data
+        self._chunk_size = chunk_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._chunk_size, len(self._data))
+        b[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+
+def _frame(message, extra_header=b''):
+    body = json.dumps(message).encode('utf-8')
+    return (b'Content-Length: %d\r\n' % len(body)) + extra_header + \
+        b'\r\n' + body
+
+
+class TestJsonRpcStreamReader(TestCase):
+    messages = [
+        {'jsonrpc': '2.0', 'id': 1, 'method': 'a', 'params': {'x': 'é'}},
+        {'jsonrpc': '2.0', 'method': 'b', 'params': {'text': 'x' * 100000}},
+        {'jsonrpc': '2.0', 'id': 2, 'result': None},
+    ]
+
+    def _listen(self, data, chunk_size):
+        rfile = io.BufferedReader(_ChunkedReader(data, chunk_size))
+        received = []
+        JsonRpcStreamReader(rfile).listen(received.append)
+        return received
+
+    def test_messages(self):
+        data = b''.join(_frame(m) for m in self.messages)
+        for chunk_size in [1, 7, 1000, len(data)]:
+            self.assertEqual(self._listen(data, chunk_size), self.messages)
+
+    def test_extra_headers(self):
+        header = b'Content-Type: application/vscode-jsonrpc; charset=utf8\r\n'
+        data = b''.join(_frame(m, header) for m in self.messages)
+        self.assertEqual(self._listen(data, 100), self.messages)
+
+    def test_truncated(self):
+        data = _frame(self.messages[0]) + _frame(self.messages[1])[:-10]
+        self.assertEqual(self._listen(data, 100), self.messages[:1])
+
+    def test_invalid_json(self):
+        body = b'{"jsonrpc": '
+        data = b'Content-Length: %d\r\n\r\n' % len(body) + body + \
+            _frame(self.messages[0])
+        self.assertEqual(self._listen(data, 100), self.messages[:1])
+
+
+class TestJsonRpcStreamWriter(TestCase):
+    def _read_all(self, data):
+        received = []
+        reader = jsonrpc_streams.JsonRpcStreamReader(io.BytesIO(data))
+        reader.listen(received.append)
+        return received
+
+    def test_readable_by_jsonrpc(self):
+        wfile = io.BytesIO()
+        writer = JsonRpcStreamWriter(wfile)
+        messages = [{'jsonrpc': '2.0', 'id': i, 'result': 'é' * i}
+                    for i in range(3)]
+        for message in messages:
+            writer.write(message)
+        self.assertEqual(self._read_all(wfile.getvalue()), messages)
+
+    def test_concurrent_writes(self):
+        read_fd, write_fd = os.pipe()
+        writer = JsonRpcStreamWriter(os.fdopen(write_fd, 'wb'))
+
+        def write(thread_id):
+            for i in range(50):
+                writer.write({'thread': thread_id, 'i': i})
+
+        threads = [threading.Thread(target=write, args=(t,))
+                   for t in range(4)]
+        received = []
+        reader = threading.Thread(
+            target=JsonRpcStreamReader(os.fdopen(read_fd, 'rb')).listen,
+            args=(received.append,))
+        reader.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        reader.join()
+
+        self.assertEqual(len(received), 200)
+        for t in range(4):
+            self.assertEqual([m['i'] for m in received if m['thread'] == t],
+                             list(range(50)))
+
+
+class TestJson(TestCase):
+    def test_fallback(self):
+        self.assertEqual(json.loads(streams.dumps({1: 2 ** 70})),
+                         {'1': 2 ** 70})
+
+    def test_without_orjson(self):
+        with patch.object(streams, 'orjson', None):
+            data = streams.dumps({'a': ['é']})
+            self.assertEqual(streams.loads(data), {'a': ['é']})
+            with self.assertRaises(ValueError):
+                streams.loads(b'{')
@@ -28,8 +28,9 @@ SOFTWARE.
 
 import tempfile
 import os
+import time
 from pathlib import Path
-from unittest import TestCase
+from unittest import TestCase, mock
 
 from . import utils
 
@@ -53,3 +54,47 @@ class TestUtils(TestCase):
         # Invalid process id
         self.assertFalse(utils.is_process_alive(-1000))
 
+    def test_debounce(self):
+        interval = 0.1
+        obj = mock.Mock()
+
+        @utils.debounce(interval)
+        def call_m():
+            obj()
+
+        self.assertFalse(obj.called)
+
+        call_m()
+        call_m()
+        call_m()
+        self.assertFalse(obj.called)
+
+        time.sleep(interval * 2)
+        self.assertEqual(obj.call_count, 1)
+
+        call_m()
+        self.assertEqual(obj.call_count, 1)
+
+        time.sleep(interval * 2)
+        self.assertEqual(obj.call_count, 2)
+
+    def test_debounce_keyed_by(self):
+        interval = 0.1
+        obj = mock.Mock()
+
+        @utils.debounce(interval, keyed_by='key')
+        def call_m(key):
+            obj(key)
+
+        self.assertFalse(obj.called)
+
+        call_m(1)
+        call_m(2)
+        call_m(3)
+        call_m(1)
+        self.assertFalse(obj.called)
+
+        time.sleep(interval * 2)
+        obj.assert_has_calls([mock.call(1), mock.call(2), mock.call(3)],
+                             any_order=True)
+        self.assertEqual(obj.call_count, 3)
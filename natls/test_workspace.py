@@ -33,6 +33,7 @@ import os
 import tempfile
 import uuid
 from pathlib import Path
+from types import SimpleNamespace
 from unittest import TestCase
 from unittest.mock import MagicMock
 
@@ -172,6 +173,28 @@ class TestDocument(CommonSetup, TestCase):
             "o"
         ])
 
+    def test_tokens_before_end_is_cached(self):
+        encode_context = MagicMock(return_value=[1, 2])
+        tokenizer = SimpleNamespace(DocumentTokens=MagicMock,
+                                    encode_context=encode_context)
+        doc = Document('file:///uri', 'Once upon', tokenizer=tokenizer)
+        self.assertEqual(doc.tokens_before(None, 16), [1, 2])
+        self.assertEqual(doc.tokens_before(None, 16), [1, 2])
+        self.assertEqual(encode_context.call_count, 1)
+
+        doc.tokens_before(None, 8)
+        doc.apply_change({'text': ' a', 'range': {
+            'start': {'line': 0, 'character': 9},
+            'end': {'line': 0, 'character': 9}
+        }})
+        doc.tokens_before(None, 8)
+        self.assertEqual(encode_context.call_count, 3)
+
+    def test_tokens_before_without_tokenizer(self):
+        doc = Document('file:///uri', 'Once upon')
+        with self.assertRaises(ValueError):
+            doc.tokens_before()
+
 
 class TestWorkspace(CommonSetup, TestCase):
     def test_local(self):
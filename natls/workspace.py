@@ -41,9 +41,22 @@ RE_END_WORD = re.compile('^[A-Za-z_0-9]*')
 
 class Workspace:
 
-    def __init__(self, root_uri, endpoint):
+    M_PUBLISH_DIAGNOSTICS = 'textDocument/publishDiagnostics'
+
+    def __init__(self, root_uri, endpoint, tokenizer=None):
+        """Manage the documents of a workspace.
+
+        Arguments:
+            root_uri: The URI of the root of the workspace.
+            endpoint: The JSON RPC endpoint of the language server.
+            tokenizer: Object with a `DocumentTokens` class and an
+                `encode_context` function like `lang_model`, which documents
+                use to encode the context before positions. It is passed in,
+                so that this module doesn't import the model.
+        """
         self._root_uri = root_uri
         self._endpoint = endpoint
+        self._tokenizer = tokenizer
         self._root_uri_scheme = uris.urlparse(self._root_uri)[0]
         self._root_path = uris.to_fs_path(self._root_uri)
         self._docs = {}
@@ -81,6 +94,11 @@ class Workspace:
         self._docs[doc_uri].apply_change(change)
         self._docs[doc_uri].version = version
 
+    def publish_diagnostics(self, doc_uri, diagnostics):
+        self._endpoint.notify(self.M_PUBLISH_DIAGNOSTICS,
+                              params={'uri': doc_uri,
+                                      'diagnostics': diagnostics})
+
     def apply_edit(self, edit):
         return self._endpoint.request(self.M_APPLY_EDIT, {'edit': edit})
 
@@ -93,14 +111,15 @@ class Workspace:
         path = uris.to_fs_path(doc_uri)
         return Document(
             doc_uri, source=source, version=version,
-            extra_sys_path=self.source_roots(path)
+            extra_sys_path=self.source_roots(path),
+            tokenizer=self._tokenizer
         )
 
 
 class Document:
 
     def __init__(self, uri, source=None, version=None, local=True,
-                 extra_sys_path=None):
+                 extra_sys_path=None, tokenizer=None):
         self.uri = uri
         self.version = version
         self.path = uris.to_fs_path(uri)
@@ -109,10 +128,21 @@ class Document:
         self._local = local
         self._source = source
         self._extra_sys_path = extra_sys_path or []
+        # See `Workspace`.
+        self._tokenizer = tokenizer
+        self._tokens = self._new_tokens()
+        # The last result of tokens_before at the end of the document, as a
+        # (source, context_tokens, tokens) tuple.
+        self._tail_tokens = None
 
     def __str__(self):
         return str(self.uri)
 
+    def _new_tokens(self):
+        if self._tokenizer is None:
+            return None
+        return self._tokenizer.DocumentTokens()
+
     @property
     def lines(self):
         return self.source.splitlines(True)
@@ -132,6 +162,7 @@ class Document:
         if not change_range:
             # The whole file has changed
             self._source = text
+            self._tokens = self._new_tokens()
             return
 
         start_line = change_range['start']['line']
@@ -141,9 +172,17 @@ class Document:
 
         # Check for an edit occuring at the very end of the file
         if start_line == len(self.lines):
+            end = len(self.source)
+            if self._tokens is not None:
+                self._tokens.apply_change(end, end, len(text))
             self._source = self.source + text
             return
 
+        if self._tokens is not None:
+            self._tokens.apply_change(
+                self.offset_at_position(change_range['start']),
+                self.offset_at_position(change_range['end']), len(text))
+
         new = io.StringIO()
 
         # Iterate over the existing document until we hit the edit range,
@@ -206,3 +245,43 @@ class Document:
         start = max(0, offset - n_chars)
         return self.source[start:offset]
 
+    def tokens_before(self, position=None, context_tokens=None):
+        """Return the token ids of the context before a position.
+
+        Tokens of sentences that haven't changed since the last call are
+        reused, so only the sentences touched by edits are encoded again. The
+        tokens at the end of a document that hasn't changed are returned from
+        the last call without assembling them again.
+
+        Arguments:
+            position: A position dict with keys "line" and "character".
+                Defaults to the end of the document.
+            context_tokens: The token budget. Defaults to the one of the
+                language model.
+
+        Returns: A list of token ids.
+
+        Raises: ValueError if the document has no tokenizer.
+
+        """
+        if self._tokenizer is None:
+            raise ValueError('{} has no tokenizer'.format(self.uri))
+        source = self.source
+        if position is not None:
+            return self._tokenizer.encode_context(
+                source, context_tokens,
+                offset=self.offset_at_position(position),
+                document_tokens=self._tokens)
+
+        # Every edit replaces the source string, so its identity tells whether
+        # the document changed.
+        if self._tail_tokens is not None and \
+                self._tail_tokens[0] is source and \
+                self._tail_tokens[1] == context_tokens:
+            return list(self._tail_tokens[2])
+        tokens = self._tokenizer.encode_context(source, context_tokens,
+                                                offset=len(source),
+                                                document_tokens=self._tokens)
+        self._tail_tokens = (source, context_tokens, tokens)
+        return list(tokens)
+
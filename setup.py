@@ -20,10 +20,15 @@ setuptools.setup(
         'ftfy==5.5.0',
         'numpy==1.15.4',
         'python-jsonrpc-server==0.0.2',
-        'spacy==2.0.18',
-        'pip @ https://github.com/explosion/spacy-models/releases/download/en_core_web_sm-2.0.0/en_core_web_sm-2.0.0.tar.gz#en_core_web_sm-2.0.0',
         'torch==1.0.0'
     ],
+    extras_require={
+        'orjson': ['orjson'],
+        'spacy': [
+            'spacy==2.0.18',
+            'pip @ https://github.com/explosion/spacy-models/releases/download/en_core_web_sm-2.0.0/en_core_web_sm-2.0.0.tar.gz#en_core_web_sm-2.0.0'
+        ]
+    },
     entry_points={
         'console_scripts': ['natls = natls.__main__:main']
     },